@@ -0,0 +1,8 @@
+"""
+Бенчмарки log_analyzer: генератор синтетических log-файлов ui_short
+(generator), общий стенд измерения стадий обработки (harness) и отдельные
+сравнения реализаций (bench_*). Скрипты запускаются из директории
+Advanced_basics_1, например:
+
+    python3 benchmarks/harness.py --lines 1000000,10000000 --output results.json
+"""
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Пропускная способность чтения log-файла для каждого способа сжатия:
+построчное чтение в текстовом режиме (как было раньше), блочное чтение
+строк bytes функцией read_lines, чтение функцией read_log (для plain
+log-файла - через отображение в память) и полный разбор функцией parser.
+Для read_log также измеряется пик памяти, выделенной при чтении (tracemalloc).
+
+    python3 benchmarks/bench_input.py --lines 500000
+"""
+
+import os
+import io
+import sys
+import bz2
+import gzip
+import lzma
+import time
+import shutil
+import tracemalloc
+import tempfile
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from log_analyzer import open_log, read_lines, read_log, parser, ENCODING
+from generator import generate_lines
+
+
+CODECS = (('plain', open), ('gz', gzip.open), ('bz2', bz2.open), ('xz', lzma.open))
+
+
+def measure(func):
+    start = time.perf_counter()
+    count = sum(1 for _ in func())
+    return count, time.perf_counter() - start
+
+
+def measure_peak(func):
+    """Пик памяти в байтах, выделенной при переборе func() без хранения строк"""
+    tracemalloc.start()
+    try:
+        for _ in func():
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def read_text_lines(path):
+    with open_log(path) as input_file:
+        yield from io.TextIOWrapper(input_file, encoding=ENCODING)
+
+
+def read_byte_lines(path, external=False):
+    with open_log(path, external) as input_file:
+        yield from read_lines(input_file)
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--lines", action="store", type=int, default=500000)
+    (opts, args) = op.parse_args()
+    text = ''.join(generate_lines(opts.lines, urls=100000, skew=0.0)).encode(ENCODING)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print('{:<12} {:>10} {:>14} {:>14} {:>14} {:>14} {:>12}'.format(
+            'codec', 'file MB', 'text lines/s', 'bytes lines/s', 'log lines/s', 'parse lines/s', 'log peak KB'))
+        for extension, opener in CODECS:
+            path = os.path.join(tmp_dir, 'nginx-access-ui.log-20170630.' + extension)
+            with opener(path, 'wb') as f:
+                f.write(text)
+            variants = [('', False)]
+            if extension == 'gz' and shutil.which('pigz'):
+                variants.append((' (pigz)', True))
+            for suffix, external in variants:
+                lines, text_time = measure(lambda: read_text_lines(path))
+                _, bytes_time = measure(lambda: read_byte_lines(path, external))
+                _, log_time = measure(lambda: read_log(path, external))
+                _, parse_time = measure(lambda: parser(path, external=external))
+                peak = measure_peak(lambda: read_log(path, external))
+                print('{:<12} {:>10.1f} {:>14,.0f} {:>14,.0f} {:>14,.0f} {:>14,.0f} {:>12,.0f}'.format(
+                    extension + suffix, os.path.getsize(path) / 2 ** 20,
+                    lines / text_time, lines / bytes_time, lines / log_time, lines / parse_time, peak / 1024))
+    finally:
+        shutil.rmtree(tmp_dir)
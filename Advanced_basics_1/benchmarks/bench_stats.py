@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение get_stats с исходной реализацией на полной сортировке на словаре
+времен запросов с большим числом различных URL.
+
+    python3 benchmarks/bench_stats.py --urls 1000000 --size 1000
+"""
+
+import os
+import sys
+import time
+import random
+import operator
+from array import array
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from log_analyzer import get_stats
+
+
+def sorting_get_stats(time_dict, size):
+    time_sum = dict()
+    all_time = 0.0
+    N = 0
+    for url in time_dict.keys():
+        time_sum[url] = sum(time_dict[url])
+        all_time += time_sum[url]
+        N += len(time_dict[url])
+    time_sorted = sorted(time_sum.items(), key=operator.itemgetter(1), reverse=True)
+    out_list = list()
+    for url, sum_value in time_sorted[:size]:
+        n = len(time_dict[url])
+        temp = sorted(time_dict[url])
+        out_list.append({'count': n,
+                        'time_avg': sum_value/n,
+                        'time_max': max(time_dict[url]),
+                        'time_sum': sum_value,
+                        'url': url,
+                        'time_med': (sum(temp[n//2-1:n//2+1])/2.0, temp[n//2])[n % 2] if n else None,
+                        'time_perc': sum_value/all_time,
+                        'count_perc': n/N
+                        })
+    return out_list
+
+
+def make_time_dict(urls, hot_urls, hot_count, seed=0):
+    """urls различных URL, из них hot_urls с hot_count запросами, остальные с одним"""
+    rnd = random.Random(seed)
+    time_dict = dict()
+    for i in range(urls):
+        count = hot_count if i < hot_urls else 1
+        time_dict['/api/v2/banner/{}'.format(rnd.getrandbits(40))] = array('d', (rnd.random() for _ in range(count)))
+    return time_dict
+
+
+def measure(func, time_dict, size):
+    start = time.perf_counter()
+    result = func(time_dict, size)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-u", "--urls", action="store", type=int, default=1000000)
+    op.add_option("-s", "--size", action="store", type=int, default=1000)
+    op.add_option("--hot-urls", action="store", type=int, default=1000)
+    op.add_option("--hot-count", action="store", type=int, default=2000)
+    (opts, args) = op.parse_args()
+    time_dict = make_time_dict(opts.urls, opts.hot_urls, opts.hot_count)
+    sorting_time, expected = measure(sorting_get_stats, time_dict, opts.size)
+    selection_time, result = measure(get_stats, time_dict, opts.size)
+    assert result == expected
+    print('urls: {:,}, requests: {:,}'.format(len(time_dict), sum(map(len, time_dict.values()))))
+    print('full sort:  {:>8.3f} s'.format(sorting_time))
+    print('selection:  {:>8.3f} s'.format(selection_time))
+    print('speedup:    {:>8.2f}x'.format(sorting_time / selection_time))
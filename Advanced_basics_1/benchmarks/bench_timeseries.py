@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Накладные расходы агрегации по интервалам времени: разбор и агрегация строк
+без временных рядов и с ними (по минутам и по часам) в точном режиме
+и в режиме "sketch". Временные ряды создаются так же, как в main, по
+параметрам конфигурации. В точном режиме на строку добавляется номер интервала
+в массив URL, в режиме "sketch" обновляется скетч пары (URL, интервал).
+
+    python3 benchmarks/bench_timeseries.py --lines 500000
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from log_analyzer import aggregate, parse_lines, get_sketch_accuracy, get_time_series, ENCODING
+from generator import generate_lines
+
+
+def measure(lines, config):
+    """Время агрегации lines с параметрами config и число интервалов во временных рядах"""
+    series = get_time_series(config)
+    start = time.perf_counter()
+    aggregate(parse_lines(lines, with_time=series is not None), get_sketch_accuracy(config), series=series)
+    seconds = time.perf_counter() - start
+    return seconds, len(series.keys) if series is not None else 0
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--lines", action="store", type=int, default=500000)
+    op.add_option("-u", "--urls", action="store", type=int, default=1000)
+    op.add_option("-r", "--repeat", action="store", type=int, default=3)
+    (opts, args) = op.parse_args()
+    lines = [line.encode(ENCODING) for line in generate_lines(opts.lines, urls=opts.urls)]
+    for aggregation in ('exact', 'sketch'):
+        plain = min(measure(lines, {'AGGREGATION': aggregation}) for _ in range(opts.repeat))[0]
+        print('{:<15} {:>8.3f} s'.format(aggregation + ':', plain))
+        for unit in ('hour', 'minute'):
+            config = {'AGGREGATION': aggregation, 'TIME_BUCKET': unit}
+            seconds, buckets = min(measure(lines, config) for _ in range(opts.repeat))
+            print('{:<15} {:>8.3f} s  +{:.1f}%  {} интервалов'.format(aggregation + ' ' + unit + ':', seconds,
+                                                                   (seconds / plain - 1) * 100, buckets))
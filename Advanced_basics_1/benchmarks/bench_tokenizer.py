@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение скорости разбора строк ui_short регулярным выражением
+RE_ROW_TEMPLATE и быстрым токенизатором tokenize.
+
+    python3 benchmarks/bench_tokenizer.py --lines 200000
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from log_analyzer import parse_lines
+from generator import generate_lines
+
+
+def make_lines(count, bad_ratio, seed=0):
+    return list(generate_lines(count, urls=100000, skew=0.0, bad_ratio=bad_ratio, seed=seed))
+
+
+def measure(lines, fast):
+    start = time.perf_counter()
+    good = sum(1 for entry in parse_lines(lines, fast=fast) if entry)
+    return len(lines) / (time.perf_counter() - start), good
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--lines", action="store", type=int, default=200000)
+    op.add_option("-b", "--bad-ratio", action="store", type=float, default=0.01)
+    (opts, args) = op.parse_args()
+    lines = make_lines(opts.lines, opts.bad_ratio)
+    regex_speed, regex_good = measure(lines, fast=False)
+    fast_speed, fast_good = measure(lines, fast=True)
+    assert regex_good == fast_good
+    print('regex:     {:>12,.0f} lines/sec'.format(regex_speed))
+    print('tokenizer: {:>12,.0f} lines/sec'.format(fast_speed))
+    print('speedup:   {:>12.2f}x'.format(fast_speed / regex_speed))
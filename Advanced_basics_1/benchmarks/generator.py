@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Детерминированный генератор синтетических nginx log-файлов в формате ui_short.
+При одинаковых параметрах и seed генерируется одно и то же содержимое.
+
+    python3 benchmarks/generator.py --lines 1000000 --urls 100000 --skew 1.1 --gzip out_dir
+"""
+
+import os
+import gzip
+import random
+import itertools
+from optparse import OptionParser
+
+
+LINE = ('{ip} -  - [29/Jun/2017:{hour:02d}:{minute:02d}:{second:02d} +0300] "{method} {url} HTTP/1.1" {status} {size} "-" '
+        '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+        '"1498697422-2190034393-4708-9752759" "dc7161be3" {time:.3f}\n')
+URL_TEMPLATES = ('/api/v2/banner/{}', '/api/v2/slot/{}/groups', '/api/1/campaigns/?id={}', '/export/{:x}/file')
+METHODS = ('GET', 'GET', 'GET', 'POST')
+STATUSES = (200, 200, 200, 200, 302, 404, 500)
+CHUNK_SIZE = 10000
+
+
+def get_url(rank):
+    """URL с номером rank, шаблоны чередуются по номеру"""
+    return URL_TEMPLATES[rank % len(URL_TEMPLATES)].format(rank)
+
+
+def get_cum_weights(urls, skew):
+    """Накопленные веса распределения Ципфа с показателем skew (0 - равномерное)"""
+    return list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(urls)))
+
+
+def generate_lines(count, urls=10000, skew=1.0, bad_ratio=0.01, seed=0):
+    """
+    Генератор count строк log-файла. URL выбираются из urls различных значений
+    по распределению Ципфа с показателем skew, доля bad_ratio строк не
+    соответствует формату. Строки генерируются пачками по CHUNK_SIZE.
+    """
+
+    rnd = random.Random(seed)
+    population = range(urls)
+    cum_weights = get_cum_weights(urls, skew)
+    produced = 0
+    while produced < count:
+        size = min(CHUNK_SIZE, count - produced)
+        for rank in rnd.choices(population, cum_weights=cum_weights, k=size):
+            if rnd.random() < bad_ratio:
+                yield 'garbage line {}\n'.format(produced)
+            else:
+                seconds = produced * 86400 // count
+                yield LINE.format(ip='{}.{}.{}.{}'.format(*rnd.getrandbits(32).to_bytes(4, 'big')),
+                                  hour=seconds // 3600, minute=seconds // 60 % 60, second=seconds % 60,
+                                  method=METHODS[rank % len(METHODS)], url=get_url(rank),
+                                  status=STATUSES[rank % len(STATUSES)], size=rnd.randint(1, 100000),
+                                  time=rnd.lognormvariate(-1.5, 1.0))
+            produced += 1
+
+
+def write_log(path, count, urls=10000, skew=1.0, bad_ratio=0.01, seed=0, compress=False):
+    """Записывает сгенерированный log-файл в path, при compress - сжатым gzip"""
+    with (gzip.open(path, 'wb', compresslevel=1) if compress else open(path, 'wb')) as log_file:
+        chunk = []
+        for line in generate_lines(count, urls, skew, bad_ratio, seed):
+            chunk.append(line)
+            if len(chunk) >= CHUNK_SIZE:
+                log_file.write(''.join(chunk).encode('utf-8'))
+                chunk = []
+        log_file.write(''.join(chunk).encode('utf-8'))
+    return path
+
+
+def get_log_name(count, urls, skew, bad_ratio, seed, compress):
+    """Имя файла, однозначно определяемое параметрами генерации"""
+    return 'nginx-access-ui.log-20170629-{}-{}-{}-{}-{}.{}'.format(count, urls, skew, bad_ratio, seed,
+                                                                   'gz' if compress else 'plain')
+
+
+def ensure_log(directory, count, urls=10000, skew=1.0, bad_ratio=0.01, seed=0, compress=False):
+    """Путь к log-файлу с заданными параметрами в directory, файл создается при отсутствии"""
+    path = os.path.join(directory, get_log_name(count, urls, skew, bad_ratio, seed, compress))
+    if not os.path.isfile(path):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        write_log(path + '.tmp', count, urls, skew, bad_ratio, seed, compress)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage='%prog [options] output_dir')
+    op.add_option("-n", "--lines", action="store", type=int, default=1000000)
+    op.add_option("-u", "--urls", action="store", type=int, default=10000)
+    op.add_option("-s", "--skew", action="store", type=float, default=1.0)
+    op.add_option("-b", "--bad-ratio", action="store", type=float, default=0.01)
+    op.add_option("--seed", action="store", type=int, default=0)
+    op.add_option("--gzip", action="store_true", default=False)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error('не указана выходная директория')
+    print(ensure_log(args[0], opts.lines, opts.urls, opts.skew, opts.bad_ratio, opts.seed, opts.gzip))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Стенд измерения производительности log_analyzer. Для каждого размера
+log-файла из --lines генерируется (или берется из --data-dir) синтетический
+log-файл, и в отдельном процессе по очереди выполняются стадии обработки:
+
+    read       чтение строк read_lines
+    parse      разбор строк parser
+    aggregate  полный разбор и агрегация get_request_times_from_log
+    stats      расчет таблицы отчета get_stats
+    report     запись отчета create_report
+
+Для каждого запуска выводятся время стадий, скорость агрегации в строках
+в секунду и пиковый объем резидентной памяти процесса (и его
+процессов-исполнителей при --workers > 1). Результаты сохраняются в json
+(--output) и могут сравниваться с предыдущим прогоном (--compare).
+
+    python3 benchmarks/harness.py --lines 1000000,10000000,50000000 --output results.json
+    python3 benchmarks/harness.py --lines 1000000 --compare results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from generator import ensure_log
+from log_analyzer import read_log, parser, get_request_times_from_log, get_stats, create_report
+
+
+STAGES = ('read', 'parse', 'aggregate', 'stats', 'report')
+RESULTS_VERSION = 1
+
+
+def get_peak_rss():
+    """Пиковый объем резидентной памяти в Кбайт процесса и завершенных дочерних процессов"""
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def run_stages(path, stages, workers=1, report_size=1000):
+    """Выполняет стадии stages над log-файлом path, возвращает словарь измерений"""
+    timings = dict()
+    lines = None
+    time_dict = out_list = None
+    if 'read' in stages:
+        start = time.perf_counter()
+        lines = sum(1 for _ in read_log(path))
+        timings['read'] = time.perf_counter() - start
+    if 'parse' in stages:
+        start = time.perf_counter()
+        lines = sum(1 for _ in parser(path))
+        timings['parse'] = time.perf_counter() - start
+    if {'aggregate', 'stats', 'report'} & set(stages):
+        start = time.perf_counter()
+        time_dict, good_count, bad_count = get_request_times_from_log(path, workers)
+        timings['aggregate'] = time.perf_counter() - start
+        lines = good_count + bad_count
+    if {'stats', 'report'} & set(stages):
+        start = time.perf_counter()
+        out_list = get_stats(time_dict, report_size)
+        timings['stats'] = time.perf_counter() - start
+    if 'report' in stages:
+        report_dir = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            create_report(out_list, os.path.join(report_dir, 'report.html'))
+            timings['report'] = time.perf_counter() - start
+        finally:
+            shutil.rmtree(report_dir)
+    rss, children_rss = get_peak_rss()
+    main_stage = 'aggregate' if 'aggregate' in timings else stages[-1]
+    return {'lines': lines,
+            'urls': len(time_dict) if time_dict is not None else None,
+            'stages': timings,
+            'lines_per_sec': lines / timings[main_stage] if lines and timings.get(main_stage) else None,
+            'peak_rss_kb': rss,
+            'peak_children_rss_kb': children_rss}
+
+
+def put_result(queue, args):
+    queue.put(run_stages(*args))
+
+
+def run_isolated(*args):
+    """
+    run_stages в отдельном процессе, чтобы пиковая память не накапливалась
+    между запусками. Процесс не демонический, поэтому сам может запускать
+    процессы-исполнители.
+    """
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=put_result, args=(queue, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def compare(runs, previous):
+    """Строки сравнения времени стадий с предыдущими результатами previous"""
+    previous_runs = {(run['params']['lines'], run['params']['gzip']): run for run in previous['runs']}
+    output = []
+    for run in runs:
+        old = previous_runs.get((run['params']['lines'], run['params']['gzip']))
+        if old is None or old['params'] != run['params']:
+            continue
+        for stage, seconds in run['stages'].items():
+            if old['stages'].get(stage):
+                output.append('{:>12,} {:<10} {:>10.3f} s {:>10.3f} s {:>8.2f}x'.format(
+                    run['params']['lines'], stage, old['stages'][stage], seconds, old['stages'][stage] / seconds))
+    return output
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--lines", action="store", default="1000000,10000000,50000000",
+                  help="размеры log-файлов через запятую")
+    op.add_option("-u", "--urls", action="store", type=int, default=100000)
+    op.add_option("-s", "--skew", action="store", type=float, default=1.1)
+    op.add_option("-b", "--bad-ratio", action="store", type=float, default=0.01)
+    op.add_option("--seed", action="store", type=int, default=0)
+    op.add_option("--gzip", action="store_true", default=False)
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("--report-size", action="store", type=int, default=1000)
+    op.add_option("--stages", action="store", default=','.join(STAGES))
+    op.add_option("--data-dir", action="store", default=None,
+                  help="директория для сгенерированных log-файлов (по умолчанию временная)")
+    op.add_option("-o", "--output", action="store", default=None)
+    op.add_option("--compare", action="store", default=None)
+    (opts, args) = op.parse_args()
+
+    stages = [stage for stage in opts.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        op.error('неизвестные стадии: {}'.format(', '.join(sorted(unknown))))
+    os.chdir(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+    data_dir = opts.data_dir or tempfile.mkdtemp()
+    runs = []
+    try:
+        for count in [int(value) for value in opts.lines.split(',')]:
+            params = {'lines': count, 'urls': opts.urls, 'skew': opts.skew, 'bad_ratio': opts.bad_ratio,
+                      'seed': opts.seed, 'gzip': opts.gzip, 'workers': opts.workers, 'report_size': opts.report_size}
+            start = time.perf_counter()
+            path = ensure_log(data_dir, count, opts.urls, opts.skew, opts.bad_ratio, opts.seed, opts.gzip)
+            print('{:,} lines: log file {} ({:.1f} MB, {:.1f} s)'.format(
+                count, path, os.path.getsize(path) / 2 ** 20, time.perf_counter() - start))
+            run = run_isolated(path, stages, opts.workers, opts.report_size)
+            run['params'] = params
+            run['file_bytes'] = os.path.getsize(path)
+            runs.append(run)
+            for stage, seconds in run['stages'].items():
+                print('    {:<10} {:>10.3f} s'.format(stage, seconds))
+            print('    {:<10} {:>10,.0f} lines/s'.format('speed', run['lines_per_sec'] or 0))
+            print('    {:<10} {:>10,} KB (workers {:,} KB)'.format('peak rss', run['peak_rss_kb'],
+                                                                  run['peak_children_rss_kb']))
+    finally:
+        if opts.data_dir is None:
+            shutil.rmtree(data_dir)
+
+    results = {'version': RESULTS_VERSION,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpu_count': os.cpu_count(),
+               'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'runs': runs}
+    if opts.output:
+        with open(opts.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print('Результаты сохранены в файл {}'.format(opts.output))
+    if opts.compare:
+        with open(opts.compare) as previous_file:
+            lines = compare(runs, json.load(previous_file))
+        print('{:>12} {:<10} {:>12} {:>12} {:>9}'.format('lines', 'stage', 'previous', 'current', 'speedup'))
+        print('\n'.join(lines))
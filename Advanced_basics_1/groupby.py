@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Группировка запросов по произвольному набору полей строки лога
+(например, по URL и статусу ответа) за тот же проход по log-файлу,
+что и основная агрегация по URL.
+"""
+
+import heapq
+
+
+# Поля, по которым можно группировать: имя в спецификации -> имя поля
+# в словаре разобранной строки
+GROUP_FIELDS = {
+    'url': 'request_url',
+    'status': 'status',
+    'request_type': 'request_type',
+    'remote_addr': 'remote_addr',
+    'http_referer': 'http_referer',
+    'http_user_agent': 'http_user_agent'
+}
+BYTES_FIELD = 'body_bytes_sent'
+
+
+class GroupBy:
+    """
+    Агрегаты по группам запросов с одинаковыми значениями полей keys:
+    количество запросов, сумма и максимум времени обработки и сумма
+    переданных байт. Для каждой группы хранится список из четырех чисел,
+    поэтому объем памяти определяется только числом различных групп.
+    """
+
+    def __init__(self, keys):
+        keys = list(keys)
+        unknown = [key for key in keys if key not in GROUP_FIELDS]
+        if not keys or unknown:
+            raise ValueError('Некорректные поля группировки {}, допустимые значения: {}'.format(
+                keys, ', '.join(GROUP_FIELDS)))
+        self.keys = keys
+        self.groups = dict()
+        self._fields = [GROUP_FIELDS[key] for key in keys]
+
+    @property
+    def name(self):
+        """Имя группировки для имени файла отчета: поля через дефис"""
+        return '-'.join(self.keys)
+
+    @property
+    def fields(self):
+        """Поля разобранной строки, кроме request_url, нужные для группировки"""
+        return {field for field in self._fields if field != 'request_url'} | {BYTES_FIELD}
+
+    def add(self, entry, url, request_time):
+        """
+        Добавляет запрос entry (словарь разобранной строки) со временем
+        обработки request_time; вместо request_url используется url
+        (шаблон URL при нормализации).
+        """
+
+        key = tuple(url if field == 'request_url' else entry[field] for field in self._fields)
+        body_bytes = int(entry[BYTES_FIELD])
+        values = self.groups.get(key)
+        if values is None:
+            self.groups[key] = [1, request_time, request_time, body_bytes]
+            return
+        values[0] += 1
+        values[1] += request_time
+        if request_time > values[2]:
+            values[2] = request_time
+        values[3] += body_bytes
+
+    def merge(self, other):
+        for key, other_values in other.groups.items():
+            values = self.groups.get(key)
+            if values is None:
+                self.groups[key] = list(other_values)
+                continue
+            values[0] += other_values[0]
+            values[1] += other_values[1]
+            values[2] = max(values[2], other_values[2])
+            values[3] += other_values[3]
+        return self
+
+    def to_dict(self):
+        return {'keys': self.keys, 'groups': [list(key) + values for key, values in self.groups.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['keys'])
+        size = len(result.keys)
+        result.groups = {tuple(row[:size]): row[size:] for row in data['groups']}
+        return result
+
+    def get_rows(self, size):
+        """Строки таблицы отчета для size групп с наибольшим суммарным временем"""
+        all_count = sum(values[0] for values in self.groups.values())
+        all_time = sum(values[1] for values in self.groups.values())
+        rows = []
+        for key, (count, time_sum, time_max, bytes_sum) in heapq.nlargest(
+                size, self.groups.items(), key=lambda item: item[1][1]):
+            row = dict(zip(self.keys, key))
+            row.update({'count': count,
+                        'count_perc': count / all_count,
+                        'time_sum': time_sum,
+                        'time_avg': time_sum / count,
+                        'time_max': time_max,
+                        'time_perc': time_sum / all_time if all_time else 0.0,
+                        'bytes_sum': bytes_sum,
+                        'bytes_avg': bytes_sum / count})
+            rows.append(row)
+        return rows
+
+
+def get_fields(groups):
+    """Объединение полей разобранной строки, нужных группировкам groups"""
+    fields = set()
+    for group in groups or ():
+        fields |= group.fields
+    return tuple(sorted(fields))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Слежение за дописываемым log-файлом и скользящие окна агрегатов по URL
+для режима WATCH.
+"""
+
+import os
+import time
+
+from sketches import QuantileSketch
+from timeseries import UNITS, parse_prefix
+
+
+BLOCK_SIZE = 1 << 18
+ROTATE_GRACE = 30
+
+
+class LogFile:
+    """Открытый log-файл: его устройство и inode, позиция чтения и недописанная последняя строка"""
+
+    def __init__(self, file, seek_end=False):
+        self.file = file
+        stat = os.fstat(file.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.position = stat.st_size if seek_end else 0
+        file.seek(self.position)
+        self.tail = b''
+
+    def read_available(self, block_size):
+        while True:
+            block = self.file.read(block_size)
+            if not block:
+                return
+            self.position += len(block)
+            cut = block.rfind(b'\n') + 1
+            if not cut:
+                self.tail += block
+                continue
+            lines = (self.tail + block[:cut]).splitlines()
+            self.tail = block[cut:]
+            yield from lines
+
+    def rewind(self):
+        self.file.seek(0)
+        self.position = 0
+        self.tail = b''
+
+    def flush_tail(self):
+        tail, self.tail = self.tail, b''
+        return tail.splitlines()
+
+    def close(self):
+        self.file.close()
+
+
+class LogFollower:
+    """
+    Чтение дописываемого log-файла path (как tail -F). Каждый вызов read_lines
+    выдает полные строки, дописанные с прошлого вызова; недописанная последняя
+    строка откладывается до следующего вызова. Ротация определяется по смене
+    устройства и inode файла path: чтение продолжается с начала нового файла,
+    а старый остается открытым, потому что nginx пишет в переименованный файл
+    до сигнала USR1. Старый файл дочитывается при каждом вызове и закрывается,
+    когда не растет grace секунд по часам clock. Если файл стал короче
+    прочитанной позиции (copytruncate), он читается с начала. При from_end=True
+    уже записанная на момент первого открытия часть файла пропускается.
+    """
+
+    def __init__(self, path, from_end=False, block_size=BLOCK_SIZE, grace=ROTATE_GRACE, clock=time.monotonic):
+        self.path = path
+        self.from_end = from_end
+        self.block_size = block_size
+        self.grace = grace
+        self.clock = clock
+        self.current = None
+        self.rotated = None
+        self.rotated_changed = None
+        self.rotations = 0
+
+    def _open(self):
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+        log_file = LogFile(file, self.from_end)
+        self.from_end = False
+        return log_file
+
+    def _close_rotated(self):
+        yield from self.rotated.flush_tail()
+        self.rotated.close()
+        self.rotated = None
+
+    def _drain_rotated(self):
+        position = self.rotated.position
+        yield from self.rotated.read_available(self.block_size)
+        now = self.clock()
+        if self.rotated.position != position:
+            self.rotated_changed = now
+        elif now - self.rotated_changed >= self.grace:
+            yield from self._close_rotated()
+
+    def read_lines(self):
+        """Генератор новых полных строк bytes без символов перевода строки"""
+        if self.rotated is not None:
+            yield from self._drain_rotated()
+        if self.current is None:
+            self.current = self._open()
+            if self.current is None:
+                return
+        yield from self.current.read_available(self.block_size)
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_dev, stat.st_ino) != self.current.identity:
+            if self.rotated is not None:
+                yield from self._close_rotated()
+            self.rotated, self.rotated_changed = self.current, self.clock()
+            self.rotations += 1
+            self.current = self._open()
+            if self.current is not None:
+                yield from self.current.read_available(self.block_size)
+        elif stat.st_size < self.current.position:
+            self.current.rewind()
+            yield from self.current.read_available(self.block_size)
+
+    def close(self):
+        for log_file in (self.current, self.rotated):
+            if log_file is not None:
+                log_file.close()
+        self.current = self.rotated = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SlidingWindows:
+    """
+    Скользящие окна агрегатов по URL за последние windows секунд. Времена
+    запросов раскладываются по корзинам длиной в минуту поля time_local,
+    в каждой корзине для каждого URL хранится скетч QuantileSketch
+    ограниченного размера. Хранятся только корзины, попадающие в самое
+    длинное окно, поэтому объем памяти не зависит от длительности работы
+    и количества строк, а определяется длиной окна и числом различных URL.
+    Агрегаты окна получаются слиянием скетчей его корзин.
+    """
+
+    BUCKET = 60
+
+    def __init__(self, windows=(300, 3600), accuracy=0.01):
+        if not windows or min(windows) <= 0:
+            raise ValueError('Длины скользящих окон должны быть положительными: {}'.format(windows))
+        self.windows = sorted(int(window) for window in windows)
+        self.accuracy = accuracy
+        self.buckets = dict()
+        self.horizon = None
+        self._starts = dict()
+
+    def get_bucket(self, time_local):
+        """Начало минуты поля time_local в секундах эпохи Unix, None если поле некорректно"""
+        key = time_local[:UNITS['minute']] + time_local[20:]
+        start = self._starts.get(key, False)
+        if start is False:
+            moment = parse_prefix(key)
+            start = self._starts[key] = int(moment.timestamp()) if moment is not None else None
+        return start
+
+    def add(self, url, time_local, value):
+        """Добавляет время запроса; запросы старше самого длинного окна пропускаются"""
+        start = self.get_bucket(time_local)
+        if start is None or (self.horizon is not None and start < self.horizon):
+            return False
+        by_url = self.buckets.get(start)
+        if by_url is None:
+            by_url = self.buckets[start] = dict()
+        sketch = by_url.get(url)
+        if sketch is None:
+            sketch = by_url[url] = QuantileSketch(self.accuracy)
+        sketch.add(value)
+        return True
+
+    def expire(self, now):
+        """Удаляет корзины, которые не попадают ни в одно окно на момент now"""
+        self.horizon = self.get_first_bucket(self.windows[-1], now)
+        for start in [start for start in self.buckets if start < self.horizon]:
+            del self.buckets[start]
+        if len(self._starts) > 4 * len(self.buckets) + 1024:
+            self._starts.clear()
+
+    def get_first_bucket(self, window, now):
+        return (int(now) - window) // self.BUCKET * self.BUCKET
+
+    def get_time_dict(self, window, now):
+        """Словарь {url: QuantileSketch} по запросам окна длиной window секунд на момент now"""
+        first = self.get_first_bucket(window, now)
+        time_dict = dict()
+        for start, by_url in self.buckets.items():
+            if start < first:
+                continue
+            for url, sketch in by_url.items():
+                if url not in time_dict:
+                    time_dict[url] = QuantileSketch(self.accuracy)
+                time_dict[url].merge(sketch)
+        return time_dict
+
+
+def get_window_name(seconds):
+    """Короткое имя окна: 300 -> "5m", 3600 -> "1h", 90 -> "90s" """
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds % size == 0:
+            return '{}{}'.format(seconds // size, unit)
+    return '{}s'.format(seconds)
@@ -12,11 +12,36 @@ import os
 import json
 import re
 import gzip
+import bz2
+import lzma
+import shutil
+import subprocess
+import hashlib
+import heapq
+import math
+import time
+import mmap
+import struct
+from array import array
 import logging
 import operator
 import platform
+import collections
+import functools
+import itertools
+import contextlib
+import random
+import multiprocessing
 from string import Template
 
+from sketches import QuantileSketch, HeavyHitters
+from stats_cache import StatsCache, write_stats_cache
+from url_normalizer import UrlNormalizer
+from metrics import Metrics, Profiler
+from timeseries import TimeSeries
+from live import LogFollower, SlidingWindows, get_window_name
+from groupby import GroupBy, get_fields
+
 
 CONFIG = {
     "REPORT_SIZE": 1000,
@@ -41,7 +66,49 @@ RE_ROW_TEMPLATE = ' '.join([
         '(?P<request_time>(\-)|(.+))'
     ])
 
-RE_FILE_NAME = r'^nginx-access-ui.log-(?P<file_date>[0-9]{8})\.(gz|plain)'
+RE_ROW_PREFIX = ' '.join([
+        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}',
+        r'.+',
+        r'.+',
+        r'\[\d{2}\/[a-z]{3}\/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}\] $'
+    ])
+ROW_PREFIX_FORMAT = re.compile(RE_ROW_PREFIX.encode(), re.IGNORECASE)
+HTTP_VERSIONS = (b' HTTP/1.1', b' HTTP/1.0')
+
+RE_FILE_NAME = r'^nginx-access-ui.log-(?P<file_date>[0-9]{8})\.(gz|bz2|xz|plain)'
+
+DECOMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open
+}
+EXTERNAL_DECOMPRESSORS = {
+    '.gz': ['pigz', '-dc']
+}
+BLOCK_SIZE = 1 << 18
+
+ENCODING = 'utf-8'
+AGGREGATIONS = ('exact', 'sketch', 'heavy')
+SKETCH_QUANTILES = {'time_p90': 0.9, 'time_p95': 0.95, 'time_p99': 0.99}
+CHECKPOINT_VERSION = 4
+CHECKPOINT_TAIL = 64
+CHECKPOINT_TIMES = struct.Struct('<II')
+STATS_CACHE_VERSION = 1
+PARTIAL_VERSION = 3
+PARTIAL_SUFFIX = '.partial.json.gz'
+SELECT_MIN_SIZE = 16384
+FAIL_SAMPLE = 2000
+FAIL_SAMPLE_Z = 3.0
+BATCH_SIZE = 10000
+
+# Счетчики текущего процесса для измерения стадий: прочитанные из потоков байты
+# распакованных данных, время чтения и распаковки, строки, разобранные
+# регулярным выражением
+COUNTERS = collections.Counter()
+
+REPORT_TEMPLATE = 'report.html'
+REPORT_FIELDS = ('table_json', 'table_pages')
+TEMPLATE_CACHE = dict()
 
 FORMATTER = '[%(asctime)s] %(levelname)s %(message)s'
 DATEFMT = '%Y.%m.%d %H:%M:%S'
@@ -76,28 +143,90 @@ def find_last_log(path, name_template=RE_FILE_NAME):
         sys.exit()
     return max(file_names)
 
+def find_unreported_logs(path, report_dir, name_template=RE_FILE_NAME):
+    """
+    Возвращает отсортированный по дате список имен log-файлов из директории
+    path, для которых в report_dir нет отчета. Если за одну дату есть
+    несколько файлов, выбирается один из них так же, как в find_last_log.
+    """
+
+    logging.info('Поиск необработанных log-файлов в директории: {}'.format(path))
+    by_date = dict()
+    for file_name in os.listdir(path):
+        data = re.search(name_template, file_name)
+        if data and os.path.isfile(os.path.join(path, file_name)):
+            file_date = data.groupdict()['file_date']
+            by_date[file_date] = max(file_name, by_date.get(file_date, file_name))
+    return [by_date[file_date] for file_date in sorted(by_date)
+            if not report_written(get_report_name(report_dir, file_date))]
+
+
+def get_report_name(report_dir, file_date):
+    """Путь к отчету по log-файлу за дату file_date в формате YYYYMMDD"""
+    return os.path.join(report_dir, 'report-{}.{}.{}.html'.format(file_date[:4], file_date[4:6], file_date[6:8]))
+
+
 def fix_config_values(config):
-        """Исправляет значения ключей словаря конфигурации"""
-        
-        def check_positive(value):
-            assert value>=0 
-            return value
-        
-        logging.info('Проверка валидности значения ключей конфига')
-        order = {
-            "FAIL_PERC": (float, check_positive), 
-            "LOG_DIR": (os.path.abspath,),
-            "REPORT_DIR": (os.path.abspath,),
-            "REPORT_SIZE": (int, check_positive),
-            "OUT_LOG": (os.path.abspath,)
-        }
-        for key, funcs in order.items():
-            if key in config.keys():
-                try:
-                    for func in funcs:
-                        config[key] = func(config[key])
-                except:
-                    logging.exception('Некорректное значение поля "{}" в конфигурации'.format(key))
+    """
+    Приводит значения ключей словаря конфигурации к нужным типам и проверяет
+    их допустимость. При некорректном значении вызывает ValueError.
+    """
+
+    def check_non_negative(value):
+        if value < 0:
+            raise ValueError('значение должно быть неотрицательным')
+        return value
+
+    def check_positive(value):
+        if value <= 0:
+            raise ValueError('значение должно быть положительным')
+        return value
+
+    def check_fraction(value):
+        if not 0 < value < 1:
+            raise ValueError('значение должно быть в интервале (0, 1)')
+        return value
+
+    def check_list(value):
+        if not isinstance(value, list):
+            raise ValueError('значение должно быть списком')
+        return value
+
+    logging.info('Проверка валидности значения ключей конфига')
+    order = {
+        "FAIL_PERC": (float, check_non_negative),
+        "LOG_DIR": (os.path.abspath,),
+        "REPORT_DIR": (os.path.abspath,),
+        "REPORT_SIZE": (int, check_non_negative),
+        "OUT_LOG": (os.path.abspath,),
+        "WORKERS": (int, check_positive),
+        "SKETCH_ACCURACY": (float, check_fraction),
+        "HEAVY_FACTOR": (float, check_positive),
+        "STATE_FILE": (os.path.abspath,),
+        "BACKFILL_WORKERS": (int, check_positive),
+        "CACHE_DIR": (os.path.abspath,),
+        "PARTIAL_DIR": (os.path.abspath,),
+        "URL_RULES": (check_list,),
+        "PROFILE_INTERVAL": (float, check_positive),
+        "REPORT_PAGE_SIZE": (int, check_non_negative),
+        "FAIL_SAMPLE": (int, check_non_negative),
+        "GROUP_BY": (check_list,),
+        "WATCH_LOG": (os.path.abspath,),
+        "WATCH_WINDOWS": (check_list,),
+        "WATCH_INTERVAL": (float, check_positive),
+        "WATCH_POLL": (float, check_positive)
+    }
+    for key, funcs in order.items():
+        if key in config.keys():
+            value = config[key]
+            try:
+                for func in funcs:
+                    value = func(value)
+            except (TypeError, ValueError) as e:
+                raise ValueError('Некорректное значение поля "{}" в конфигурации: {!r}, {}'.format(
+                    key, config[key], e))
+            config[key] = value
+    return config
 
 
 def get_new_config(path, old_config=None):
@@ -132,7 +261,224 @@ def get_new_config(path, old_config=None):
     return old_config
 
 
-def parser(path, line_template=RE_ROW_TEMPLATE):
+def tokenize(line, with_time=False, fields=()):
+    """
+    Быстрый разбор строки bytes формата ui_short без полного регулярного
+    выражения. Строка делится по кавычкам, поля проверяются на фиксированных
+    позициях, и декодируются только поля request_url и request_time
+    (и time_local при with_time=True), а также поля из fields (status,
+    body_bytes_sent, request_type, remote_addr, http_referer,
+    http_user_agent). Возвращает словарь с этими полями,
+    совпадающими с результатом RE_ROW_TEMPLATE, либо None, если строка
+    не укладывается в ожидаемую структуру. None не означает, что строка
+    некорректна: такую строку нужно разобрать регулярным выражением.
+    """
+
+    if line.endswith(b'\n'):
+        line = line[:-1]
+    parts = line.split(b'"')
+    if len(parts) != 13:
+        return None
+    if parts[4] != b' ' or parts[6] != b' ' or parts[8] != b' ' or parts[10] != b' ':
+        return None
+    if not (parts[3] and parts[5] and parts[7] and parts[9] and parts[11]):
+        return None
+    request_time = parts[12]
+    if len(request_time) < 2 or request_time[0] != 32:
+        return None
+    status_bytes = parts[2].split(b' ')
+    if len(status_bytes) != 4 or status_bytes[0] or status_bytes[3]:
+        return None
+    status, body_bytes = status_bytes[1], status_bytes[2]
+    if not (len(status) == 3 and status.isdigit() and body_bytes.isdigit()):
+        return None
+    request_type, _, request_url = parts[1].partition(b' ')
+    if not request_type.isalpha():
+        return None
+    if len(request_url) <= 9 or not request_url.endswith(HTTP_VERSIONS):
+        return None
+    prefix = ROW_PREFIX_FORMAT.search(parts[0])
+    if not prefix:
+        return None
+    entry = {'request_url': request_url.decode(ENCODING, 'replace'),
+             'request_time': request_time[1:].decode(ENCODING, 'replace')}
+    if with_time:
+        entry['time_local'] = parts[0][-28:-2].decode(ENCODING)
+    if fields:
+        values = {'status': status,
+                  'body_bytes_sent': body_bytes,
+                  'request_type': request_type,
+                  'remote_addr': parts[0][prefix.start():].partition(b' ')[0],
+                  'http_referer': parts[3],
+                  'http_user_agent': parts[5]}
+        for field in fields:
+            entry[field] = values[field].decode(ENCODING, 'replace')
+    return entry
+
+
+def parse_lines(lines, line_template=RE_ROW_TEMPLATE, fast=True, with_time=False, fields=()):
+    """
+    Возвращает генератор, выдающий для каждой строки из lines (str или bytes)
+    словарь распознанных значений параметров либо None, если строку
+    распознать не удалось. При fast=True строка сначала разбирается функцией
+    tokenize, и регулярное выражение line_template применяется только
+    к строкам, которые она не смогла разобрать. В этом случае словарь
+    содержит только поля request_url и request_time, а при with_time=True
+    еще и time_local, и поля из fields.
+    """
+
+    line_format = re.compile(line_template, re.IGNORECASE)
+    for line in lines:
+        if fast:
+            entry = tokenize(line.encode(ENCODING) if isinstance(line, str) else line, with_time, fields)
+            if entry:
+                yield entry
+                continue
+        if isinstance(line, bytes):
+            line = line.decode(ENCODING, 'replace')
+        COUNTERS['regex_lines'] += 1
+        data = line_format.search(line)
+        if data:
+            yield data.groupdict()
+        else:
+            yield None
+
+
+class CommandReader:
+    """Двоичный поток стандартного вывода внешней команды распаковки"""
+
+    def __init__(self, command):
+        self.command = command
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        self.read = self.process.stdout.read
+
+    def close(self, check=True):
+        self.process.stdout.close()
+        code = self.process.wait()
+        if check and code:
+            raise OSError('Команда "{}" завершилась с кодом {}'.format(' '.join(self.command), code))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(check=exc_type is None)
+
+
+def get_codec(path):
+    """Расширение сжатого log-файла из DECOMPRESSORS либо None для plain log-файла"""
+    extension = os.path.splitext(path)[1]
+    return extension if extension in DECOMPRESSORS else None
+
+
+def open_log(path, external=False):
+    """
+    Открывает log-файл path как двоичный поток распакованных данных. При
+    external=True и наличии в системе внешней программы распаковки из
+    EXTERNAL_DECOMPRESSORS (pigz для gz) данные читаются из ее вывода.
+    """
+
+    codec = get_codec(path)
+    if codec is None:
+        return open(path, 'rb')
+    if external and codec in EXTERNAL_DECOMPRESSORS and shutil.which(EXTERNAL_DECOMPRESSORS[codec][0]):
+        return CommandReader(EXTERNAL_DECOMPRESSORS[codec] + [path])
+    return DECOMPRESSORS[codec](path, 'rb')
+
+
+def read_lines(stream, limit=None, block_size=BLOCK_SIZE):
+    """
+    Генератор строк bytes без символов перевода строки из двоичного потока
+    stream, который читается блоками по block_size байт, но не более limit
+    байт. Переводы строк LF, CRLF и CR обрабатываются так же, как при чтении
+    файла в текстовом режиме.
+    """
+
+    tail = b''
+    while limit is None or limit > 0:
+        started = time.perf_counter()
+        block = stream.read(block_size if limit is None else min(block_size, limit))
+        COUNTERS['read_seconds'] += time.perf_counter() - started
+        COUNTERS['read_bytes'] += len(block)
+        if not block:
+            break
+        if limit is not None:
+            limit -= len(block)
+        cut = block.rfind(b'\n') + 1
+        if not cut:
+            tail += block
+            continue
+        lines = (tail + block[:cut]).splitlines()
+        tail = block[cut:]
+        yield from lines
+    if tail:
+        yield from tail.splitlines()
+
+
+@contextlib.contextmanager
+def map_file(path):
+    """
+    Отображает файл path в память только для чтения. Возвращает объект mmap
+    либо None для пустого файла, который отобразить нельзя.
+    """
+
+    with open(path, 'rb') as input_file:
+        if not os.fstat(input_file.fileno()).st_size:
+            yield None
+            return
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def read_mapped(path, start=0, end=None, block_size=BLOCK_SIZE):
+    """
+    Генератор строк bytes без символов перевода строки из диапазона байт
+    [start, end) plain log-файла path (по умолчанию весь файл). Файл
+    отображается в память, границы строк ищутся прямо в отображении, и каждая
+    строка копируется из него один раз, без промежуточных блоков и списков.
+    Переводы строк LF, CRLF и CR обрабатываются так же, как в read_lines:
+    блоки около block_size байт, в которых есть CR, делятся splitlines.
+    """
+
+    with map_file(path) as mapped:
+        if mapped is None:
+            return
+        end = len(mapped) if end is None else min(end, len(mapped))
+        find = mapped.find
+        position = start
+        while position < end:
+            started = time.perf_counter()
+            cut = mapped.rfind(b'\n', position, min(position + block_size, end)) + 1
+            if not cut:
+                cut = find(b'\n', position + block_size, end) + 1 or end
+            COUNTERS['read_seconds'] += time.perf_counter() - started
+            COUNTERS['read_bytes'] += cut - position
+            if find(b'\r', position, cut) >= 0:
+                yield from mapped[position:cut].splitlines()
+                position = cut
+                continue
+            while position < cut:
+                line_end = find(b'\n', position, cut)
+                if line_end < 0:
+                    line_end = cut
+                yield mapped[position:line_end]
+                position = line_end + 1
+
+
+def read_log(path, external=False):
+    """
+    Генератор строк bytes log-файла path: plain log-файл отображается в память,
+    сжатый читается блоками из потока распакованных данных.
+    """
+
+    if get_codec(path) is None:
+        yield from read_mapped(path)
+        return
+    with open_log(path, external) as input_file:
+        yield from read_lines(input_file)
+
+
+def parser(path, line_template=RE_ROW_TEMPLATE, external=False, with_time=False, fields=()):
     """
     
     Возвращает генератор, выдающий словарь распознанных значений
@@ -143,60 +489,694 @@ def parser(path, line_template=RE_ROW_TEMPLATE):
     """
 
     logging.info('Открыте входного log-файла для чтения: {}'.format(path))
-    if path.endswith(".gz"):
-        input_file = gzip.open(path)        
-    else:
-        input_file = open(path)
-    line_format = re.compile(line_template, re.IGNORECASE)
-    for line in input_file:
-        data = re.search(line_format, line)
-        if data:
-            yield data.groupdict()
-        else:
-            yield None
-    input_file.close()
+    yield from parse_lines(read_log(path, external), line_template, with_time=with_time, fields=fields)
     logging.info('Входной log-файл прочитан и закрыт')
 
 
-def get_request_times_from_log(path):
-    time_dict = dict()
+def aggregate(entries, sketch_accuracy=None, normalizer=None, series=None, groups=None, capacity=None):
+    """
+    Собирает времена обработки запросов из распознанных записей entries
+    в словарь {url: array('d', [request_time, ...])}. Возвращает словарь
+    и количество удачно и неудачно распознанных строк. Если задана точность
+    sketch_accuracy, то вместо списков времен в словаре хранятся скетчи
+    QuantileSketch ограниченного размера. Если задан normalizer (UrlNormalizer),
+    то времена собираются по номерам шаблонов URL, а ключами возвращаемого
+    словаря становятся сами шаблоны. Если задан series (TimeSeries), то
+    времена дополнительно собираются в него по интервалам поля time_local,
+    а если задан список группировок groups (GroupBy) - в каждую из них.
+
+    Если задан capacity, то вместо словаря возвращается сводка HeavyHitters,
+    отслеживающая не более capacity URL с наибольшим суммарным временем.
+    В этом режиме URL нормализуются без таблиц normalizer, чтобы объем
+    памяти не зависел от числа различных URL.
+    """
+
+    time_dict = HeavyHitters(capacity, sketch_accuracy or 0.01) if capacity else dict()
     bad_count, good_count = 0, 0
-    for entry in parser(path):
+    for entry in entries:
         if entry:
             dt = float(entry['request_time'])
-            if entry['request_url'] in time_dict.keys():
-                time_dict[entry['request_url']].append(dt)
+            if capacity:
+                url = entry['request_url'] if normalizer is None else normalizer.normalize(entry['request_url'])
+                time_dict.add(url, dt)
             else:
-                time_dict[entry['request_url']] = [dt]
+                url = entry['request_url'] if normalizer is None else normalizer.get_id(entry['request_url'])
+                if url in time_dict:
+                    time_dict[url].append(dt)
+                elif sketch_accuracy:
+                    time_dict[url] = QuantileSketch(sketch_accuracy)
+                    time_dict[url].add(dt)
+                else:
+                    time_dict[url] = array('d', (dt,))
+            if series is not None or groups:
+                name = url if normalizer is None or capacity else normalizer.names[url]
+                if series is not None:
+                    series.add(name, entry['time_local'], dt)
+                for group in groups or ():
+                    group.add(entry, name, dt)
             good_count += 1
         else:
             bad_count += 1
+    if normalizer is not None and not capacity:
+        time_dict = {normalizer.names[url_id]: times for url_id, times in time_dict.items()}
     return time_dict, good_count, bad_count
 
 
-def get_stats(time_dict, size):
-    time_sum = dict()
-    all_time = 0.0
-    N = 0
-    for url in time_dict.keys():
-        time_sum[url] = sum(time_dict[url])
-        all_time += time_sum[url]
-        N += len(time_dict[url])
-    time_sorted = sorted(time_sum.items(), key=operator.itemgetter(1), reverse=True)
+def merge_aggregates(target, part):
+    """
+    Дописывает частичный результат part функции aggregate в target.
+    Части должны сливаться в порядке следования строк в log-файле, тогда
+    результат совпадает с однопроцессной обработкой всего файла.
+    """
+
+    time_dict, good_count, bad_count = target
+    if isinstance(part[0], HeavyHitters):
+        time_dict = time_dict.merge(part[0]) if time_dict else part[0]
+        return time_dict, good_count + part[1], bad_count + part[2]
+    for url, times in part[0].items():
+        if url not in time_dict:
+            time_dict[url] = times
+        elif isinstance(times, QuantileSketch):
+            time_dict[url].merge(times)
+        else:
+            time_dict[url].extend(times)
+    return time_dict, good_count + part[1], bad_count + part[2]
+
+
+def split_file(path, parts, start=0, end=None):
+    """
+    Разбивает диапазон байт [start, end) файла path (по умолчанию весь файл)
+    на не более чем parts диапазонов (start, end), границы которых совпадают
+    с началами строк. Значение start должно быть началом строки.
+    """
+
+    bounds = [start]
+    with map_file(path) as mapped:
+        size = len(mapped) if mapped is not None else 0
+        end = size if end is None else min(end, size)
+        for i in range(1, parts):
+            position = start + (end - start) * i // parts
+            if position <= bounds[-1]:
+                continue
+            position = mapped.find(b'\n', position - 1, end) + 1
+            if bounds[-1] < position < end:
+                bounds.append(position)
+    bounds.append(max(end, start))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_range(path, start, end):
+    """
+    Генератор строк bytes файла path в диапазоне байт [start, end). Переводы
+    строк обрабатываются так же, как при чтении файла в текстовом режиме.
+    """
+
+    yield from read_mapped(path, start, end)
+
+
+def aggregate_in_worker(lines, sketch_accuracy=None, url_rules=None, series_spec=None, group_keys=None,
+                        capacity=None):
+    """
+    Разбор и агрегация строк lines в процессе-исполнителе. К результату
+    aggregate добавляются счетчики различных исходных URL по шаблонам для
+    пополнения нормализатора главного процесса (при нормализации URL по правилам
+    url_rules), счетчики COUNTERS исполнителя за время обработки,
+    временные ряды TimeSeries(*series_spec), если series_spec задан,
+    и группировки GroupBy по спискам полей group_keys.
+    """
+
+    COUNTERS.clear()
+    normalizer = UrlNormalizer(url_rules) if url_rules else None
+    series = TimeSeries(*series_spec) if series_spec else None
+    groups = [GroupBy(keys) for keys in group_keys] if group_keys else None
+    result = aggregate(parse_lines(lines, with_time=series is not None, fields=get_fields(groups)), sketch_accuracy,
+                       normalizer, series, groups, capacity)
+    return result + (normalizer.variants() if normalizer else None, dict(COUNTERS), series, groups)
+
+
+def aggregate_range(args):
+    """Обработка диапазона байт plain log-файла в процессе-исполнителе"""
+    path, start, end, sketch_accuracy, url_rules, series_spec, group_keys, capacity = args
+    return aggregate_in_worker(read_range(path, start, end), sketch_accuracy, url_rules, series_spec, group_keys,
+                               capacity)
+
+
+def aggregate_batch(lines, sketch_accuracy=None, url_rules=None, series_spec=None, group_keys=None, capacity=None):
+    """Обработка пачки строк распакованного log-файла в процессе-исполнителе"""
+    return aggregate_in_worker(lines, sketch_accuracy, url_rules, series_spec, group_keys, capacity)
+
+
+def read_batches(path, size=BATCH_SIZE, external=False):
+    """Генератор пачек по size строк bytes сжатого log-файла path"""
+    batch = []
+    for line in read_log(path, external):
+        batch.append(line)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_request_times_parallel(path, workers, sketch_accuracy=None, start=0, end=None, external=False,
+                               normalizer=None, series=None, groups=None, capacity=None):
+    """
+    Многопроцессная версия get_request_times_from_log. Plain log-файл делится
+    на диапазоны байт по границам строк, сжатый log-файл распаковывается
+    в главном процессе и раздается исполнителям пачками строк. Частичные результаты
+    сливаются в порядке следования строк в файле. Для plain log-файла можно
+    ограничить обработку диапазоном байт [start, end). Исполнители нормализуют
+    URL по правилам normalizer, а их счетчики исходных URL сливаются в normalizer.
+    Счетчики исполнителей добавляются к COUNTERS главного процесса, а их
+    временные ряды и группировки сливаются в series и groups.
+    """
+
+    def merge_part(result, part):
+        if normalizer is not None:
+            normalizer.update(part[3])
+        COUNTERS.update(part[4])
+        if series is not None:
+            series.merge(part[5])
+        for group, group_part in zip(groups or (), part[6] or ()):
+            group.merge(group_part)
+        return merge_aggregates(result, part)
+
+    url_rules = normalizer.rules if normalizer is not None else None
+    series_spec = (series.unit, series.accuracy) if series is not None else None
+    group_keys = [group.keys for group in groups] if groups else None
+    logging.info('Открыте входного log-файла для чтения в {} процессах: {}'.format(workers, path))
+    result = (dict(), 0, 0)
+    with multiprocessing.Pool(workers) as pool:
+        if get_codec(path):
+            pending = collections.deque()
+            for batch in read_batches(path, external=external):
+                pending.append(pool.apply_async(aggregate_batch, (batch, sketch_accuracy, url_rules, series_spec,
+                                                                      group_keys, capacity)))
+                if len(pending) >= 2 * workers:
+                    result = merge_part(result, pending.popleft().get())
+            while pending:
+                result = merge_part(result, pending.popleft().get())
+        else:
+            ranges = [(path, range_start, range_end, sketch_accuracy, url_rules, series_spec, group_keys, capacity)
+                      for range_start, range_end in split_file(path, workers, start, end)]
+            for part in pool.imap(aggregate_range, ranges):
+                result = merge_part(result, part)
+    logging.info('Входной log-файл прочитан и закрыт')
+    return result
+
+
+def get_request_times_from_log(path, workers=1, sketch_accuracy=None, external=False, normalizer=None, series=None,
+                               groups=None, capacity=None):
+    if workers > 1:
+        return get_request_times_parallel(path, workers, sketch_accuracy, external=external, normalizer=normalizer,
+                                          series=series, groups=groups, capacity=capacity)
+    return aggregate(parser(path, external=external, with_time=series is not None, fields=get_fields(groups)),
+                     sketch_accuracy, normalizer, series, groups, capacity)
+
+
+def get_request_times_from_range(path, start, end, workers=1, sketch_accuracy=None, normalizer=None, series=None,
+                                 groups=None, capacity=None):
+    """Обработка диапазона байт [start, end) plain log-файла path"""
+    if workers > 1:
+        return get_request_times_parallel(path, workers, sketch_accuracy, start, end, normalizer=normalizer,
+                                          series=series, groups=groups, capacity=capacity)
+    logging.info('Чтение входного log-файла {} с позиции {}'.format(path, start))
+    return aggregate(parse_lines(read_range(path, start, end), with_time=series is not None, fields=get_fields(groups)),
+                     sketch_accuracy, normalizer, series, groups, capacity)
+
+
+def get_file_identity(path):
+    """Идентификатор файла: путь, устройство, inode, размер и время изменения"""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path),
+            'device': stat.st_dev,
+            'inode': stat.st_ino,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def get_tail_hash(path, offset, length=CHECKPOINT_TAIL):
+    """Хеш последних length байт файла path перед позицией offset"""
+    with open(path, 'rb') as input_file:
+        input_file.seek(max(offset - length, 0))
+        return hashlib.md5(input_file.read(min(offset, length))).hexdigest()
+
+
+def find_last_line_end(path, size):
+    """Позиция сразу после последнего перевода строки в первых size байтах файла"""
+    with map_file(path) as mapped:
+        if mapped is None:
+            return 0
+        return mapped.rfind(b'\n', 0, size) + 1
+
+
+def dump_time_dict(time_dict):
+    """Представление словаря времен запросов (или сводки HeavyHitters) для записи в json"""
+    if isinstance(time_dict, HeavyHitters):
+        return time_dict.to_dict()
+    return {url: times.to_dict() if isinstance(times, QuantileSketch) else times.tolist()
+            for url, times in time_dict.items()}
+
+
+def load_time_dict(data, capacity=None):
+    """Обратное преобразование к dump_time_dict, при capacity - к сводке HeavyHitters"""
+    if capacity:
+        return HeavyHitters.from_dict(data)
+    return {url: QuantileSketch.from_dict(times) if isinstance(times, dict) else array('d', times)
+            for url, times in data.items()}
+
+
+def get_times_path(state_path):
+    """Путь к двоичному файлу времен запросов рядом с файлом состояния state_path"""
+    return state_path + '.times'
+
+
+def append_times(path, offset, urls, time_dict):
+    """
+    Дописывает времена запросов time_dict в двоичный файл path с позиции offset,
+    отбрасывая данные после нее (их мог оставить прерванный запуск). Для каждого
+    URL записываются номер URL в списке urls и число времен (CHECKPOINT_TIMES),
+    затем сами времена array('d') в little-endian. Новые URL добавляются
+    в конец urls. Возвращает позицию конца записанных данных.
+    """
+
+    index = {url: i for i, url in enumerate(urls)}
+    with open(path, 'r+b' if offset else 'wb') as times_file:
+        times_file.seek(offset)
+        times_file.truncate()
+        for url, times in time_dict.items():
+            if url not in index:
+                index[url] = len(urls)
+                urls.append(url)
+            times_file.write(CHECKPOINT_TIMES.pack(index[url], len(times)))
+            if sys.byteorder != 'little':
+                times = array('d', times)
+                times.byteswap()
+            times.tofile(times_file)
+        return times_file.tell()
+
+
+def load_times(path, size, urls):
+    """Обратное преобразование к append_times: словарь времен из первых size байт файла path"""
+    time_dict = {url: array('d') for url in urls}
+    with open(path, 'rb') as times_file:
+        data = memoryview(times_file.read(size))
+    if len(data) != size:
+        raise ValueError('Файл времен запросов {} короче сохраненного размера {}'.format(path, size))
+    position = 0
+    while position < size:
+        url_index, count = CHECKPOINT_TIMES.unpack_from(data, position)
+        position += CHECKPOINT_TIMES.size
+        times = array('d')
+        times.frombytes(data[position:position + 8 * count])
+        if sys.byteorder != 'little':
+            times.byteswap()
+        time_dict[urls[url_index]].extend(times)
+        position += 8 * count
+    return time_dict
+
+
+def load_state_time_dict(state, state_path, capacity=None):
+    """Словарь времен запросов (или сводка HeavyHitters) из состояния state"""
+    if state['times'] is not None:
+        return load_times(get_times_path(state_path), state['times']['size'], state['times']['urls'])
+    return load_time_dict(state['time_dict'], capacity)
+
+
+def load_checkpoint(path):
+    """Читает файл состояния инкрементальной обработки, None если его нет"""
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'r', encoding=ENCODING) as state_file:
+            state = json.load(state_file)
+        times = state.get('times')
+        if times is not None and os.path.getsize(get_times_path(path)) < times['size']:
+            raise ValueError('Файл времен запросов короче сохраненного размера')
+        return state
+    except (OSError, ValueError):
+        logging.exception('Файл состояния {} поврежден и будет перезаписан'.format(path))
+        return None
+
+
+def save_checkpoint(path, state):
+    """Атомарно записывает файл состояния инкрементальной обработки"""
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding=ENCODING) as state_file:
+        json.dump(state, state_file)
+    os.replace(temp_path, path)
+    logging.info('Состояние обработки сохранено в файл {}'.format(path))
+
+
+def restore_state(state, normalizer=None, series=None, groups=None):
+    """Пополняет normalizer, series и groups данными из файла состояния state"""
+    if normalizer is not None:
+        normalizer.update_from_dict(state['url_variants'])
+    if series is not None:
+        series.merge(TimeSeries.from_dict(state['time_series']))
+    for group, data in zip(groups or (), state.get('groups') or ()):
+        group.merge(GroupBy.from_dict(data))
+
+
+def get_request_times_incremental(path, state_path, workers=1, sketch_accuracy=None, report_exists=False,
+                                  external=False, normalizer=None, series=None, groups=None, capacity=None,
+                                  closed=False):
+    """
+    Инкрементальная версия get_request_times_from_log. В файле состояния
+    state_path хранятся идентификатор log-файла, позиция, до которой он
+    обработан, и накопленные результаты. Если log-файл тот же и только
+    дописан, то обрабатывается лишь новая часть. Последняя строка без
+    перевода строки считается недописанной и откладывается до следующего
+    запуска, если только log-файл не закрыт (closed - он ротирован и больше
+    не дописывается) и не остался неизменным с прошлого запуска: тогда она
+    учитывается, как и при полной обработке. Сжатые log-файлы при любом
+    изменении обрабатываются целиком.
+
+    Времена запросов точного режима дописываются в двоичный файл рядом
+    с файлом состояния (append_times), поэтому запуск записывает только
+    времена новой части, а не всю историю. Сводки режимов "sketch" и "heavy"
+    ограничены по размеру и сохраняются в самом файле состояния.
+
+    При нормализации URL в состоянии сохраняются и счетчики различных исходных
+    URL по шаблонам, которые при продолжении сливаются в normalizer, при
+    агрегации по времени - временные ряды, которые сливаются в series,
+    а при группировках - их агрегаты, которые сливаются в groups.
+
+    Возвращает None, если log-файл не изменился с прошлого запуска и отчет
+    уже существует.
+    """
+
+    identity = get_file_identity(path)
+    state = load_checkpoint(state_path)
+    url_rules = normalizer.rules if normalizer is not None else None
+    series_spec = [series.unit, series.accuracy] if series is not None else None
+    group_keys = [group.keys for group in groups] if groups else None
+    resumable = (state is not None
+                 and state['version'] == CHECKPOINT_VERSION
+                 and state['sketch_accuracy'] == sketch_accuracy
+                 and state.get('capacity') == capacity
+                 and state.get('url_rules') == url_rules
+                 and state.get('series_spec') == series_spec
+                 and state.get('group_keys') == group_keys
+                 and all(state['identity'][key] == identity[key] for key in ('path', 'device', 'inode'))
+                 and state['offset'] <= identity['size'])
+    unchanged = (resumable and state['identity']['size'] == identity['size']
+                 and state['identity']['mtime'] == identity['mtime'])
+    if unchanged and state['offset'] == identity['size']:
+        if report_exists:
+            return None
+        logging.info('Log-файл не изменился, используется сохраненное состояние')
+        restore_state(state, normalizer, series, groups)
+        return load_state_time_dict(state, state_path, capacity), state['good_count'], state['bad_count']
+
+    if get_codec(path):
+        resumable = False
+        end = identity['size']
+        result = get_request_times_from_log(path, workers, sketch_accuracy, external, normalizer, series, groups,
+                                            capacity)
+    else:
+        resumable = resumable and get_tail_hash(path, state['offset']) == state['tail_hash']
+        start = state['offset'] if resumable else 0
+        end = identity['size'] if closed or unchanged else find_last_line_end(path, identity['size'])
+        if resumable:
+            restore_state(state, normalizer, series, groups)
+        part = get_request_times_from_range(path, start, end, workers, sketch_accuracy, normalizer, series, groups,
+                                            capacity)
+        if resumable:
+            logging.info('Log-файл дописан, обработаны строки с позиции {}'.format(start))
+            result = merge_aggregates((load_state_time_dict(state, state_path, capacity), state['good_count'],
+                                       state['bad_count']), part)
+        else:
+            logging.info('Сохраненное состояние не подходит, log-файл обрабатывается целиком')
+            result = part
+
+    times = None
+    if isinstance(result[0], dict) and not sketch_accuracy:
+        urls = state['times']['urls'] if resumable else []
+        size = append_times(get_times_path(state_path), state['times']['size'] if resumable else 0, urls,
+                            part[0] if resumable else result[0])
+        times = {'urls': urls, 'size': size}
+    save_checkpoint(state_path, {'version': CHECKPOINT_VERSION,
+                                 'identity': identity,
+                                 'offset': end,
+                                 'tail_hash': get_tail_hash(path, end),
+                                 'sketch_accuracy': sketch_accuracy,
+                                 'capacity': capacity,
+                                 'url_rules': url_rules,
+                                 'url_variants': normalizer.variants_to_dict() if normalizer is not None else None,
+                                 'series_spec': series_spec,
+                                 'time_series': series.to_dict() if series is not None else None,
+                                 'group_keys': group_keys,
+                                 'groups': [group.to_dict() for group in groups] if groups else None,
+                                 'good_count': result[1],
+                                 'bad_count': result[2],
+                                 'times': times,
+                                 'time_dict': dump_time_dict(result[0]) if times is None else None})
+    return result
+
+
+def select_ranks(values, ranks):
+    """
+    Порядковые статистики: значения с номерами ranks (с нуля) в values,
+    упорядоченных по возрастанию. Для больших последовательностей границы
+    искомых значений оцениваются по отсортированной случайной выборке,
+    затем за один проход отбираются значения между границами, и сортируется
+    только этот небольшой отрезок (выбор Флойда-Ривеста). Если искомые
+    значения не попали между границами, values сортируется целиком.
+    """
+
+    n = len(values)
+    if n < SELECT_MIN_SIZE:
+        temp = sorted(values)
+        return [temp[rank] for rank in ranks]
+    sample = sorted(random.sample(values, int(4 * n ** 0.5)))
+    margin = int(2 * len(sample) ** 0.5)
+    low = sample[max(min(ranks) * len(sample) // n - margin, 0)]
+    high = sample[min(max(ranks) * len(sample) // n + margin, len(sample) - 1)]
+    less_count = sum(map(low.__gt__, values))
+    middle = sorted([x for x in values if low <= x <= high])
+    if less_count <= min(ranks) and max(ranks) < less_count + len(middle):
+        return [middle[rank - less_count] for rank in ranks]
+    temp = sorted(values)
+    return [temp[rank] for rank in ranks]
+
+
+def get_median(values):
+    """Медиана values, совпадающая с медианой по отсортированному списку"""
+    n = len(values)
+    if not n:
+        return None
+    if n % 2:
+        return select_ranks(values, (n//2,))[0]
+    return sum(select_ranks(values, (n//2-1, n//2)))/2.0
+
+
+def select_top(sums, size):
+    """
+    Номера size наибольших значений массива sums по убыванию. При равенстве
+    значений первым идет меньший номер, как при устойчивой сортировке.
+    """
+
+    return heapq.nlargest(size, range(len(sums)), key=sums.__getitem__)
+
+
+def get_stats(time_dict, size, variants=None):
+    """
+    Строки таблицы отчета для size URL с наибольшим суммарным временем.
+    Суммы и количества по всем URL собираются в типизированные массивы,
+    индексированные номером URL в time_dict, за один проход, наибольшие
+    суммы выбираются частичным отбором, а медианы - выбором порядковой
+    статистики без сортировки. Если задан словарь variants
+    {шаблон: число исходных URL}, то это число добавляется в строки
+    под ключом url_variants. Для сводки HeavyHitters строки строятся
+    функцией get_heavy_stats.
+    """
+
+    if isinstance(time_dict, HeavyHitters):
+        return get_heavy_stats(time_dict, size)
+    urls = list(time_dict.keys())
+    groups = list(time_dict.values())
+    if groups and isinstance(groups[0], QuantileSketch):
+        sums = array('d', [sketch.total for sketch in groups])
+    else:
+        sums = array('d', map(sum, groups))
+    counts = array('q', map(len, groups))
+    all_time = functools.reduce(operator.add, sums, 0.0)
+    N = sum(counts)
     out_list = list()
     logging.info('Вычисление выходных значений величин для таблицы отчета')
-    for url, sum_value in time_sorted[:size]:
-        n = len(time_dict[url])
-        temp = sorted(time_dict[url])
-        out_list.append({'count': n,
-                        'time_avg': sum_value/n,
-                        'time_max': max(time_dict[url]),
-                        'time_sum': sum_value,
-                        'url': url,
-                        'time_med': (sum(temp[n//2-1:n//2+1])/2.0, temp[n//2])[n % 2] if n else None,
-                        'time_perc': sum_value/all_time,
-                        'count_perc': n/N
-                        })
+    for i in select_top(sums, size):
+        url, times, sum_value = urls[i], groups[i], sums[i]
+        if isinstance(times, QuantileSketch):
+            row = get_sketch_stats(times, url, sum_value, all_time, N)
+        else:
+            n = counts[i]
+            row = {'count': n,
+                   'time_avg': sum_value/n,
+                   'time_max': max(times),
+                   'time_sum': sum_value,
+                   'url': url,
+                   'time_med': get_median(times),
+                   'time_perc': sum_value/all_time,
+                   'count_perc': n/N
+                   }
+        if variants is not None:
+            row['url_variants'] = variants.get(url, 1)
+        out_list.append(row)
+    return out_list
+
+
+def get_sketch_stats(sketch, url, sum_value, all_time, N):
+    """Строка таблицы отчета для URL, времена которого собраны в скетч"""
+    n = sketch.count
+    row = {'count': n,
+           'time_avg': sum_value/n,
+           'time_max': sketch.max,
+           'time_sum': sum_value,
+           'url': url,
+           'time_med': sketch.quantile(0.5),
+           'time_perc': sum_value/all_time,
+           'count_perc': n/N
+           }
+    for key, q in SKETCH_QUANTILES.items():
+        row[key] = sketch.quantile(q)
+    return row
+
+
+def get_heavy_stats(hitters, size):
+    """
+    Строки таблицы отчета для size URL с наибольшей оценкой суммарного
+    времени в сводке HeavyHitters. Колонка time_sum содержит оценку сверху,
+    time_sum_error - ее погрешность: истинная сумма не меньше
+    time_sum - time_sum_error. Количество, среднее, медиана и квантили
+    вычисляются по запросам с начала отслеживания URL, а доли - от суммы
+    и количества по всем строкам log-файла.
+    """
+
+    logging.info('Вычисление выходных значений величин для таблицы отчета по {} отслеживаемым URL'.format(
+        len(hitters)))
+    out_list = list()
+    for url, total, error, sketch in hitters.top(size):
+        row = get_sketch_stats(sketch, url, total, hitters.total, hitters.count)
+        row['time_avg'] = sketch.total / sketch.count
+        row['time_sum_error'] = error
+        out_list.append(row)
+    return out_list
+
+
+def get_url_stats(time_dict, variants=None):
+    """
+    Колонки статистики по всем URL из time_dict в порядке словаря: количество,
+    сумма, максимум и медиана времен запросов, а для скетчей также квантили
+    SKETCH_QUANTILES. Значения совпадают с вычисляемыми в get_stats.
+    Если задан словарь variants, добавляется колонка url_variants.
+    """
+
+    columns = [('count', array('q')), ('time_sum', array('d')), ('time_max', array('d')), ('time_med', array('d'))]
+    quantiles = []
+    if any(isinstance(times, QuantileSketch) for times in time_dict.values()):
+        quantiles = [(key, array('d')) for key in SKETCH_QUANTILES]
+    counts, sums, maxes, medians = (column for _, column in columns)
+    for times in time_dict.values():
+        if isinstance(times, QuantileSketch):
+            counts.append(times.count)
+            sums.append(times.total)
+            maxes.append(times.max)
+            medians.append(times.quantile(0.5))
+            for key, column in quantiles:
+                column.append(times.quantile(SKETCH_QUANTILES[key]))
+            continue
+        counts.append(len(times))
+        sums.append(sum(times))
+        maxes.append(max(times))
+        medians.append(get_median(times))
+    if variants is not None:
+        quantiles.append(('url_variants', array('q', [variants.get(url, 1) for url in time_dict])))
+    return columns + quantiles
+
+
+def get_cache_path(config, file_name):
+    """
+    Путь к файлу агрегатов log-файла file_name, None если CACHE_DIR не задан
+    или задан режим агрегации "heavy", в котором хранятся не все URL.
+    """
+
+    if 'CACHE_DIR' not in config.keys() or config.get('AGGREGATION') == 'heavy':
+        return None
+    return os.path.join(config['CACHE_DIR'], file_name + '.stats')
+
+
+def save_stats_cache(path, identity, result, sketch_accuracy=None, normalizer=None):
+    """
+    Сохраняет агрегаты по URL из результата разбора log-файла в файл path.
+    При нормализации URL сохраняются правила и число исходных URL для шаблонов.
+    """
+
+    time_dict, good_count, bad_count = result
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    meta = {'version': STATS_CACHE_VERSION,
+            'identity': identity,
+            'sketch_accuracy': sketch_accuracy,
+            'url_rules': normalizer.rules if normalizer is not None else None,
+            'good_count': good_count,
+            'bad_count': bad_count}
+    variants = normalizer.variant_counts() if normalizer is not None else None
+    temp_path = path + '.tmp'
+    write_stats_cache(temp_path, meta, list(time_dict.keys()), get_url_stats(time_dict, variants))
+    os.replace(temp_path, path)
+    logging.info('Агрегаты log-файла сохранены в файл {}'.format(path))
+
+
+def load_stats_cache(path, identity, sketch_accuracy=None, url_rules=None):
+    """
+    Открывает файл агрегатов path. Возвращает None, если файла нет или он
+    построен по другой версии log-файла либо в другом режиме агрегации
+    или нормализации URL.
+    """
+
+    if not os.path.isfile(path):
+        return None
+    try:
+        cache = StatsCache(path)
+    except (OSError, ValueError):
+        logging.exception('Файл агрегатов {} поврежден и будет перезаписан'.format(path))
+        return None
+    if (cache.meta.get('version') != STATS_CACHE_VERSION or cache.meta.get('identity') != identity
+            or cache.meta.get('sketch_accuracy') != sketch_accuracy or cache.meta.get('url_rules') != url_rules):
+        logging.info('Файл агрегатов {} устарел'.format(path))
+        cache.close()
+        return None
+    logging.info('Агрегаты log-файла загружены из файла {}'.format(path))
+    return cache
+
+
+def get_stats_from_cache(cache, size):
+    """Аналог get_stats для агрегатов, загруженных из файла StatsCache"""
+    counts, sums = cache.columns['count'], cache.columns['time_sum']
+    all_time = functools.reduce(operator.add, sums, 0.0)
+    N = sum(counts)
+    logging.info('Вычисление выходных значений величин для таблицы отчета')
+    out_list = list()
+    for i in select_top(sums, size):
+        n, sum_value = counts[i], sums[i]
+        row = {'count': n,
+               'time_avg': sum_value/n,
+               'time_max': cache.columns['time_max'][i],
+               'time_sum': sum_value,
+               'url': cache.url(i),
+               'time_med': cache.columns['time_med'][i],
+               'time_perc': sum_value/all_time,
+               'count_perc': n/N
+               }
+        for key in list(SKETCH_QUANTILES) + ['url_variants']:
+            if key in cache.columns:
+                row[key] = cache.columns[key][i]
+        out_list.append(row)
     return out_list
 
 
@@ -209,18 +1189,644 @@ def round_values_in_list(target, number):
     return target
 
 
-def create_report(data_list, path):
-    with open('report.html', 'r') as f:
+def load_template(path=REPORT_TEMPLATE):
+    """
+    Шаблон отчета path в виде списка частей: строки текста и имена
+    подстановок из REPORT_FIELDS. Файл шаблона читается один раз и
+    перечитывается только при изменении.
+    """
+
+    key, mtime = os.path.abspath(path), os.stat(path).st_mtime
+    cached = TEMPLATE_CACHE.get(key)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r', encoding=ENCODING) as f:
             html_template = f.read()
+        marks = {name: '\0{}\0'.format(name) for name in REPORT_FIELDS}
+        text = Template(html_template).safe_substitute(marks)
+        names = {mark: name for name, mark in marks.items()}
+        parts = re.split('({})'.format('|'.join(marks.values())), text)
+        cached = TEMPLATE_CACHE[key] = (mtime, [names.get(part, part) for part in parts])
+    return cached[1]
+
+
+def open_report(path, compress=False):
+    """Текстовый поток для записи файла отчета, при compress - сжатого gzip"""
+    if compress:
+        return gzip.open(path, 'wt', encoding=ENCODING)
+    return open(path, 'w', encoding=ENCODING)
+
+
+def write_json_rows(output, rows):
+    """
+    Записывает строки таблицы rows в поток output json-массивом по одной
+    строке за раз. Последовательность "</" экранируется, чтобы значения
+    не могли закрыть тег script.
+    """
+
+    output.write('[')
+    for i, row in enumerate(rows):
+        if i:
+            output.write(',\n')
+        output.write(json.dumps(row).replace('</', '<\\/'))
+    output.write(']')
+
+
+def create_report(data_list, path, compress=False, page_size=None, template_path=REPORT_TEMPLATE):
+    """
+    Записывает отчет по строкам таблицы data_list (список или итератор) в path,
+    при compress - сжатым gzip в path + '.gz'. Строки записываются в поток
+    по одной. Если задан page_size, то в html-файл попадают первые page_size
+    строк, а остальные записываются страницами по page_size строк в файлы
+    <отчет>.data/page-NNNNNN.js, которые страница загружает при прокрутке
+    по префиксу и суффиксу имени из $table_pages. При compress рядом с каждой
+    страницей записывается и ее сжатая копия page-NNNNNN.js.gz: nginx
+    с gzip_static отдает ее по запросу page-NNNNNN.js клиентам с поддержкой
+    gzip, остальные получают несжатый файл.
+    Возвращает путь к записанному html-файлу.
+    """
 
+    parts = load_template(template_path)
     dirname = os.path.dirname(path)
     if not os.path.exists(dirname):
         os.makedirs(dirname)
+    data_dir = get_side_path(path, '.data')
+    if os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
 
-    with open(path, 'w') as out_report:
-        html_out = Template(html_template).safe_substitute(table_json=str(data_list))
-        out_report.write(html_out)
+    rows = iter(data_list)
+    first_page = list(itertools.islice(rows, page_size)) if page_size else rows
+    next_row = next(rows, None) if page_size else None
+    pages = None
+    if next_row is not None:
+        pages = {'prefix': os.path.basename(data_dir) + '/page-', 'suffix': '.js', 'size': page_size}
+
+    if compress:
+        path += '.gz'
+    with open_report(path, compress) as out_report:
+        for part in parts:
+            if part == 'table_json':
+                write_json_rows(out_report, first_page)
+            elif part == 'table_pages':
+                out_report.write(json.dumps(pages))
+            else:
+                out_report.write(part)
+
+    if next_row is not None:
+        os.makedirs(data_dir)
+        rows = itertools.chain([next_row], rows)
+        for number in itertools.count(1):
+            page = list(itertools.islice(rows, page_size))
+            if not page:
+                break
+            page_path = os.path.join(data_dir, 'page-{:06d}{}'.format(number, pages['suffix']))
+            with open_report(page_path) as page_file:
+                page_file.write('reportPage({}, '.format(number))
+                write_json_rows(page_file, page)
+                page_file.write(');\n')
+            if compress:
+                with open(page_path, 'rb') as page_file, gzip.open(page_path + '.gz', 'wb') as gzip_file:
+                    shutil.copyfileobj(page_file, gzip_file)
+        logging.info('Страницы таблицы отчета записаны в директорию {}'.format(data_dir))
     logging.info('Результат отчета записаны в файл {}'.format(path))
+    return path
+
+
+def report_written(report_name):
+    """Проверяет, существует ли отчет report_name, в том числе сжатый"""
+    return os.path.isfile(report_name) or os.path.isfile(report_name + '.gz')
+
+
+def check_fail_perc(config, good_count, bad_count):
+    """
+    Проверяет, что доля неудачно распознанных строк не превышает FAIL_PERC.
+    Возвращает True, если проверка пройдена или FAIL_PERC не задан.
+    """
+
+    if 'FAIL_PERC' not in config.keys():
+        return True
+    fail_limit = config['FAIL_PERC'] * 100
+    bad_percent = bad_count / (good_count+bad_count) * 100
+    bad_percent = round(bad_percent, 3)
+    fail_limit = round(fail_limit, 3)
+    tmp_str = 'Доля неудачно обработанных строк во входном log-файле {}%, что {} допустимого {}%'
+    tmp_str = tmp_str.format(bad_percent, '{}', fail_limit)
+    if  bad_percent > fail_limit:
+        logging.error(tmp_str.format('выше'))
+        return False
+    logging.info(tmp_str.format('ниже'))
+    return True
+
+
+def sample_lines(path, size=FAIL_SAMPLE, external=False, seed=None):
+    """
+    Выборка около size строк bytes log-файла path для предварительной
+    проверки FAIL_PERC. Возвращает два списка: первые строки файла и строки,
+    начинающиеся после переводов строки в случайных позициях. Для plain
+    log-файла выборка делится между ними поровну, сжатый log-файл нельзя
+    читать с произвольной позиции, поэтому для него берутся только первые
+    строки. Если файл короче половины выборки, возвращаются все его строки.
+    """
+
+    plain = get_codec(path) is None
+    head_size = size // 2 if plain else size
+    with contextlib.closing(read_log(path, external)) as lines:
+        head = list(itertools.islice(lines, head_size))
+    if not plain or len(head) < head_size:
+        return head, []
+    rnd = random.Random(seed)
+    sample = []
+    with map_file(path) as mapped:
+        end = len(mapped)
+        for _ in range(size - head_size):
+            start = mapped.find(b'\n', rnd.randrange(end)) + 1
+            if not start or start >= end:
+                continue
+            line_end = mapped.find(b'\n', start)
+            sample.append(mapped[start:line_end if line_end >= 0 else end].rstrip(b'\r'))
+    return head, sample
+
+
+def get_fail_bound(bad_count, count, z=FAIL_SAMPLE_Z):
+    """
+    Нижняя граница доверительного интервала Уилсона для доли неудачно
+    распознанных строк по выборке из count строк, z - квантиль нормального
+    распределения (3.0 - около 99.9% для односторонней границы).
+    """
+
+    if not count:
+        return 0.0
+    ratio = bad_count / count
+    center = ratio + z * z / (2 * count)
+    margin = z * math.sqrt(ratio * (1 - ratio) / count + z * z / (4 * count * count))
+    return (center - margin) / (1 + z * z / count)
+
+
+def precheck_fail_perc(config, path):
+    """
+    Предварительная проверка FAIL_PERC по выборке FAIL_SAMPLE строк log-файла
+    path до полного разбора. Возвращает False, только если доля неудачно
+    распознанных строк с уверенностью выше FAIL_PERC: нижняя граница
+    доверительного интервала выше допустимой доли и для первых строк файла,
+    и для строк из случайных позиций. Точная проверка check_fail_perc после
+    полного разбора выполняется в любом случае.
+    """
+
+    size = config.get('FAIL_SAMPLE', FAIL_SAMPLE)
+    if 'FAIL_PERC' not in config.keys() or not size:
+        return True
+    parts = [lines for lines in sample_lines(path, size, config.get('EXTERNAL_DECOMPRESS', False)) if lines]
+    bad_counts = [sum(entry is None for entry in parse_lines(lines)) for lines in parts]
+    count, bad_count = sum(map(len, parts)), sum(bad_counts)
+    if not count:
+        return True
+    rejected = all(get_fail_bound(bad, len(lines)) > config['FAIL_PERC'] for bad, lines in zip(bad_counts, parts))
+    tmp_str = 'Оценка доли неудачно обработанных строк по выборке из {} строк: {}%'.format(
+        count, round(bad_count / count * 100, 3))
+    if rejected:
+        logging.error('{}, что уверенно выше допустимого {}%'.format(tmp_str, round(config['FAIL_PERC'] * 100, 3)))
+        return False
+    logging.info(tmp_str)
+    return True
+
+
+def get_sketch_accuracy(config):
+    """Точность скетча для режима агрегации из конфигурации, None для точного режима"""
+    aggregation = config.get('AGGREGATION', 'exact')
+    if aggregation not in AGGREGATIONS:
+        raise ValueError('Неизвестный режим агрегации "{}", допустимые значения: {}'.format(aggregation, ', '.join(AGGREGATIONS)))
+    return config.get('SKETCH_ACCURACY', 0.01) if aggregation in ('sketch', 'heavy') else None
+
+
+def get_heavy_capacity(config):
+    """
+    Количество отслеживаемых URL в режиме агрегации "heavy": HEAVY_FACTOR
+    (по умолчанию 10), умноженный на REPORT_SIZE, None для других режимов.
+    """
+
+    if config.get('AGGREGATION', 'exact') != 'heavy':
+        return None
+    return max(int(config.get('HEAVY_FACTOR', 10) * config['REPORT_SIZE']), 1)
+
+
+def get_url_normalizer(config):
+    """Нормализатор URL по правилам URL_RULES из конфигурации, None если правила не заданы"""
+    url_rules = config.get('URL_RULES')
+    return UrlNormalizer(url_rules) if url_rules else None
+
+
+def get_time_series(config):
+    """
+    Временные ряды TimeSeries с интервалом TIME_BUCKET из конфигурации,
+    None если TIME_BUCKET не задан. Квантили оцениваются скетчами с точностью
+    SKETCH_ACCURACY только в режимах агрегации со скетчами, иначе времена
+    хранятся полностью и квантили вычисляются точно.
+    """
+
+    unit = config.get('TIME_BUCKET')
+    return TimeSeries(unit, get_sketch_accuracy(config)) if unit else None
+
+
+def save_time_series(series, out_list, report_name, time_dict=None):
+    """
+    Записывает временные ряды для URL из таблицы отчета в файл
+    <отчет>.timeseries.json. Для точных временных рядов времена берутся
+    из словаря time_dict основной агрегации.
+    """
+
+    path = get_side_path(report_name, '.timeseries.json')
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w', encoding=ENCODING) as series_file:
+        json.dump(series.report([row['url'] for row in out_list], time_dict), series_file)
+    logging.info('Временные ряды записаны в файл {}'.format(path))
+
+
+def get_groups(config):
+    """
+    Группировки GroupBy по спискам полей GROUP_BY из конфигурации, None если
+    GROUP_BY не задан.
+    """
+
+    specs = config.get('GROUP_BY')
+    return [GroupBy(keys) for keys in specs] if specs else None
+
+
+def save_group_reports(groups, report_name, config):
+    """Записывает таблицу каждой группировки в отчет <отчет>.<поля через дефис>.html"""
+    for group in groups:
+        build_report(group.get_rows(config['REPORT_SIZE']), get_side_path(report_name, '.{}.html'.format(group.name)),
+                     config=config)
+
+
+def get_side_path(report_name, suffix):
+    """Путь к файлу рядом с отчетом report_name: имя отчета без расширения и suffix"""
+    return os.path.splitext(report_name)[0] + suffix
+
+
+def get_profiler(config, report_name):
+    """
+    Профайлер режима PROFILE из конфигурации, пишущий результат рядом
+    с отчетом report_name, либо пустой контекст, если PROFILE не задан.
+    """
+
+    mode = config.get('PROFILE')
+    if not mode:
+        return contextlib.nullcontext()
+    suffix = '.prof' if mode == 'cprofile' else '.stacks'
+    return Profiler(mode, get_side_path(report_name, suffix), config.get('PROFILE_INTERVAL', 0.005))
+
+
+def save_metrics(config, metrics, report_name):
+    """Записывает измерения стадий в файл <отчет>.metrics.json, если METRICS не отключен"""
+    if not config.get('METRICS', True):
+        return
+    path = get_side_path(report_name, '.metrics.json')
+    metrics.save(path)
+    logging.info('Измерения стадий обработки записаны в файл {}'.format(path))
+
+
+def parse_stage(record, identity, result):
+    """Дописывает в словарь стадии разбора количество строк, URL и размер log-файла"""
+    record['lines'] = result[1] + result[2]
+    record['bad_lines'] = result[2]
+    record['urls'] = len(result[0])
+    record['file_bytes'] = identity['size']
+
+
+def build_report(out_list, report_name, metrics=None, config=dict()):
+    """Записывает отчет с параметрами REPORT_GZIP и REPORT_PAGE_SIZE из конфигурации"""
+    with metrics.stage('report') if metrics is not None else contextlib.nullcontext() as record:
+        out_list = round_values_in_list(out_list, 4)
+        path = create_report(out_list, report_name, config.get('REPORT_GZIP', False), config.get('REPORT_PAGE_SIZE'))
+        if record is not None:
+            record['rows'] = len(out_list)
+            record['report_bytes'] = os.path.getsize(path)
+
+
+def process_log(args):
+    """
+    Полная обработка одного log-файла в режиме BACKFILL: разбор, проверка
+    FAIL_PERC и создание отчета. Возвращает имя файла, признак успеха
+    и описание результата.
+    """
+
+    file_name, config = args
+    file_date = re.search(RE_FILE_NAME, file_name).groupdict()['file_date']
+    try:
+        full_name = os.path.join(config['LOG_DIR'], file_name)
+        report_name = get_report_name(config['REPORT_DIR'], file_date)
+        metrics = Metrics(COUNTERS)
+        metrics.info.update({'log_file': full_name, 'report': report_name, 'workers': 1})
+        sketch_accuracy = get_sketch_accuracy(config)
+        capacity = get_heavy_capacity(config)
+        normalizer = get_url_normalizer(config)
+        series = get_time_series(config)
+        groups = get_groups(config)
+        url_rules = normalizer.rules if normalizer is not None else None
+        identity = get_file_identity(full_name)
+        cache_path = get_cache_path(config, file_name)
+        cache = None
+        if cache_path and series is None and not groups:
+            with metrics.stage('cache_load'):
+                cache = load_stats_cache(cache_path, identity, sketch_accuracy, url_rules)
+        if cache is not None:
+            with cache, metrics.stage('stats'):
+                good_count, bad_count = cache.meta['good_count'], cache.meta['bad_count']
+                out_list = get_stats_from_cache(cache, config['REPORT_SIZE'])
+        else:
+            with metrics.stage('precheck'):
+                passed = precheck_fail_perc(config, full_name)
+            if not passed:
+                save_metrics(config, metrics, report_name)
+                return file_name, False, 'доля неудачно обработанных строк в выборке выше допустимой'
+            with metrics.stage('parse') as record:
+                result = get_request_times_from_log(full_name, 1, sketch_accuracy,
+                                                    config.get('EXTERNAL_DECOMPRESS', False), normalizer, series,
+                                                    groups, capacity)
+                parse_stage(record, identity, result)
+            if cache_path:
+                with metrics.stage('cache_save'):
+                    save_stats_cache(cache_path, identity, result, sketch_accuracy, normalizer)
+            time_dict, good_count, bad_count = result
+        if not check_fail_perc(config, good_count, bad_count):
+            save_metrics(config, metrics, report_name)
+            return file_name, False, 'доля неудачно обработанных строк выше допустимой'
+        if cache is None:
+            with metrics.stage('stats'):
+                variants = normalizer.variant_counts() if normalizer is not None else None
+                out_list = get_stats(time_dict, config['REPORT_SIZE'], variants)
+        if series is not None:
+            with metrics.stage('timeseries'):
+                save_time_series(series, out_list, report_name, time_dict)
+        if groups:
+            with metrics.stage('groups'):
+                save_group_reports(groups, report_name, config)
+        build_report(out_list, report_name, metrics, config)
+        save_metrics(config, metrics, report_name)
+        return file_name, True, report_name
+    except Exception as e:
+        logging.exception('Ошибка обработки log-файла {}'.format(file_name))
+        return file_name, False, 'ошибка обработки: {}'.format(e)
+
+
+def backfill(config):
+    """
+    Создает отчеты по всем log-файлам из LOG_DIR, для которых их еще нет.
+    Файлы обрабатываются параллельно в BACKFILL_WORKERS процессах, каждый
+    в одном процессе, проверка FAIL_PERC выполняется для каждого файла
+    отдельно. Возвращает список результатов process_log.
+    """
+
+    file_names = find_unreported_logs(config['LOG_DIR'], config['REPORT_DIR'])
+    if not file_names:
+        logging.info('Отчеты по всем log-файлам уже существуют.')
+        return []
+    workers = min(config.get('BACKFILL_WORKERS', os.cpu_count() or 1), len(file_names))
+    logging.info('Обработка {} log-файлов без отчетов в {} процессах'.format(len(file_names), workers))
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(process_log, [(file_name, config) for file_name in file_names], chunksize=1)
+
+    succeeded = [file_name for file_name, ok, _ in results if ok]
+    logging.info('Успешно обработано log-файлов: {} из {}'.format(len(succeeded), len(results)))
+    for file_name, ok, message in results:
+        if ok:
+            logging.info('{}: отчет записан в файл {}'.format(file_name, message))
+        else:
+            logging.error('{}: {}'.format(file_name, message))
+    return results
+
+
+def get_partial_settings(sketch_accuracy=None, capacity=None, normalizer=None, series=None, groups=None):
+    """Параметры агрегации, которые должны совпадать у сливаемых файлов частичных агрегатов"""
+    return {'sketch_accuracy': sketch_accuracy,
+            'capacity': capacity,
+            'url_rules': normalizer.rules if normalizer is not None else None,
+            'series_spec': [series.unit, series.accuracy] if series is not None else None,
+            'group_keys': [group.keys for group in groups] if groups else None}
+
+
+def get_partial_path(config, file_name):
+    """
+    Путь к файлу частичных агрегатов log-файла file_name в PARTIAL_DIR
+    (по умолчанию REPORT_DIR). В имя входит NODE_NAME (по умолчанию имя
+    хоста), чтобы файлы одноименных log-файлов разных серверов можно было
+    собрать в одну директорию.
+    """
+
+    node = config.get('NODE_NAME') or platform.node() or 'node'
+    return os.path.join(config.get('PARTIAL_DIR', config['REPORT_DIR']),
+                        '{}.{}{}'.format(file_name, node, PARTIAL_SUFFIX))
+
+
+def save_partial(path, file_date, identity, result, settings, normalizer=None, series=None, groups=None):
+    """
+    Атомарно записывает сжатый gzip json-файл частичных агрегатов одного
+    log-файла: версию формата, дату и идентификатор log-файла, параметры
+    агрегации, количества строк, времена запросов по URL, а также счетчики
+    различных исходных URL по шаблонам, временные ряды и группировки, если
+    они собирались.
+    """
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    partial = dict(settings)
+    partial.update({'version': PARTIAL_VERSION,
+                    'file_date': file_date,
+                    'identity': identity,
+                    'good_count': result[1],
+                    'bad_count': result[2],
+                    'time_dict': dump_time_dict(result[0]),
+                    'url_variants': normalizer.variants_to_dict() if normalizer is not None else None,
+                    'time_series': series.to_dict() if series is not None else None,
+                    'groups': [group.to_dict() for group in groups] if groups else None})
+    temp_path = path + '.tmp'
+    with gzip.open(temp_path, 'wt', encoding=ENCODING) as partial_file:
+        json.dump(partial, partial_file, separators=(',', ':'))
+    os.replace(temp_path, path)
+    logging.info('Частичные агрегаты записаны в файл {}'.format(path))
+
+
+def load_partial(path):
+    """Читает файл частичных агрегатов, ValueError при неподдерживаемой версии формата"""
+    with gzip.open(path, 'rt', encoding=ENCODING) as partial_file:
+        partial = json.load(partial_file)
+    if partial.get('version') != PARTIAL_VERSION:
+        raise ValueError('Неподдерживаемая версия {} файла частичных агрегатов {}'.format(
+            partial.get('version'), path))
+    return partial
+
+
+def find_partials(paths):
+    """Файлы частичных агрегатов из списка paths файлов и директорий"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.endswith(PARTIAL_SUFFIX)))
+        else:
+            found.append(path)
+    return found
+
+
+def write_partials(config, force=False):
+    """
+    Режим частичных агрегатов: для каждого log-файла из LOG_DIR, для которого
+    еще нет файла частичных агрегатов (или для всех при force), записывает
+    такой файл вместо отчета. Проверка FAIL_PERC выполняется при слиянии
+    по всем строкам. Возвращает список путей записанных файлов.
+    """
+
+    sketch_accuracy = get_sketch_accuracy(config)
+    capacity = get_heavy_capacity(config)
+    written = []
+    for file_name in sorted(os.listdir(config['LOG_DIR'])):
+        data = re.search(RE_FILE_NAME, file_name)
+        full_name = os.path.join(config['LOG_DIR'], file_name)
+        if not data or not os.path.isfile(full_name):
+            continue
+        path = get_partial_path(config, file_name)
+        if os.path.isfile(path) and not force:
+            continue
+        normalizer = get_url_normalizer(config)
+        series = get_time_series(config)
+        groups = get_groups(config)
+        identity = get_file_identity(full_name)
+        result = get_request_times_from_log(full_name, config.get('WORKERS', 1), sketch_accuracy,
+                                            config.get('EXTERNAL_DECOMPRESS', False), normalizer, series, groups,
+                                            capacity)
+        settings = get_partial_settings(sketch_accuracy, capacity, normalizer, series, groups)
+        save_partial(path, data.groupdict()['file_date'], identity, result, settings, normalizer, series, groups)
+        written.append(path)
+    logging.info('Записано файлов частичных агрегатов: {}'.format(len(written)))
+    return written
+
+
+def merge_partials(paths, config):
+    """
+    Сливает файлы частичных агрегатов paths (файлы или директории с ними)
+    в один отчет в REPORT_DIR за самую позднюю из их дат. Параметры агрегации
+    всех файлов должны совпадать. Файлы сливаются в порядке paths, и отчет
+    совпадает с отчетом по log-файлу, склеенному из исходных в том же порядке.
+    Возвращает путь к отчету либо None, если доля нераспознанных строк выше
+    FAIL_PERC.
+    """
+
+    paths = find_partials(paths)
+    if not paths:
+        raise ValueError('Не найдено файлов частичных агрегатов')
+    partials = [load_partial(path) for path in paths]
+    settings = {key: partials[0][key] for key in get_partial_settings()}
+    for path, partial in zip(paths, partials):
+        if any(partial[key] != value for key, value in settings.items()):
+            raise ValueError('Параметры агрегации файла {} отличаются от параметров файла {}'.format(path, paths[0]))
+    capacity = settings['capacity']
+    normalizer = UrlNormalizer(settings['url_rules']) if settings['url_rules'] else None
+    series = TimeSeries(*settings['series_spec']) if settings['series_spec'] else None
+    groups = [GroupBy(keys) for keys in settings['group_keys']] if settings['group_keys'] else None
+
+    report_name = get_report_name(config['REPORT_DIR'], max(partial['file_date'] for partial in partials))
+    metrics = Metrics(COUNTERS)
+    metrics.info.update({'partials': paths, 'report': report_name})
+    with metrics.stage('merge') as record:
+        result = (HeavyHitters(capacity, settings['sketch_accuracy']) if capacity else dict(), 0, 0)
+        for partial in partials:
+            restore_state(partial, normalizer, series, groups)
+            result = merge_aggregates(result, (load_time_dict(partial['time_dict'], capacity), partial['good_count'],
+                                               partial['bad_count']))
+        record['lines'] = result[1] + result[2]
+        record['bad_lines'] = result[2]
+        record['urls'] = len(result[0])
+    time_dict, good_count, bad_count = result
+    logging.info('Слито файлов частичных агрегатов: {}'.format(len(paths)))
+    if not check_fail_perc(config, good_count, bad_count):
+        save_metrics(config, metrics, report_name)
+        return None
+    with metrics.stage('stats'):
+        variants = normalizer.variant_counts() if normalizer is not None else None
+        out_list = get_stats(time_dict, config['REPORT_SIZE'], variants)
+    if series is not None:
+        with metrics.stage('timeseries'):
+            save_time_series(series, out_list, report_name, time_dict)
+    if groups:
+        with metrics.stage('groups'):
+            save_group_reports(groups, report_name, config)
+    build_report(out_list, report_name, metrics, config)
+    save_metrics(config, metrics, report_name)
+    return report_name
+
+
+def get_merge_paths(options):
+    """Аргументы опции запуска --merge до следующей опции"""
+    paths = []
+    for option in options[options.index('--merge') + 1:]:
+        if option.startswith('--'):
+            break
+        paths.append(option)
+    return paths
+
+
+def get_watch_log(config):
+    """
+    Путь к отслеживаемому в режиме WATCH log-файлу: WATCH_LOG из конфигурации
+    либо последний log-файл из LOG_DIR.
+    """
+
+    if config.get('WATCH_LOG'):
+        return config['WATCH_LOG']
+    return os.path.join(config['LOG_DIR'], find_last_log(config['LOG_DIR']))
+
+
+def write_window_reports(windows, config, now):
+    """Перезаписывает отчеты live-<окно>.html по всем скользящим окнам на момент now"""
+    for window in windows.windows:
+        report_name = os.path.join(config['REPORT_DIR'], 'live-{}.html'.format(get_window_name(window)))
+        out_list = get_stats(windows.get_time_dict(window, now), config['REPORT_SIZE'])
+        build_report(out_list, report_name, config=config)
+
+
+def watch(config, iterations=None, clock=time.time, sleep=time.sleep):
+    """
+    Режим WATCH: следит за дописываемым log-файлом, раз в WATCH_POLL секунд
+    разбирает новые строки и добавляет их в скользящие окна WATCH_WINDOWS,
+    а раз в WATCH_INTERVAL секунд перезаписывает отчеты по окнам. Ротация
+    log-файла определяется по смене inode. Работает до прерывания либо
+    iterations опросов log-файла.
+    """
+
+    path = get_watch_log(config)
+    windows = SlidingWindows(config.get('WATCH_WINDOWS', [300, 3600]), config.get('SKETCH_ACCURACY', 0.01))
+    normalizer = get_url_normalizer(config)
+    interval, poll = config.get('WATCH_INTERVAL', 60), config.get('WATCH_POLL', 1.0)
+    logging.info('Слежение за log-файлом {}, окна: {}'.format(
+        path, ', '.join(get_window_name(window) for window in windows.windows)))
+    next_report = clock()
+    good_count, bad_count, rotations = 0, 0, 0
+    with LogFollower(path) as follower:
+        while iterations is None or iterations > 0:
+            windows.expire(clock())
+            for entry in parse_lines(follower.read_lines(), with_time=True):
+                if entry:
+                    url = entry['request_url'] if normalizer is None else normalizer.normalize(entry['request_url'])
+                    windows.add(url, entry['time_local'], float(entry['request_time']))
+                    good_count += 1
+                else:
+                    bad_count += 1
+            if follower.rotations != rotations:
+                rotations = follower.rotations
+                logging.info('Ротация log-файла {}, чтение продолжено с начала нового файла'.format(path))
+            now = clock()
+            if now >= next_report:
+                windows.expire(now)
+                write_window_reports(windows, config, now)
+                logging.info('Отчеты по скользящим окнам обновлены, строк всего: {}, нераспознанных: {}'.format(
+                    good_count + bad_count, bad_count))
+                next_report = now + interval
+            if iterations is not None:
+                iterations -= 1
+            sleep(poll)
+    return good_count, bad_count
 
 
 def main(options=sys.argv):
@@ -235,7 +1841,70 @@ def main(options=sys.argv):
         "LOG_DIR": директория, содержащая входные log-файлы для обработки
         "FAIL_PERC": верхнее допустимое отношение неудачно распознанных строк входного лога,
                     превышение которого останавливает работу скрипта (по умолчанию 0.5)
+        "FAIL_SAMPLE": количество строк выборки для предварительной проверки FAIL_PERC
+                    до полного разбора (по умолчанию 2000, 0 - не проверять). Работа
+                    прерывается, если доля нераспознанных строк в выборке уверенно выше FAIL_PERC
         "OUT_LOG": путь выходного log-файл работы скрипта.
+        "WORKERS": количество процессов для разбора log-файла (по умолчанию 1)
+        "AGGREGATION": "exact" - хранить все времена запросов (по умолчанию),
+                    "sketch" - хранить для каждого URL скетч квантилей ограниченного размера
+                    "heavy" - отслеживать только HEAVY_FACTOR * REPORT_SIZE URL с наибольшим
+                    суммарным временем (Space-Saving), в отчет добавляется погрешность
+                    суммы time_sum_error
+        "HEAVY_FACTOR": во сколько раз число отслеживаемых URL в режиме "heavy" больше
+                    REPORT_SIZE (по умолчанию 10)
+        "SKETCH_ACCURACY": относительная точность квантилей в режимах "sketch" и "heavy"
+                    (по умолчанию 0.01)
+        "INCREMENTAL": при true состояние обработки сохраняется в файл "<REPORT_DIR>.state",
+                    и при повторном запуске обрабатывается только дописанная часть log-файла
+        "BACKFILL": при true (или опции запуска --backfill) создаются отчеты по всем
+                    log-файлам без отчета, а не только по последнему
+        "BACKFILL_WORKERS": количество одновременно обрабатываемых log-файлов в режиме
+                    BACKFILL (по умолчанию количество процессоров)
+        "CACHE_DIR": директория для бинарных файлов агрегатов по URL. Если файл агрегатов
+                    соответствует log-файлу, то отчет строится по нему без разбора log-файла
+        "EXTERNAL_DECOMPRESS": при true gz log-файлы распаковываются внешней программой
+                    pigz, если она установлена
+        "URL_RULES": список правил нормализации URL в шаблоны: "query" - отбросить строку
+                    запроса, "uuid", "numeric", "hex" - заменить такие сегменты пути
+                    на {uuid}, {id}, {hex}. Отчет строится по шаблонам, в колонке
+                    url_variants указывается число свернутых в шаблон различных URL
+        "METRICS": при true (по умолчанию) рядом с отчетом записывается файл
+                    <отчет>.metrics.json с временем, процессорным временем, пиковой памятью,
+                    количеством строк и прочитанных байт для каждой стадии обработки
+        "PROFILE": "cprofile" - профилировать обработку cProfile в файл <отчет>.prof,
+                    "sampling" - семплирующим профайлером в файл свернутых стеков <отчет>.stacks
+        "PROFILE_INTERVAL": период семплирования в секундах процессорного времени (по умолчанию 0.005)
+        "TIME_BUCKET": "minute" или "hour" - дополнительно собирать для каждого URL количество,
+                    сумму и квантили p50/p99 времен запросов по минутам или часам поля time_local
+                    и записывать временные ряды для URL отчета в файл <отчет>.timeseries.json
+        "GROUP_BY": список группировок, каждая - список полей из url, status, request_type,
+                    remote_addr, http_referer, http_user_agent, например [["url", "status"],
+                    ["request_type"]]. Все группировки считаются за тот же проход по log-файлу,
+                    таблица каждой (count, time_sum, time_avg, time_max, bytes_sum и доли)
+                    записывается в отчет <отчет>.<поля через дефис>.html
+        "REPORT_GZIP": при true отчет записывается сжатым gzip в файл <отчет>.html.gz
+        "REPORT_PAGE_SIZE": количество строк таблицы в html-файле отчета. Остальные строки
+                    записываются страницами такого же размера в директорию <отчет>.data
+                    и загружаются страницей отчета при прокрутке
+        "WATCH": при true (или опции запуска --watch) скрипт не завершается, а следит
+                    за дописываемым log-файлом WATCH_LOG (по умолчанию последним из LOG_DIR),
+                    в том числе после его ротации, и раз в WATCH_INTERVAL секунд
+                    (по умолчанию 60) перезаписывает отчеты live-5m.html, live-1h.html
+                    по скользящим окнам WATCH_WINDOWS (по умолчанию [300, 3600] секунд)
+        "WATCH_POLL": период проверки log-файла на новые строки в секундах (по умолчанию 1)
+        "PARTIAL_DIR": директория для файлов частичных агрегатов (по умолчанию REPORT_DIR)
+        "NODE_NAME": имя сервера в именах файлов частичных агрегатов (по умолчанию имя хоста)
+
+    Log-файлы могут быть несжатыми (.plain) или сжатыми gzip (.gz), bzip2 (.bz2) и xz (.xz).
+
+    Опция запуска --force перезаписывает уже существующий отчет по последнему log-файлу.
+    Опция --watch включает режим WATCH.
+    Опция --partial вместо отчетов записывает для каждого log-файла из LOG_DIR сжатый
+    файл частичных агрегатов <log-файл>.<NODE_NAME>.partial.json.gz в PARTIAL_DIR.
+    Опция --merge path [path ...] сливает файлы частичных агрегатов (или все такие файлы
+    из директорий path), например собранные с нескольких серверов, в один отчет в REPORT_DIR
+    за самую позднюю из дат их log-файлов.
 
     В случае отсутствия опций запуска скрипт попытается считать конфигурационный файл
     из директории './configs/config.txt' относительно своего расположения, если операционной 
@@ -261,40 +1930,134 @@ def main(options=sys.argv):
             logging.info('Опция --config не указана, выбран файл конфигурации по умолчанию')
 
         config = get_new_config(config_dir, config)
-        
+        try:
+            fix_config_values(config)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit()
+
         if 'OUT_LOG' in config.keys():
             set_logging(config['OUT_LOG'])
             logging.info('Логгирование дополнительно ведется в файл {}'.format(config['OUT_LOG']))
-            
+
+        try:
+            sketch_accuracy = get_sketch_accuracy(config)
+            capacity = get_heavy_capacity(config)
+            normalizer = get_url_normalizer(config)
+            series = get_time_series(config)
+            groups = get_groups(config)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit()
+
+        if config.get('BACKFILL') or '--backfill' in options:
+            backfill(config)
+            logging.info('Работа скрипта успешно завершена.')
+            return
+
+        if '--partial' in options:
+            write_partials(config, '--force' in options)
+            logging.info('Работа скрипта успешно завершена.')
+            return
+
+        if '--merge' in options:
+            try:
+                report_name = merge_partials(get_merge_paths(options), config)
+            except ValueError as e:
+                logging.error(e)
+                sys.exit()
+            if report_name is not None:
+                logging.info('Отчет по слитым агрегатам записан в файл {}'.format(report_name))
+            return
+
+        if config.get('WATCH') or '--watch' in options:
+            try:
+                watch(config)
+            except KeyboardInterrupt:
+                logging.info('Слежение за log-файлом остановлено.')
+            return
+
         file_name = find_last_log(config['LOG_DIR'])
         file_date = re.search(RE_FILE_NAME, file_name).groupdict()['file_date']
-        date_year = file_date[:4]
-        date_month = file_date[4:6]
-        date_day = file_date[6:8]
-        if os.path.isfile(os.path.join(config['REPORT_DIR'],'report-{}.{}.{}.html'.format(date_year, date_month, date_day))):
+        report_name = get_report_name(config['REPORT_DIR'], file_date)
+        report_exists = report_written(report_name) and '--force' not in options
+        if report_exists and not config.get('INCREMENTAL'):
             logging.info('Выходной отчет по последнему log-файлу уже существует.')
             sys.exit()
         
         full_name = os.path.join(config['LOG_DIR'], file_name)
-        time_dict, good_count, bad_count  = get_request_times_from_log(full_name)
-
-        if 'FAIL_PERC' in config.keys():
-            fail_limit = config['FAIL_PERC'] * 100
-            bad_percent = bad_count / (good_count+bad_count) * 100
-            bad_percent = round(bad_percent, 3)
-            fail_limit = round(fail_limit, 3)
-            tmp_str = 'Доля неудачно обработанных строк во входном log-файле {}%, что {} допустимого {}%'
-            tmp_str = tmp_str.format(bad_percent, '{}', fail_limit)
-            if  bad_percent > fail_limit:
-                logging.error(tmp_str.format('выше'))
+        workers = config.get('WORKERS', 1)
+        metrics = Metrics(COUNTERS)
+        metrics.info.update({'log_file': full_name, 'report': report_name, 'workers': workers})
+        try:
+            profiler = get_profiler(config, report_name)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit()
+
+        with profiler:
+            identity = get_file_identity(full_name)
+            cache_path = get_cache_path(config, file_name)
+            url_rules = normalizer.rules if normalizer is not None else None
+            cache = None
+            if cache_path and series is None and not groups:
+                with metrics.stage('cache_load'):
+                    cache = load_stats_cache(cache_path, identity, sketch_accuracy, url_rules)
+            if cache is not None:
+                with cache:
+                    if report_exists:
+                        logging.info('Log-файл не изменился, выходной отчет по нему уже существует.')
+                        sys.exit()
+                    if not check_fail_perc(config, cache.meta['good_count'], cache.meta['bad_count']):
+                        save_metrics(config, metrics, report_name)
+                        sys.exit()
+                    with metrics.stage('stats'):
+                        out_list = get_stats_from_cache(cache, config['REPORT_SIZE'])
+                build_report(out_list, report_name, metrics, config)
+                save_metrics(config, metrics, report_name)
+                logging.info('Работа скрипта успешно завершена.')
+                return
+
+            with metrics.stage('precheck'):
+                passed = precheck_fail_perc(config, full_name)
+            if not passed:
+                save_metrics(config, metrics, report_name)
                 sys.exit()
-            else:
-                logging.info(tmp_str.format('ниже'))
+            with metrics.stage('parse') as record:
+                if config.get('INCREMENTAL'):
+                    state_path = config.get('STATE_FILE', config['REPORT_DIR'].rstrip('/\\') + '.state')
+                    result = get_request_times_incremental(full_name, state_path, workers,
+                                                           sketch_accuracy, report_exists,
+                                                           config.get('EXTERNAL_DECOMPRESS', False), normalizer,
+                                                           series, groups, capacity)
+                    if result is None:
+                        logging.info('Log-файл не изменился, выходной отчет по нему уже существует.')
+                        sys.exit()
+                else:
+                    result = get_request_times_from_log(full_name, workers, sketch_accuracy,
+                                                        config.get('EXTERNAL_DECOMPRESS', False), normalizer, series,
+                                                        groups, capacity)
+                parse_stage(record, identity, result)
+            if cache_path:
+                with metrics.stage('cache_save'):
+                    save_stats_cache(cache_path, identity, result, sketch_accuracy, normalizer)
+            time_dict, good_count, bad_count = result
 
-        out_list = get_stats(time_dict, config['REPORT_SIZE'])
-        out_list = round_values_in_list(out_list, 4)
-        report_name = os.path.join(config['REPORT_DIR'], 'report-{}.{}.{}.html'.format(date_year, date_month, date_day))
-        create_report(out_list, report_name)        
+            if not check_fail_perc(config, good_count, bad_count):
+                save_metrics(config, metrics, report_name)
+                sys.exit()
+
+            with metrics.stage('stats'):
+                variants = normalizer.variant_counts() if normalizer is not None else None
+                out_list = get_stats(time_dict, config['REPORT_SIZE'], variants)
+            if series is not None:
+                with metrics.stage('timeseries'):
+                    save_time_series(series, out_list, report_name, time_dict)
+            if groups:
+                with metrics.stage('groups'):
+                    save_group_reports(groups, report_name, config)
+            build_report(out_list, report_name, metrics, config)
+        save_metrics(config, metrics, report_name)
         logging.info('Работа скрипта успешно завершена.')
     except SystemExit:
         logging.info('Прерывание работы скрипта.')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Измерение стадий обработки log-файла и профилирование.
+
+Metrics записывает для каждой стадии время выполнения, процессорное время
+(включая завершившиеся дочерние процессы), пиковый объем резидентной памяти
+и приращения счетчиков (прочитанные байты, строки и т.п.). Profiler
+включает cProfile или простой семплирующий профайлер на время обработки.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import cProfile
+import contextlib
+import collections
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+PROFILERS = ('cprofile', 'sampling')
+
+
+def get_cpu_time():
+    """Процессорное время процесса и его завершившихся дочерних процессов в секундах"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def get_peak_rss():
+    """Пиковый объем резидентной памяти процесса в Кбайт, None если он недоступен"""
+    if resource is None:
+        return None
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+
+
+class Metrics:
+    """
+    Измерения стадий обработки. Стадия оформляется блоком with metrics.stage(name)
+    и возвращает словарь, в который можно дописать свои значения (например,
+    количество строк). В словарь стадии также попадают ненулевые приращения
+    счетчиков counters (collections.Counter) за время стадии. Общие сведения
+    о запуске можно добавить в словарь info.
+    """
+
+    def __init__(self, counters=None):
+        self.counters = counters if counters is not None else collections.Counter()
+        self.info = dict()
+        self.stages = []
+        self._start = time.perf_counter()
+        self._cpu_start = get_cpu_time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = {'stage': name}
+        counters = dict(self.counters)
+        wall, cpu = time.perf_counter(), get_cpu_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = get_cpu_time() - cpu
+            record['peak_rss_kb'] = get_peak_rss()
+            for key, value in self.counters.items():
+                if value != counters.get(key, 0):
+                    record[key] = value - counters.get(key, 0)
+            self.stages.append(record)
+
+    def to_dict(self):
+        return {'info': self.info,
+                'stages': self.stages,
+                'wall_seconds': time.perf_counter() - self._start,
+                'cpu_seconds': get_cpu_time() - self._cpu_start,
+                'peak_rss_kb': get_peak_rss()}
+
+    def save(self, path):
+        """Записывает измерения в json-файл path"""
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+
+class Profiler:
+    """
+    Профилирование блока with в главном процессе. В режиме "cprofile"
+    статистика cProfile записывается в path (читается модулем pstats),
+    в режиме "sampling" стек вызовов запоминается по сигналу SIGPROF каждые
+    interval секунд процессорного времени, и в path записываются свернутые
+    стеки в формате "функция;функция;... количество" для построения
+    flame graph. Процессы-исполнители не профилируются.
+    """
+
+    def __init__(self, mode, path, interval=0.005):
+        if mode not in PROFILERS:
+            raise ValueError('Неизвестный режим профилирования "{}", допустимые значения: {}'.format(mode, ', '.join(PROFILERS)))
+        if mode == 'sampling' and not hasattr(signal, 'setitimer'):
+            raise ValueError('Семплирующий профайлер не поддерживается в этой операционной системе')
+        self.mode = mode
+        self.path = path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._profile = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *args):
+        if self.mode == 'cprofile':
+            self._profile.disable()
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._handler)
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        if self.mode == 'cprofile':
+            self._profile.dump_stats(self.path)
+        else:
+            with open(self.path, 'w') as stacks_file:
+                for stack, count in self.stacks.most_common():
+                    stacks_file.write('{} {}\n'.format(stack, count))
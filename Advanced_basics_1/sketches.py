@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Вероятностные структуры данных для агрегации времен обработки запросов
+с ограниченным объемом памяти.
+"""
+
+import math
+import base64
+import heapq
+
+
+class QuantileSketch:
+    """
+    Сливаемый скетч квантилей с гарантированной относительной точностью
+    (логарифмическая гистограмма в духе DDSketch).
+
+    Количество, сумма и максимум значений хранятся точно. Значение x попадает
+    в корзину с индексом ceil(log(x) / log(gamma)), где gamma = (1 + a) / (1 - a),
+    а a - относительная точность accuracy. Оценка квантиля q отличается от
+    точного значения x элемента с рангом floor(q * (count - 1)) в
+    отсортированной выборке не более чем на a * x.
+
+    Число корзин ограничено max_buckets: при переполнении сливаются корзины
+    с наименьшими индексами, и гарантия точности сохраняется только для
+    квантилей, не попавших в слитые корзины. При a = 0.01 значения от 1 мс
+    до 1 часа занимают около 750 корзин, поэтому при настройках по умолчанию
+    слияние на реальных данных не происходит.
+
+    Результат слияния скетчей не зависит от порядка слияния, кроме суммы,
+    которая вычисляется с точностью арифметики с плавающей точкой.
+    """
+
+    __slots__ = ('accuracy', 'log_gamma', 'max_buckets', 'buckets',
+                 'zero_count', 'count', 'total', 'max')
+
+    MIN_VALUE = 1e-9
+
+    def __init__(self, accuracy=0.01, max_buckets=2048):
+        if not 0 < accuracy < 1:
+            raise ValueError('Точность скетча должна быть в интервале (0, 1): {}'.format(accuracy))
+        self.accuracy = accuracy
+        self.log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.max_buckets = max_buckets
+        self.buckets = dict()
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    append = add
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError('Нельзя слить скетчи с разной точностью: {} и {}'.format(self.accuracy, other.accuracy))
+        if not other.count:
+            return self
+        self.count += other.count
+        self.total += other.total
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        return self
+
+    def _collapse(self):
+        """Сливает корзины с наименьшими индексами, пока их число превышает max_buckets"""
+        indexes = sorted(self.buckets)
+        extra = len(indexes) - self.max_buckets
+        target = indexes[extra]
+        for index in indexes[:extra]:
+            self.buckets[target] += self.buckets.pop(index)
+
+    def to_dict(self):
+        """Представление скетча для записи в json"""
+        return {'accuracy': self.accuracy,
+                'max_buckets': self.max_buckets,
+                'buckets': list(self.buckets.items()),
+                'zero_count': self.zero_count,
+                'count': self.count,
+                'total': self.total,
+                'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает скетч из представления to_dict"""
+        sketch = cls(data['accuracy'], data['max_buckets'])
+        sketch.buckets = {index: count for index, count in data['buckets']}
+        sketch.zero_count = data['zero_count']
+        sketch.count = data['count']
+        sketch.total = data['total']
+        sketch.max = data['max']
+        return sketch
+
+    def quantile(self, q):
+        """Оценка квантиля q из [0, 1]; для пустого скетча возвращается None"""
+        if not self.count:
+            return None
+        rank = math.floor(q * (self.count - 1))
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * math.exp(index * self.log_gamma) / (1 + math.exp(self.log_gamma))
+                return min(value, self.max)
+        return self.max
+
+
+class HeavyHitters:
+    """
+    Приближенный отбор URL с наибольшим суммарным временем запросов
+    алгоритмом Space-Saving с весами. Отслеживается не более capacity URL:
+    для каждого хранятся оценка суммы времен total, ее погрешность error
+    и скетч QuantileSketch времен, добавленных с начала отслеживания.
+    Когда приходит новый URL, а места нет, вытесняется URL с наименьшей
+    оценкой суммы m, и новый URL получает total = m и error = m.
+
+    Истинная сумма отслеживаемого URL лежит в интервале [total - error, total],
+    и любой URL с суммой больше W / capacity, где W - сумма всех времен,
+    гарантированно отслеживается. Количество запросов в скетче - нижняя
+    граница истинного количества. Объем памяти ограничен capacity и не
+    зависит от числа различных URL.
+
+    Наименьшая оценка ищется по куче, в которой для каждого URL хранится
+    одна запись. Оценки только растут, поэтому при добавлении запись не
+    обновляется, а устаревшая запись при извлечении из кучи возвращается
+    в нее с текущей оценкой.
+    """
+
+    def __init__(self, capacity, accuracy=0.01):
+        if capacity < 1:
+            raise ValueError('Количество отслеживаемых URL должно быть положительным: {}'.format(capacity))
+        self.capacity = capacity
+        self.accuracy = accuracy
+        self.items = dict()
+        self.total = 0.0
+        self.count = 0
+        self._heap = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def _pop_min(self):
+        """Удаляет URL с наименьшей оценкой суммы и возвращает эту оценку"""
+        while True:
+            total, url = heapq.heappop(self._heap)
+            item = self.items[url]
+            if item[0] == total:
+                del self.items[url]
+                return total
+            heapq.heappush(self._heap, (item[0], url))
+
+    def add(self, url, value):
+        self.total += value
+        self.count += 1
+        item = self.items.get(url)
+        if item is None:
+            error = self._pop_min() if len(self.items) >= self.capacity else 0.0
+            item = self.items[url] = [error + value, error, QuantileSketch(self.accuracy)]
+            heapq.heappush(self._heap, (item[0], url))
+        else:
+            item[0] += value
+        item[2].add(value)
+
+    def get_min_total(self):
+        """Наименьшая оценка суммы, если отслеживается capacity URL, иначе 0"""
+        if len(self.items) < self.capacity:
+            return 0.0
+        return min(item[0] for item in self.items.values())
+
+    def merge(self, other):
+        """
+        Слияние со сводкой other: URL, отсутствующий в одной из сводок, получает
+        в ней оценку суммы и погрешность, равные ее наименьшей оценке, затем
+        остаются capacity URL с наибольшими оценками.
+        """
+
+        if other.accuracy != self.accuracy:
+            raise ValueError('Нельзя слить сводки с разной точностью: {} и {}'.format(self.accuracy, other.accuracy))
+        own_min, other_min = self.get_min_total(), other.get_min_total()
+        merged = dict()
+        for url in self.items.keys() | other.items.keys():
+            own = self.items.get(url, (own_min, own_min, None))
+            theirs = other.items.get(url, (other_min, other_min, None))
+            sketch = QuantileSketch(self.accuracy)
+            for part in (own[2], theirs[2]):
+                if part is not None:
+                    sketch.merge(part)
+            merged[url] = [own[0] + theirs[0], own[1] + theirs[1], sketch]
+        self.items = dict(heapq.nlargest(self.capacity, merged.items(), key=lambda item: item[1][0]))
+        self._heap = [(item[0], url) for url, item in self.items.items()]
+        heapq.heapify(self._heap)
+        self.total += other.total
+        self.count += other.count
+        return self
+
+    def top(self, size):
+        """
+        Список (url, оценка суммы, погрешность, скетч) для size URL с наибольшей
+        гарантированной суммой total - error. URL, вытеснившие другой незадолго
+        до конца, имеют большую оценку за счет погрешности, и при упорядочивании
+        по total они попадали бы в начало списка вместо действительно тяжелых.
+        """
+
+        return [(url, item[0], item[1], item[2])
+                for url, item in heapq.nlargest(size, self.items.items(),
+                                                key=lambda item: (item[1][0] - item[1][1], item[1][0]))]
+
+    def to_dict(self):
+        """Представление сводки для записи в json"""
+        return {'capacity': self.capacity,
+                'accuracy': self.accuracy,
+                'total': self.total,
+                'count': self.count,
+                'items': [[url, item[0], item[1], item[2].to_dict()] for url, item in self.items.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает сводку из представления to_dict"""
+        hitters = cls(data['capacity'], data['accuracy'])
+        hitters.total = data['total']
+        hitters.count = data['count']
+        hitters.items = {url: [total, error, QuantileSketch.from_dict(sketch)]
+                         for url, total, error, sketch in data['items']}
+        hitters._heap = [(item[0], url) for url, item in hitters.items.items()]
+        heapq.heapify(hitters._heap)
+        return hitters
+
+
+class DistinctCounter:
+    """
+    Счетчик числа различных значений по их 64-битным хешам. Пока хешей
+    не больше exact_limit, они хранятся во множестве, и счет точный. Затем
+    множество заменяется регистрами HyperLogLog (2 ** precision байт),
+    и число различных значений оценивается с относительной погрешностью
+    около 1.04 / sqrt(2 ** precision), то есть 1.6% при precision = 12.
+
+    Результат добавления и слияния не зависит от их порядка: и множество,
+    и регистры (максимумы рангов) определяются только набором хешей.
+    """
+
+    __slots__ = ('precision', 'exact_limit', 'hashes', 'registers')
+
+    def __init__(self, precision=12, exact_limit=1024):
+        if not 4 <= precision <= 16:
+            raise ValueError('Точность HyperLogLog должна быть в интервале [4, 16]: {}'.format(precision))
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.hashes = set()
+        self.registers = None
+
+    def add(self, value_hash):
+        if self.registers is None:
+            self.hashes.add(value_hash)
+            if len(self.hashes) > self.exact_limit:
+                self._to_registers()
+        else:
+            self._add_register(value_hash)
+
+    def _add_register(self, value_hash):
+        rest_bits = 64 - self.precision
+        index = value_hash >> rest_bits
+        rank = rest_bits - (value_hash & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def _to_registers(self):
+        self.registers = bytearray(1 << self.precision)
+        for value_hash in self.hashes:
+            self._add_register(value_hash)
+        self.hashes = None
+
+    def merge(self, other):
+        if (other.precision, other.exact_limit) != (self.precision, self.exact_limit):
+            raise ValueError('Нельзя слить счетчики с разными параметрами')
+        if self.registers is None and other.registers is None:
+            self.hashes |= other.hashes
+            if len(self.hashes) > self.exact_limit:
+                self._to_registers()
+            return self
+        if self.registers is None:
+            self._to_registers()
+        if other.registers is None:
+            for value_hash in other.hashes:
+                self._add_register(value_hash)
+        else:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Точное (пока хранятся хеши) или оценочное число различных значений"""
+        if self.registers is None:
+            return len(self.hashes)
+        size = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return max(int(round(estimate)), self.exact_limit + 1)
+
+    def to_dict(self):
+        """Представление счетчика для записи в json"""
+        return {'precision': self.precision,
+                'exact_limit': self.exact_limit,
+                'hashes': sorted(self.hashes) if self.registers is None else None,
+                'registers': base64.b64encode(self.registers).decode('ascii') if self.registers is not None
+                else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает счетчик из представления to_dict"""
+        counter = cls(data['precision'], data['exact_limit'])
+        if data['registers'] is None:
+            counter.hashes = set(data['hashes'])
+        else:
+            counter.registers = bytearray(base64.b64decode(data['registers']))
+            counter.hashes = None
+        return counter
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Компактный бинарный файл с агрегатами log-файла по URL.
+
+Структура файла:
+    MAGIC (8 байт), длина заголовка (uint64 little-endian), заголовок в json,
+    выравнивание до 8 байт, затем числовые колонки (по count элементов
+    каждая), таблица смещений URL (count + 1 элементов uint64) и строки URL
+    в utf-8 подряд. Смещения всех массивов в заголовке отсчитываются от
+    начала данных и кратны 8 байтам, поэтому при чтении колонки отображаются
+    в память через mmap без копирования.
+"""
+
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+
+MAGIC = b'LASTATS1'
+HEADER = struct.Struct('<8sQ')
+URL_OFFSETS = 'Q'
+
+
+def align(position, size=8):
+    return (position + size - 1) // size * size
+
+
+def write_stats_cache(path, meta, urls, columns):
+    """
+    Записывает в файл path метаданные meta (словарь, сериализуемый в json),
+    список строк urls и колонки columns - список пар (имя, array) длины len(urls).
+    """
+
+    encoded = [url.encode('utf-8') for url in urls]
+    url_offsets = array(URL_OFFSETS, [0])
+    for url in encoded:
+        url_offsets.append(url_offsets[-1] + len(url))
+    blocks = [array(column.typecode, column) for _, column in columns] + [url_offsets]
+    blob = b''.join(encoded)
+
+    layout, position = [], 0
+    for block in blocks:
+        layout.append(position)
+        position = align(position + len(block) * block.itemsize)
+    header = dict(meta)
+    header['count'] = len(urls)
+    header['columns'] = [[name, column.typecode, offset] for (name, column), offset in zip(columns, layout)]
+    header['urls'] = [layout[-1], position, len(blob)]
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    with open(path, 'wb') as cache_file:
+        cache_file.write(HEADER.pack(MAGIC, len(header_bytes)))
+        cache_file.write(header_bytes)
+        base = align(HEADER.size + len(header_bytes))
+        for block, offset in zip(blocks, layout):
+            cache_file.write(b'\0' * (base + offset - cache_file.tell()))
+            if sys.byteorder != 'little':
+                block.byteswap()
+            cache_file.write(block.tobytes())
+        cache_file.write(b'\0' * (base + position - cache_file.tell()))
+        cache_file.write(blob)
+
+
+class StatsCache:
+    """
+    Файл агрегатов, отображенный в память. Колонки доступны в словаре columns
+    как memoryview нужного типа, URL с номером i возвращает метод url(i).
+    Объект нужно закрыть методом close или использовать в блоке with.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as cache_file:
+            self._mmap = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, length = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC or sys.byteorder != 'little':
+                raise ValueError('Неподдерживаемый формат файла агрегатов {}'.format(path))
+            self.meta = json.loads(self._mmap[HEADER.size:HEADER.size + length].decode('utf-8'))
+            base = align(HEADER.size + length)
+            self.count = self.meta['count']
+            self._view = memoryview(self._mmap)
+            self.columns = dict()
+            for name, typecode, offset in self.meta['columns']:
+                itemsize = array(typecode).itemsize
+                self.columns[name] = self._view[base + offset:base + offset + self.count * itemsize].cast(typecode)
+            offsets, blob, blob_length = self.meta['urls']
+            self._url_offsets = self._view[base + offsets:base + offsets + (self.count + 1) * 8].cast(URL_OFFSETS)
+            self._urls = self._view[base + blob:base + blob + blob_length]
+        except Exception:
+            self.close()
+            raise
+
+    def url(self, index):
+        return bytes(self._urls[self._url_offsets[index]:self._url_offsets[index + 1]]).decode('utf-8')
+
+    def close(self):
+        for view in list(getattr(self, 'columns', dict()).values()) + [getattr(self, name, None)
+                                                                       for name in ('_url_offsets', '_urls', '_view')]:
+            if view is not None:
+                view.release()
+        self.columns = dict()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
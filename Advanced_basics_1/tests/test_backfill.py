@@ -0,0 +1,57 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import backfill, find_unreported_logs
+from test_parallel import make_lines
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.tmp_dir, 'log')
+        self.report_dir = os.path.join(self.tmp_dir, 'reports')
+        os.makedirs(self.log_dir)
+        os.makedirs(self.report_dir)
+        self.config = {'REPORT_SIZE': 10, 'LOG_DIR': self.log_dir, 'REPORT_DIR': self.report_dir,
+                       'FAIL_PERC': 0.5, 'BACKFILL_WORKERS': 2}
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def write_log(self, name, lines):
+        with open(os.path.join(self.log_dir, name), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def test_find_unreported_logs(self):
+        """Выбираются только log-файлы без отчетов, по одному на дату"""
+        for name in ('nginx-access-ui.log-20170629.plain', 'nginx-access-ui.log-20170630.gz',
+                     'nginx-access-ui.log-20170630.plain', 'nginx-access-ui.log-20170701.plain', 'other.log'):
+            self.write_log(name, [])
+        open(os.path.join(self.report_dir, 'report-2017.06.29.html'), 'w').close()
+        self.assertEqual(find_unreported_logs(self.log_dir, self.report_dir),
+                         ['nginx-access-ui.log-20170630.plain', 'nginx-access-ui.log-20170701.plain'])
+
+    def test_backfill(self):
+        """Отчеты создаются по каждому файлу, FAIL_PERC проверяется для каждого отдельно"""
+        self.write_log('nginx-access-ui.log-20170628.plain', make_lines(300, seed=1))
+        self.write_log('nginx-access-ui.log-20170629.plain', ['broken'] * 10 + make_lines(5))
+        self.write_log('nginx-access-ui.log-20170630.plain', make_lines(300, seed=2))
+        results = backfill(self.config)
+        self.assertEqual([(name[-14:-6], ok) for name, ok, _ in results],
+                         [('20170628', True), ('20170629', False), ('20170630', True)])
+        self.assertEqual(sorted(os.listdir(self.report_dir)),
+                         ['report-2017.06.28.html', 'report-2017.06.28.metrics.json', 'report-2017.06.29.metrics.json',
+                          'report-2017.06.30.html', 'report-2017.06.30.metrics.json'])
+        self.assertEqual([name for name, _, _ in backfill(self.config)], ['nginx-access-ui.log-20170629.plain'])
+
+
+if __name__ == '__main__':
+    unittest.main()
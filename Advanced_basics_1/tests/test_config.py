@@ -0,0 +1,44 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import fix_config_values, main
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_values(self):
+        """Значения приводятся к нужным типам, относительные пути - к абсолютным"""
+        config = fix_config_values({'WORKERS': '4', 'FAIL_PERC': '0.2', 'REPORT_PAGE_SIZE': 0,
+                                    'WATCH_POLL': 2, 'REPORT_DIR': 'reports', 'URL_RULES': ['numeric']})
+        self.assertEqual(config, {'WORKERS': 4, 'FAIL_PERC': 0.2, 'REPORT_PAGE_SIZE': 0, 'WATCH_POLL': 2.0,
+                                  'REPORT_DIR': os.path.abspath('reports'), 'URL_RULES': ['numeric']})
+
+    def test_invalid_values(self):
+        for key, value in (('BACKFILL_WORKERS', 0), ('WORKERS', 'four'), ('SKETCH_ACCURACY', 1.5),
+                           ('FAIL_PERC', -0.1), ('WATCH_INTERVAL', 0), ('GROUP_BY', 'status'),
+                           ('REPORT_SIZE', None)):
+            self.assertRaises(ValueError, fix_config_values, {key: value})
+
+    def test_main(self):
+        """Скрипт с некорректным значением в файле конфигурации завершается до обработки"""
+        path = os.path.join(self.tmp_dir, 'config.json')
+        with open(path, 'w') as f:
+            json.dump({'LOG_DIR': self.tmp_dir, 'REPORT_DIR': self.tmp_dir, 'BACKFILL_WORKERS': 0}, f)
+        with self.assertLogs(level='ERROR') as logs:
+            main(['log_analyzer.py', '--config', path, '--backfill'])
+        self.assertIn('BACKFILL_WORKERS', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import sys
+import json
+import gzip
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import sample_lines, get_fail_bound, precheck_fail_perc, process_log
+from test_parallel import LINE
+
+
+def make_log(good, bad, bad_first=False):
+    good_lines = [LINE.format('/api/v2/banner/{}'.format(i % 50), '0.{:03d}'.format(i % 1000)) for i in range(good)]
+    bad_lines = ['broken line {}'.format(i) for i in range(bad)]
+    if bad_first:
+        return bad_lines + good_lines
+    step = (good + bad) // bad if bad else 0
+    lines = list(good_lines)
+    for i, line in enumerate(bad_lines):
+        lines.insert(i * step, line)
+    return lines
+
+
+class TestFailSample(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.tmp_dir, 'log')
+        os.makedirs(self.log_dir)
+        self.config = {'REPORT_SIZE': 10, 'LOG_DIR': self.log_dir, 'REPORT_DIR': os.path.join(self.tmp_dir, 'reports'),
+                       'FAIL_PERC': 0.2}
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, lines, name='nginx-access-ui.log-20170630.plain', opener=open):
+        path = os.path.join(self.log_dir, name)
+        with opener(path, 'wt') as f:
+            f.write('\r\n'.join(lines) + '\r\n')
+        return path
+
+    def test_sample_lines(self):
+        """Выборка состоит из первых строк и целых строк из случайных позиций файла"""
+        lines = make_log(5000, 500)
+        path = self.write(lines)
+        head, sample = sample_lines(path, 400, seed=1)
+        self.assertEqual(head, [line.encode() for line in lines[:200]])
+        self.assertGreater(len(sample), 150)
+        self.assertTrue(set(sample) <= {line.encode() for line in lines})
+        self.assertEqual(sample_lines(path, 400, seed=1), (head, sample))
+
+        head, sample = sample_lines(self.write(lines[:50]), 400)
+        self.assertEqual((len(head), sample), (50, []))
+        head, sample = sample_lines(self.write(lines, 'nginx-access-ui.log-20170630.gz', gzip.open), 400)
+        self.assertEqual((len(head), sample), (400, []))
+
+    def test_fail_bound(self):
+        self.assertEqual(get_fail_bound(0, 0), 0.0)
+        self.assertAlmostEqual(get_fail_bound(0, 1000), 0.0)
+        self.assertGreater(get_fail_bound(1000, 1000), 0.99)
+        self.assertLess(get_fail_bound(300, 1000), 0.3)
+        self.assertGreater(get_fail_bound(300, 1000), 0.25)
+        self.assertLess(get_fail_bound(3, 10), get_fail_bound(300, 1000))
+
+    def test_precheck(self):
+        """Работа прерывается только при уверенном превышении FAIL_PERC"""
+        self.assertFalse(precheck_fail_perc(self.config, self.write(make_log(1000, 9000))))
+        self.assertTrue(precheck_fail_perc(self.config, self.write(make_log(8500, 1500))))
+        self.assertTrue(precheck_fail_perc(self.config, self.write(make_log(20000, 1500, bad_first=True))))
+        self.assertTrue(precheck_fail_perc(dict(self.config, FAIL_SAMPLE=0), self.write(make_log(0, 100))))
+        self.assertTrue(precheck_fail_perc({}, self.write(make_log(0, 100))))
+
+    def test_process_log(self):
+        """Log-файл неверного формата отбрасывается без полного разбора"""
+        self.write(make_log(500, 50000))
+        name, ok, message = process_log(('nginx-access-ui.log-20170630.plain', self.config))
+        self.assertFalse(ok)
+        with open(os.path.join(self.config['REPORT_DIR'], 'report-2017.06.30.metrics.json')) as f:
+            stages = [stage['stage'] for stage in json.load(f)['stages']]
+        self.assertEqual(stages, ['precheck'])
+
+
+if __name__ == '__main__':
+    unittest.main()
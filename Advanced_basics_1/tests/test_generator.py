@@ -0,0 +1,40 @@
+import unittest
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import parse_lines, get_request_times_from_log
+from benchmarks.generator import generate_lines, ensure_log
+
+
+class TestGenerator(unittest.TestCase):
+
+    def test_deterministic(self):
+        """Одинаковые параметры дают одинаковые строки, все корректные строки распознаются"""
+        lines = list(generate_lines(20000, urls=500, skew=1.2, bad_ratio=0.05, seed=1))
+        self.assertEqual(lines, list(generate_lines(20000, urls=500, skew=1.2, bad_ratio=0.05, seed=1)))
+        self.assertNotEqual(lines, list(generate_lines(20000, urls=500, skew=1.2, bad_ratio=0.05, seed=2)))
+        entries = list(parse_lines(lines))
+        bad = [line for line, entry in zip(lines, entries) if entry is None]
+        self.assertTrue(all(line.startswith('garbage') for line in bad))
+        self.assertAlmostEqual(len(bad) / len(lines), 0.05, delta=0.01)
+        self.assertLessEqual(len({entry['request_url'] for entry in entries if entry}), 500)
+
+    def test_gzip(self):
+        """Сжатый и несжатый log-файлы с одинаковыми параметрами совпадают по содержимому"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            plain = ensure_log(tmp_dir, 5000, urls=100)
+            compressed = ensure_log(tmp_dir, 5000, urls=100, compress=True)
+            with open(plain, 'rb') as plain_file, gzip.open(compressed, 'rb') as gzip_file:
+                self.assertEqual(plain_file.read(), gzip_file.read())
+            self.assertEqual(get_request_times_from_log(plain), get_request_times_from_log(compressed))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
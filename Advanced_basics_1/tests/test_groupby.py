@@ -0,0 +1,91 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import collections
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from groupby import GroupBy, get_fields
+from log_analyzer import parse_lines, get_request_times_from_log, get_request_times_incremental, process_log
+from benchmarks.generator import generate_lines
+
+
+class TestGroupBy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_group(self):
+        group = GroupBy(['url', 'status'])
+        self.assertEqual(group.name, 'url-status')
+        self.assertEqual(get_fields([group, GroupBy(['request_type'])]), ('body_bytes_sent', 'request_type', 'status'))
+        group.add({'status': '200', 'body_bytes_sent': '10'}, '/a', 0.5)
+        group.add({'status': '200', 'body_bytes_sent': '30'}, '/a', 1.5)
+        group.add({'status': '404', 'body_bytes_sent': '0'}, '/a', 0.1)
+        other = GroupBy.from_dict(json.loads(json.dumps(group.to_dict())))
+        self.assertEqual(other.groups, group.groups)
+        group.merge(other)
+        rows = group.get_rows(1)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual({key: rows[0][key] for key in ('url', 'status', 'count', 'time_sum', 'time_max', 'bytes_sum')},
+                         {'url': '/a', 'status': '200', 'count': 4, 'time_sum': 4.0, 'time_max': 1.5, 'bytes_sum': 80})
+        self.assertAlmostEqual(rows[0]['time_perc'], 4.0 / 4.2)
+        self.assertRaises(ValueError, GroupBy, ['url', 'time'])
+        self.assertRaises(ValueError, GroupBy, [])
+
+    def test_single_pass(self):
+        """Группировки считаются за один проход одинаково в одном и нескольких процессах"""
+        lines = list(generate_lines(20000, urls=100, bad_ratio=0.02, seed=3))
+        expected = collections.Counter()
+        expected_bytes = collections.Counter()
+        for entry in parse_lines(lines, fast=False):
+            if entry:
+                expected[entry['request_url'], entry['status']] += 1
+                expected_bytes[entry['request_type']] += int(entry['body_bytes_sent'])
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170629.plain')
+        with open(path, 'w') as f:
+            f.write(''.join(lines))
+
+        plain = get_request_times_from_log(path)
+        for workers in (1, 3):
+            groups = [GroupBy(['url', 'status']), GroupBy(['request_type'])]
+            self.assertEqual(get_request_times_from_log(path, workers, groups=groups), plain)
+            self.assertEqual({key: values[0] for key, values in groups[0].groups.items()}, expected)
+            self.assertEqual({key[0]: values[3] for key, values in groups[1].groups.items()}, expected_bytes)
+
+        state_path = os.path.join(self.tmp_dir, 'reports.state')
+        with open(path, 'w') as f:
+            f.write(''.join(lines[:7000]))
+        get_request_times_incremental(path, state_path, groups=[GroupBy(['url', 'status'])])
+        with open(path, 'a') as f:
+            f.write(''.join(lines[7000:]))
+        resumed = [GroupBy(['url', 'status'])]
+        self.assertEqual(get_request_times_incremental(path, state_path, groups=resumed), plain)
+        self.assertEqual({key: values[0] for key, values in resumed[0].groups.items()}, expected)
+
+    def test_reports(self):
+        """Таблица каждой группировки записывается в свой отчет"""
+        cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+        try:
+            log_dir = os.path.join(self.tmp_dir, 'log')
+            os.makedirs(log_dir)
+            with open(os.path.join(log_dir, 'nginx-access-ui.log-20170629.plain'), 'w') as f:
+                f.write(''.join(generate_lines(3000, urls=20, seed=4)))
+            config = {'REPORT_SIZE': 5, 'LOG_DIR': log_dir, 'REPORT_DIR': os.path.join(self.tmp_dir, 'reports'),
+                      'GROUP_BY': [['url', 'status'], ['request_type']]}
+            self.assertTrue(process_log(('nginx-access-ui.log-20170629.plain', config))[1])
+            self.assertEqual(sorted(name for name in os.listdir(config['REPORT_DIR']) if name.endswith('.html')),
+                             ['report-2017.06.29.html', 'report-2017.06.29.request_type.html',
+                              'report-2017.06.29.url-status.html'])
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import collections
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from sketches import HeavyHitters
+from log_analyzer import parse_lines, get_request_times_from_log, get_request_times_incremental, get_stats, \
+    get_heavy_capacity
+from benchmarks.generator import generate_lines
+
+
+def make_lines(count, seed):
+    """Строки генератора вперемешку с запросами ботов к однократно запрошенным URL"""
+    rnd = random.Random(seed)
+    lines = list(generate_lines(count, urls=200, skew=1.2, bad_ratio=0.0, seed=seed))
+    bot_lines = generate_lines(count, urls=count, skew=0.0, bad_ratio=0.0, seed=seed + 1)
+    for i, line in enumerate(bot_lines):
+        lines.insert(rnd.randrange(len(lines) + 1), line.replace(' /', ' /bot{}/'.format(i), 1))
+    return lines
+
+
+def get_sums(lines):
+    sums = collections.Counter()
+    for entry in parse_lines(lines, fast=False):
+        if entry:
+            sums[entry['request_url']] += float(entry['request_time'])
+    return sums
+
+
+class TestHeavyHitters(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_top(self, hitters, sums, size):
+        self.assertLessEqual(len(hitters), hitters.capacity)
+        bound = sum(sums.values()) / hitters.capacity
+        self.assertTrue({url for url, total in sums.items() if total > bound} <= hitters.items.keys())
+        expected = [url for url, total in sums.most_common(size) if total > 2 * bound]
+        self.assertGreater(len(expected), 3)
+        top = hitters.top(size)
+        self.assertEqual([url for url, total, error, sketch in top[:len(expected)]], expected)
+        for url, total, error, sketch in top:
+            self.assertLessEqual(total - error, sums[url] + 1e-6)
+            self.assertGreaterEqual(total, sums[url] - 1e-6)
+
+    def test_stream(self):
+        """Порядок тяжелых URL и границы оценок на потоке с большим числом редких URL"""
+        lines = make_lines(20000, seed=5)
+        sums = get_sums(lines)
+        self.assertGreater(len(sums), 20000)
+        hitters = HeavyHitters(200)
+        for entry in parse_lines(lines, fast=False):
+            if entry:
+                hitters.add(entry['request_url'], float(entry['request_time']))
+        self.check_top(hitters, sums, 10)
+        self.assertAlmostEqual(hitters.total, sum(sums.values()))
+
+        restored = HeavyHitters.from_dict(json.loads(json.dumps(hitters.to_dict())))
+        self.assertEqual(restored.top(20)[0][:3], hitters.top(20)[0][:3])
+        self.assertRaises(ValueError, HeavyHitters, 0)
+
+    def test_merge(self):
+        """Слияние сводок частей лога сохраняет тяжелые URL и границы оценок"""
+        lines = make_lines(20000, seed=6)
+        parts = []
+        for i in range(4):
+            part = HeavyHitters(200)
+            for entry in parse_lines(lines[i::4], fast=False):
+                if entry:
+                    part.add(entry['request_url'], float(entry['request_time']))
+            parts.append(part)
+        merged = parts[0]
+        for part in parts[1:]:
+            merged.merge(part)
+        self.check_top(merged, get_sums(lines), 10)
+        self.assertRaises(ValueError, merged.merge, HeavyHitters(10, 0.05))
+
+    def test_log(self):
+        """Режим heavy в одном и нескольких процессах и при инкрементальной обработке"""
+        lines = make_lines(10000, seed=7)
+        sums = get_sums(lines)
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170629.plain')
+        with open(path, 'w') as f:
+            f.write(''.join(lines))
+        capacity = get_heavy_capacity({'AGGREGATION': 'heavy', 'REPORT_SIZE': 10})
+        self.assertEqual(capacity, 100)
+        self.assertIsNone(get_heavy_capacity({'REPORT_SIZE': 10}))
+        for workers in (1, 3):
+            hitters, good, bad = get_request_times_from_log(path, workers, capacity=capacity)
+            self.assertEqual(good, len(lines))
+            self.check_top(hitters, sums, 10)
+        rows = get_stats(hitters, 10)
+        self.assertEqual([row['url'] for row in rows], [url for url, total, error, sketch in hitters.top(10)])
+        self.assertIn('time_sum_error', rows[0])
+
+        state_path = os.path.join(self.tmp_dir, 'reports.state')
+        with open(path, 'w') as f:
+            f.write(''.join(lines[:4000]))
+        get_request_times_incremental(path, state_path, capacity=capacity)
+        with open(path, 'a') as f:
+            f.write(''.join(lines[4000:]))
+        hitters, good, bad = get_request_times_incremental(path, state_path, capacity=capacity)
+        self.assertEqual(good, len(lines))
+        self.check_top(hitters, sums, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import (get_request_times_from_log, get_request_times_incremental, load_checkpoint,
+                          get_times_path)
+from test_parallel import make_lines
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630.plain')
+        self.state_path = os.path.join(self.tmp_dir, 'reports.state')
+        self.lines = make_lines(2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def append(self, text):
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_growing_log(self):
+        """Результат дообработки дописанного файла совпадает с полной обработкой"""
+        self.append('\n'.join(self.lines[:700]) + '\n' + self.lines[700][:50])
+        first = get_request_times_incremental(self.log_path, self.state_path)
+        self.assertEqual(sum(first[1:]), 700)
+        offset = load_checkpoint(self.state_path)['offset']
+
+        self.append(self.lines[700][50:] + '\n' + '\n'.join(self.lines[701:]) + '\n')
+        second = get_request_times_incremental(self.log_path, self.state_path, workers=3)
+        self.assertEqual(second, get_request_times_from_log(self.log_path))
+        self.assertGreater(load_checkpoint(self.state_path)['offset'], offset)
+
+    def test_unterminated_line(self):
+        """Последняя строка без перевода строки учитывается в закрытом или неизменном файле"""
+        self.append('\n'.join(self.lines))
+        full = get_request_times_from_log(self.log_path)
+        self.assertEqual(sum(full[1:]), len(self.lines))
+        self.assertEqual(get_request_times_incremental(self.log_path, self.state_path, closed=True), full)
+        os.remove(self.state_path)
+        self.assertEqual(sum(get_request_times_incremental(self.log_path, self.state_path)[1:]), len(self.lines) - 1)
+        self.assertEqual(get_request_times_incremental(self.log_path, self.state_path, report_exists=True), full)
+        self.assertEqual(load_checkpoint(self.state_path)['offset'], os.path.getsize(self.log_path))
+
+    def test_times_appended(self):
+        """Времена запросов дописываются в двоичный файл, а не переписываются в файле состояния"""
+        self.append('\n'.join(self.lines[:1000]) + '\n')
+        get_request_times_incremental(self.log_path, self.state_path)
+        state = load_checkpoint(self.state_path)
+        self.assertIsNone(state['time_dict'])
+        size = os.path.getsize(get_times_path(self.state_path))
+        self.assertEqual(state['times']['size'], size)
+
+        self.append('\n'.join(self.lines[1000:1010]) + '\n')
+        with open(get_times_path(self.state_path), 'ab') as f:
+            f.write(b'garbage of an interrupted run')
+        result = get_request_times_incremental(self.log_path, self.state_path)
+        self.assertEqual(result, get_request_times_from_log(self.log_path))
+        self.assertLess(os.path.getsize(get_times_path(self.state_path)) - size, 10 * 16 + 10 * 8)
+        self.assertEqual(get_request_times_incremental(self.log_path, self.state_path), result)
+
+    def test_unchanged_log(self):
+        """Неизмененный файл не обрабатывается повторно, если отчет уже есть"""
+        self.append('\n'.join(self.lines) + '\n')
+        first = get_request_times_incremental(self.log_path, self.state_path, sketch_accuracy=0.01)
+        self.assertIsNone(get_request_times_incremental(self.log_path, self.state_path, sketch_accuracy=0.01,
+                                                        report_exists=True))
+        restored = get_request_times_incremental(self.log_path, self.state_path, sketch_accuracy=0.01)
+        self.assertEqual(first[1:], restored[1:])
+        for url, sketch in first[0].items():
+            self.assertEqual(sketch.to_dict(), restored[0][url].to_dict())
+
+    def test_replaced_log(self):
+        """Замененный файл с другим содержимым обрабатывается целиком"""
+        self.append('\n'.join(self.lines[:1500]) + '\n')
+        get_request_times_incremental(self.log_path, self.state_path)
+        os.remove(self.log_path)
+        self.append('\n'.join(self.lines[1000:]) + '\n')
+        result = get_request_times_incremental(self.log_path, self.state_path)
+        self.assertEqual(result, get_request_times_from_log(self.log_path))
+
+    def test_settings_changed(self):
+        """Смена режима агрегации приводит к полной обработке"""
+        self.append('\n'.join(self.lines) + '\n')
+        get_request_times_incremental(self.log_path, self.state_path, sketch_accuracy=0.01)
+        result = get_request_times_incremental(self.log_path, self.state_path)
+        self.assertEqual(result, get_request_times_from_log(self.log_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
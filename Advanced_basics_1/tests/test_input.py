@@ -0,0 +1,109 @@
+import unittest
+import os
+import io
+import re
+import sys
+import bz2
+import gzip
+import lzma
+import shutil
+import tempfile
+import tracemalloc
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import (read_lines, read_mapped, read_range, split_file, find_last_line_end, open_log,
+                          get_request_times_from_log, RE_FILE_NAME)
+from test_parallel import make_lines
+
+
+TRICKY_TEXTS = [
+    b'',
+    b'\n',
+    b'one line without newline',
+    b'a\nb\n',
+    b'a\r\nb\r\n\r\n',
+    b'a\rb\r',
+    b'a\r\r\nb\n\rc',
+    b'\xd0\xbf\xd1\x83\xd1\x82\xd1\x8c\n' * 3,
+]
+
+
+class TestInput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_lines(self):
+        """Разбиение на строки совпадает с чтением в текстовом режиме при любом размере блока"""
+        for text in TRICKY_TEXTS:
+            expected = [line.rstrip('\n').encode('utf-8')
+                        for line in io.TextIOWrapper(io.BytesIO(text), encoding='utf-8')]
+            for block_size in (1, 2, 3, 7, 1 << 20):
+                self.assertEqual(list(read_lines(io.BytesIO(text), block_size=block_size)), expected, (text, block_size))
+
+    def test_read_lines_limit(self):
+        """Чтение ограничивается limit байтами"""
+        self.assertEqual(list(read_lines(io.BytesIO(b'ab\ncd\nef\n'), limit=6, block_size=4)), [b'ab', b'cd'])
+
+    def test_read_mapped(self):
+        """Чтение через отображение в память и по диапазонам split_file совпадает с read_lines"""
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630.plain')
+        for text in TRICKY_TEXTS + [b'a\nbb\r\nccc\n' * 50]:
+            with open(path, 'wb') as f:
+                f.write(text)
+            expected = list(read_lines(io.BytesIO(text)))
+            for block_size in (1, 2, 3, 7, 1 << 20):
+                self.assertEqual(list(read_mapped(path, block_size=block_size)), expected, (text, block_size))
+            for parts in (1, 2, 5):
+                ranges = split_file(path, parts)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], len(text))
+                lines = [line for start, end in ranges for line in read_range(path, start, end)]
+                self.assertEqual(lines, expected, (text, parts))
+            self.assertEqual(find_last_line_end(path, len(text)), text.rfind(b'\n') + 1)
+
+    def test_read_mapped_allocations(self):
+        """Строки копируются из отображения по одной, без копий блоков и списков строк"""
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630.plain')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(make_lines(20000)) + '\n')
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in read_mapped(path, block_size=1 << 18))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, 20000)
+        self.assertLess(peak, 1 << 15)
+
+    def test_codecs(self):
+        """Результат обработки не зависит от способа сжатия log-файла"""
+        text = ('\n'.join(make_lines(3000)) + '\n').encode('utf-8')
+        results = []
+        for extension, opener in (('plain', open), ('gz', gzip.open), ('bz2', bz2.open), ('xz', lzma.open)):
+            name = 'nginx-access-ui.log-20170630.' + extension
+            self.assertIsNotNone(re.search(RE_FILE_NAME, name))
+            path = os.path.join(self.tmp_dir, name)
+            with opener(path, 'wb') as f:
+                f.write(text)
+            with open_log(path) as f:
+                self.assertEqual(f.read(), text)
+            results.append(get_request_times_from_log(path))
+            results.append(get_request_times_from_log(path, workers=3))
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    @unittest.skipUnless(shutil.which('pigz'), 'pigz не установлен')
+    def test_external_decompress(self):
+        """Распаковка внешней программой pigz"""
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(('\n'.join(make_lines(1000)) + '\n').encode('utf-8'))
+        self.assertEqual(get_request_times_from_log(path, external=True), get_request_times_from_log(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
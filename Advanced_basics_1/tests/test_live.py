@@ -0,0 +1,174 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import datetime
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from live import LogFollower, SlidingWindows, get_window_name
+from log_analyzer import watch
+
+
+LINE = ('1.196.116.32 -  - [{}] "GET {} HTTP/1.1" 200 927 "-" "Lynx/2.8.8dev.9" "-" '
+        '"1498697422-2190034393-4708-9752759" "dc7161be3" {}\n')
+START = datetime.datetime(2017, 6, 29, 3, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+
+
+def make_line(seconds, url, request_time):
+    moment = START + datetime.timedelta(seconds=seconds)
+    return LINE.format(moment.strftime('%d/Jun/%Y:%H:%M:%S +0300'), url, request_time)
+
+
+class TestLogFollower(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'access.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def append(self, data, path=None):
+        with open(path or self.path, 'ab') as f:
+            f.write(data)
+
+    def test_partial_lines(self):
+        """Недописанная строка выдается только после перевода строки"""
+        with LogFollower(self.path, block_size=3) as follower:
+            self.assertEqual(list(follower.read_lines()), [])
+            self.append(b'first\r\nsec')
+            self.assertEqual(list(follower.read_lines()), [b'first'])
+            self.append(b'ond\nthird')
+            self.assertEqual(list(follower.read_lines()), [b'second'])
+            self.assertEqual(list(follower.read_lines()), [])
+            self.append(b'\n')
+            self.assertEqual(list(follower.read_lines()), [b'third'])
+
+    def test_rotation(self):
+        """После ротации старый файл дочитывается, а новый читается с начала"""
+        self.append(b'a\nb\n')
+        with LogFollower(self.path, grace=0) as follower:
+            self.assertEqual(list(follower.read_lines()), [b'a', b'b'])
+            self.append(b'c\nd')
+            os.rename(self.path, self.path + '.1')
+            self.assertEqual(list(follower.read_lines()), [b'c'])
+            self.append(b'e\n', self.path)
+            self.assertEqual(list(follower.read_lines()), [b'e'])
+            self.assertEqual(follower.rotations, 1)
+            self.assertEqual(list(follower.read_lines()), [b'd'])
+            self.assertIsNone(follower.rotated)
+
+    def test_rotated_writes(self):
+        """Строки, дописанные в переименованный файл до USR1, не теряются"""
+        now = [0.0]
+        self.append(b'a\n')
+        with LogFollower(self.path, grace=10, clock=lambda: now[0]) as follower:
+            self.assertEqual(list(follower.read_lines()), [b'a'])
+            os.rename(self.path, self.path + '.1')
+            self.append(b'b\n', self.path)
+            self.assertEqual(list(follower.read_lines()), [b'b'])
+            self.append(b'c\nd', self.path + '.1')
+            self.append(b'e\n', self.path)
+            self.assertEqual(list(follower.read_lines()), [b'c', b'e'])
+            now[0] = 8.0
+            self.append(b'\nf', self.path + '.1')
+            self.assertEqual(list(follower.read_lines()), [b'd'])
+            now[0] = 16.0
+            self.assertEqual(list(follower.read_lines()), [])
+            self.assertIsNotNone(follower.rotated)
+            now[0] = 18.0
+            self.assertEqual(list(follower.read_lines()), [b'f'])
+            self.assertIsNone(follower.rotated)
+            self.append(b'g\n', self.path + '.1')
+            self.append(b'h\n', self.path)
+            self.assertEqual(list(follower.read_lines()), [b'h'])
+            self.assertEqual(follower.rotations, 1)
+
+    def test_truncation(self):
+        """Файл, ставший короче прочитанной позиции, читается с начала"""
+        self.append(b'aaaa\nbbbb\n')
+        with LogFollower(self.path) as follower:
+            self.assertEqual(list(follower.read_lines()), [b'aaaa', b'bbbb'])
+            with open(self.path, 'wb') as f:
+                f.write(b'c\n')
+            self.assertEqual(list(follower.read_lines()), [b'c'])
+
+    def test_from_end(self):
+        self.append(b'old\n')
+        with LogFollower(self.path, from_end=True) as follower:
+            self.assertEqual(list(follower.read_lines()), [])
+            self.append(b'new\n')
+            self.assertEqual(list(follower.read_lines()), [b'new'])
+
+
+class TestSlidingWindows(unittest.TestCase):
+
+    def test_windows(self):
+        """Окна содержат запросы своих последних минут, старые корзины удаляются"""
+        windows = SlidingWindows([300, 3600])
+        now = START.timestamp() + 7200
+        for minute in range(0, 121):
+            time_local = (START + datetime.timedelta(minutes=minute, seconds=30)).strftime('%d/Jun/%Y:%H:%M:%S +0300')
+            windows.add('/a', time_local, 1.0)
+        windows.expire(now)
+        self.assertEqual(len(windows.buckets), 61)
+        self.assertEqual(windows.get_time_dict(300, now)['/a'].count, 6)
+        self.assertEqual(windows.get_time_dict(3600, now)['/a'].count, 61)
+        self.assertFalse(windows.add('/a', '29/Jun/2017:03:10:00 +0300', 1.0))
+        self.assertFalse(windows.add('/a', 'garbage', 1.0))
+        self.assertRaises(ValueError, SlidingWindows, [])
+
+    def test_window_name(self):
+        self.assertEqual([get_window_name(seconds) for seconds in (90, 300, 3600, 86400)], ['90s', '5m', '1h', '1d'])
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_watch(self):
+        """Отчеты по окнам перезаписываются с учетом дописанных строк и ротации"""
+        path = os.path.join(self.tmp_dir, 'access.log')
+        report_dir = os.path.join(self.tmp_dir, 'reports')
+        config = {'WATCH_LOG': path, 'REPORT_DIR': report_dir, 'REPORT_SIZE': 10,
+                  'WATCH_WINDOWS': [300, 3600], 'WATCH_INTERVAL': 10, 'WATCH_POLL': 5}
+        clock = [START.timestamp() + 3600]
+        with open(path, 'w') as f:
+            f.write(make_line(-600, '/old', 5.0))
+            f.write(make_line(3000, '/hour', 1.0))
+            f.write(make_line(3500, '/recent', 0.5))
+            f.write('broken line\n')
+
+        def sleep(seconds):
+            clock[0] += seconds
+            if clock[0] == START.timestamp() + 3605:
+                os.rename(path, path + '.1')
+                with open(path, 'w') as f:
+                    f.write(make_line(3600, '/recent', 0.7))
+
+        def read_table(name):
+            with open(os.path.join(report_dir, name)) as f:
+                text = f.read()
+            table = json.loads(text[text.index('var table = ') + 12:text.index(';\n    var pages')])
+            return {row['url']: row['count'] for row in table}
+
+        self.assertEqual(watch(config, 2, lambda: clock[0], sleep), (4, 1))
+        self.assertEqual(read_table('live-5m.html'), {'/recent HTTP/1.1': 1})
+        self.assertEqual(read_table('live-1h.html'), {'/recent HTTP/1.1': 1, '/hour HTTP/1.1': 1})
+
+        clock[0] = START.timestamp() + 3600
+        self.assertEqual(watch(config, 3, lambda: clock[0], sleep), (2, 0))
+        self.assertEqual(read_table('live-5m.html'), {'/recent HTTP/1.1': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
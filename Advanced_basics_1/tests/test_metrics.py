@@ -0,0 +1,84 @@
+import unittest
+import os
+import sys
+import json
+import pstats
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from metrics import Metrics, Profiler
+from log_analyzer import process_log, COUNTERS
+from test_parallel import make_lines
+
+
+def busy(count):
+    return sum(i * i for i in range(count))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.tmp_dir, 'log')
+        self.report_dir = os.path.join(self.tmp_dir, 'reports')
+        os.makedirs(self.log_dir)
+        self.config = {'REPORT_SIZE': 10, 'LOG_DIR': self.log_dir, 'REPORT_DIR': self.report_dir, 'FAIL_PERC': 0.5}
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stage(self):
+        """Стадия получает время, память и приращения счетчиков"""
+        metrics = Metrics(COUNTERS)
+        with metrics.stage('work') as record:
+            COUNTERS['test_items'] += 5
+            busy(10000)
+            record['lines'] = 7
+        self.assertEqual(metrics.stages[0]['stage'], 'work')
+        self.assertEqual(metrics.stages[0]['test_items'], 5)
+        self.assertEqual(metrics.stages[0]['lines'], 7)
+        self.assertGreater(metrics.stages[0]['wall_seconds'], 0)
+        self.assertGreaterEqual(metrics.stages[0]['cpu_seconds'], 0)
+
+    def test_metrics_file(self):
+        """Рядом с отчетом записывается json с измерениями стадий"""
+        name = 'nginx-access-ui.log-20170630.plain'
+        lines = make_lines(2000)
+        with open(os.path.join(self.log_dir, name), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.assertTrue(process_log((name, self.config))[1])
+        with open(os.path.join(self.report_dir, 'report-2017.06.30.metrics.json')) as f:
+            data = json.load(f)
+        stages = {stage['stage']: stage for stage in data['stages']}
+        self.assertEqual(list(stages), ['precheck', 'parse', 'stats', 'report'])
+        self.assertEqual(stages['parse']['lines'], 2000)
+        self.assertEqual(stages['parse']['bad_lines'], sum(line.startswith('broken') for line in lines))
+        self.assertEqual(stages['parse']['read_bytes'], stages['parse']['file_bytes'])
+        self.assertEqual(stages['parse']['regex_lines'], stages['parse']['bad_lines'])
+        self.assertEqual(stages['report']['rows'], 10)
+        self.assertEqual(data['info']['log_file'], os.path.join(self.log_dir, name))
+
+    def test_cprofile(self):
+        path = os.path.join(self.tmp_dir, 'run.prof')
+        with Profiler('cprofile', path):
+            busy(10000)
+        self.assertTrue(any(function[2] == 'busy' for function in pstats.Stats(path).stats))
+
+    @unittest.skipUnless(hasattr(__import__('signal'), 'setitimer'), 'нет signal.setitimer')
+    def test_sampling(self):
+        path = os.path.join(self.tmp_dir, 'run.stacks')
+        with Profiler('sampling', path, interval=0.001):
+            busy(3000000)
+        with open(path) as f:
+            stacks = [line.rsplit(' ', 1) for line in f.read().splitlines()]
+        self.assertTrue(stacks)
+        self.assertTrue(any('test_metrics.py:busy' in stack for stack, _ in stacks))
+        self.assertRaises(ValueError, Profiler, 'perf', path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import os
+import sys
+import gzip
+import random
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import get_request_times_from_log, get_stats, split_file
+
+
+LINE = ('1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET {} HTTP/1.1" 200 927 "-" '
+        '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+        '"1498697422-2190034393-4708-9752759" "dc7161be3" {}')
+
+
+def make_lines(count, seed=42):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        if rnd.random() < 0.05:
+            lines.append('broken line {}'.format(i))
+        else:
+            url = '/api/v2/banner/{}'.format(rnd.randint(1, 50))
+            lines.append(LINE.format(url, '{:.3f}'.format(rnd.random() * 3)))
+    return lines
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_log(self, name, text, compress=False):
+        path = os.path.join(self.tmp_dir, name)
+        with (gzip.open(path, 'wb') if compress else open(path, 'wb')) as f:
+            f.write(text.encode('utf-8'))
+        return path
+
+    def assert_same_result(self, path, workers=4):
+        single = get_request_times_from_log(path)
+        parallel = get_request_times_from_log(path, workers)
+        self.assertEqual(single, parallel)
+        self.assertEqual(list(single[0].keys()), list(parallel[0].keys()))
+        self.assertEqual(get_stats(single[0], 10), get_stats(parallel[0], 10))
+
+    def test_plain_log(self):
+        """Многопроцессная обработка plain-файла совпадает с однопроцессной"""
+        path = self.write_log('nginx-access-ui.log-20170630.plain', '\n'.join(make_lines(3000)) + '\n')
+        self.assert_same_result(path)
+
+    def test_plain_log_line_endings(self):
+        """Совпадение результатов при CRLF и отсутствии перевода строки в конце файла"""
+        path = self.write_log('nginx-access-ui.log-20170630.plain', '\r\n'.join(make_lines(500)))
+        self.assert_same_result(path, workers=7)
+
+    def test_gz_log(self):
+        """Многопроцессная обработка gz-файла совпадает с однопроцессной"""
+        path = self.write_log('nginx-access-ui.log-20170630.gz', '\n'.join(make_lines(25000)) + '\n', compress=True)
+        self.assert_same_result(path)
+
+    def test_split_file(self):
+        """Диапазоны покрывают файл целиком и начинаются с начала строки"""
+        text = '\n'.join(make_lines(100)) + '\n'
+        path = self.write_log('nginx-access-ui.log-20170630.plain', text)
+        ranges = split_file(path, 8)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(text.encode('utf-8')))
+        for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(text.encode('utf-8')[start - 1:start], b'\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import sys
+import json
+import gzip
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import write_partials, merge_partials, load_partial, get_merge_paths, process_log
+from benchmarks.generator import generate_lines
+
+
+LOG_NAME = 'nginx-access-ui.log-20170629.plain'
+
+
+def read_table(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    return json.loads(text[text.index('var table = ') + 12:text.index(';\n    var pages')])
+
+
+class TestPartial(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.lines = list(generate_lines(12000, urls=300, bad_ratio=0.01, seed=8))
+        self.parts = [self.lines[:5000], self.lines[5000:9000], self.lines[9000:]]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def write_log(self, dirname, lines):
+        log_dir = os.path.join(self.tmp_dir, dirname)
+        os.makedirs(log_dir)
+        with open(os.path.join(log_dir, LOG_NAME), 'w') as f:
+            f.write(''.join(lines))
+        return log_dir
+
+    def check_merge(self, options):
+        """Отчет по слитым агрегатам совпадает с отчетом по склеенному log-файлу"""
+        partial_dir = os.path.join(self.tmp_dir, 'partials')
+        for i, lines in enumerate(self.parts):
+            config = dict(options, LOG_DIR=self.write_log('node{}'.format(i), lines), REPORT_DIR=self.tmp_dir,
+                          PARTIAL_DIR=partial_dir, NODE_NAME='node{}'.format(i))
+            self.assertEqual(write_partials(config), [os.path.join(partial_dir, '{}.node{}.partial.json.gz'.format(
+                LOG_NAME, i))])
+            self.assertEqual(write_partials(config), [])
+
+        merged_dir = os.path.join(self.tmp_dir, 'merged')
+        report_name = merge_partials([partial_dir], dict(options, REPORT_SIZE=20, REPORT_DIR=merged_dir))
+        self.assertEqual(report_name, os.path.join(merged_dir, 'report-2017.06.29.html'))
+
+        whole_dir = os.path.join(self.tmp_dir, 'whole')
+        config = dict(options, REPORT_SIZE=20, LOG_DIR=self.write_log('all', self.lines), REPORT_DIR=whole_dir)
+        self.assertTrue(process_log((LOG_NAME, config))[1])
+        reports = sorted(name for name in os.listdir(whole_dir) if not name.endswith('.metrics.json'))
+        self.assertEqual(sorted(name for name in os.listdir(merged_dir) if not name.endswith('.metrics.json')),
+                         reports)
+        for name in reports:
+            path = os.path.join(merged_dir, name)
+            if name.endswith('.html'):
+                self.assertEqual(read_table(path), read_table(os.path.join(whole_dir, name)))
+            else:
+                with open(path) as merged, open(os.path.join(whole_dir, name)) as whole:
+                    self.assertEqual(json.load(merged), json.load(whole))
+        return reports
+
+    def test_exact(self):
+        self.assertEqual(self.check_merge({}), ['report-2017.06.29.html'])
+
+    def test_options(self):
+        reports = self.check_merge({'AGGREGATION': 'sketch', 'URL_RULES': ['numeric', 'hex'], 'TIME_BUCKET': 'hour',
+                                    'GROUP_BY': [['status']]})
+        self.assertEqual(reports, ['report-2017.06.29.html', 'report-2017.06.29.status.html',
+                                   'report-2017.06.29.timeseries.json'])
+
+    def test_mismatch(self):
+        """Файлы с разными параметрами агрегации или версией формата не сливаются"""
+        log_dir = self.write_log('node', self.parts[0])
+        exact = write_partials({'LOG_DIR': log_dir, 'REPORT_DIR': self.tmp_dir, 'NODE_NAME': 'a'})
+        sketch = write_partials({'LOG_DIR': log_dir, 'REPORT_DIR': self.tmp_dir, 'NODE_NAME': 'b',
+                                 'AGGREGATION': 'sketch'})
+        config = {'REPORT_SIZE': 10, 'REPORT_DIR': os.path.join(self.tmp_dir, 'reports')}
+        self.assertRaises(ValueError, merge_partials, exact + sketch, config)
+        self.assertRaises(ValueError, merge_partials, [os.path.join(self.tmp_dir, 'node')], config)
+
+        partial = load_partial(exact[0])
+        partial['version'] += 1
+        with gzip.open(exact[0], 'wt') as f:
+            json.dump(partial, f)
+        self.assertRaises(ValueError, load_partial, exact[0])
+
+    def test_merge_paths(self):
+        self.assertEqual(get_merge_paths(['log_analyzer.py', '--merge', 'a', 'b/', '--config', 'c']), ['a', 'b/'])
+
+
+if __name__ == '__main__':
+    unittest.main()
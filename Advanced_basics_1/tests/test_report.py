@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import re
+import gzip
+import json
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import create_report, load_template, report_written
+
+
+def make_rows(count):
+    return [{'count': i, 'time_avg': i / 7.0, 'url': '/api/{}</script> HTTP/1.1'.format(i)} for i in range(count)]
+
+
+def read_table(text):
+    return json.loads(re.search(r'var table = (\[.*?\]);\n', text, re.DOTALL).group(1))
+
+
+def read_pages(text):
+    return json.loads(re.search(r'var pages = (.*?);\n', text).group(1))
+
+
+def get_page_url(pages, number):
+    """Адрес страницы number так же, как его строит loadPage в report.html"""
+    return pages['prefix'] + str(number).rjust(6, '0') + pages['suffix']
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(current_path), os.pardir))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'reports', 'report-2017.06.30.html')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_json_table(self):
+        """Таблица записывается в json, содержимое строк не закрывает тег script"""
+        rows = make_rows(20)
+        self.assertEqual(create_report(iter(rows), self.path), self.path)
+        with open(self.path, encoding='utf-8') as f:
+            text = f.read()
+        self.assertNotIn('</script> HTTP', text)
+        self.assertEqual(read_table(text), rows)
+        self.assertIsNone(read_pages(text))
+        self.assertTrue(report_written(self.path))
+
+    def test_template_cache(self):
+        """Шаблон читается один раз, пока файл не изменится"""
+        template = os.path.join(self.tmp_dir, 'template.html')
+        with open(template, 'w') as f:
+            f.write('<script>var table = $table_json; var pages = $table_pages; $(x)</script>')
+        parts = load_template(template)
+        self.assertEqual(parts, ['<script>var table = ', 'table_json', '; var pages = ', 'table_pages', '; $(x)</script>'])
+        self.assertIs(load_template(template), parts)
+        with open(template, 'w') as f:
+            f.write('$table_json')
+        os.utime(template, (0, 0))
+        self.assertEqual(load_template(template), ['', 'table_json', ''])
+
+    def test_pages_gzip(self):
+        """
+        Строки сверх REPORT_PAGE_SIZE пишутся страницами, отчет сжимается,
+        рядом со страницами, которые запрашивает отчет, лежат их сжатые копии
+        """
+
+        rows = make_rows(105)
+        path = create_report(rows, self.path, compress=True, page_size=20)
+        self.assertEqual(path, self.path + '.gz')
+        self.assertTrue(report_written(self.path))
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            text = f.read()
+        collected = read_table(text)
+        self.assertEqual(len(collected), 20)
+        pages = read_pages(text)
+        self.assertEqual(pages, {'prefix': 'report-2017.06.30.data/page-', 'suffix': '.js', 'size': 20})
+        data_dir = os.path.join(self.tmp_dir, 'reports', 'report-2017.06.30.data')
+        self.assertEqual(len(os.listdir(data_dir)), 10)
+        for number in range(1, 6):
+            page_path = os.path.join(self.tmp_dir, 'reports', get_page_url(pages, number))
+            with open(page_path, encoding='utf-8') as f:
+                page = f.read()
+            with gzip.open(page_path + '.gz', 'rt', encoding='utf-8') as f:
+                self.assertEqual(f.read(), page)
+            self.assertTrue(page.startswith('reportPage({}, ['.format(number)))
+            collected.extend(json.loads(page[page.index('['):page.rindex(']') + 1]))
+        self.assertEqual(collected, rows)
+
+        create_report(rows[:10], self.path, page_size=20)
+        self.assertFalse(os.path.exists(data_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
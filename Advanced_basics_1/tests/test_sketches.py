@@ -0,0 +1,136 @@
+import unittest
+import os
+import sys
+import math
+import random
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from sketches import QuantileSketch, DistinctCounter
+from url_normalizer import get_url_hash
+from log_analyzer import aggregate, merge_aggregates, get_stats
+
+
+def synthetic_times(count, seed):
+    rnd = random.Random(seed)
+    times = [round(rnd.lognormvariate(-1.5, 1.2), 3) for _ in range(count)]
+    times.extend([0.0] * (count // 50))
+    rnd.shuffle(times)
+    return times
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    accuracy = 0.01
+
+    def assert_quantile(self, sketch, values, q):
+        exact = sorted(values)[math.floor(q * (len(values) - 1))]
+        self.assertLessEqual(abs(sketch.quantile(q) - exact), self.accuracy * exact + 1e-12, q)
+
+    def test_error_bound(self):
+        """Оценки квантилей укладываются в заявленную относительную точность"""
+        for seed in range(5):
+            values = synthetic_times(5000, seed)
+            sketch = QuantileSketch(self.accuracy)
+            for value in values:
+                sketch.add(value)
+            self.assertEqual(sketch.count, len(values))
+            self.assertEqual(sketch.max, max(values))
+            self.assertAlmostEqual(sketch.total, sum(values))
+            for q in (0.0, 0.1, 0.5, 0.9, 0.95, 0.99, 1.0):
+                self.assert_quantile(sketch, values, q)
+
+    def test_merge(self):
+        """Слияние скетчей эквивалентно скетчу по объединенной выборке"""
+        values = synthetic_times(6000, 7)
+        whole, parts = QuantileSketch(self.accuracy), [QuantileSketch(self.accuracy) for _ in range(3)]
+        for i, value in enumerate(values):
+            whole.add(value)
+            parts[i % 3].add(value)
+        merged = parts[0].merge(parts[1]).merge(parts[2])
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assertEqual(merged.zero_count, whole.zero_count)
+        self.assertEqual(merged.count, whole.count)
+        self.assertEqual(merged.max, whole.max)
+        for q in (0.5, 0.9, 0.99):
+            self.assertEqual(merged.quantile(q), whole.quantile(q))
+
+    def test_bounded_memory(self):
+        """Число корзин не превышает max_buckets"""
+        sketch = QuantileSketch(self.accuracy, max_buckets=64)
+        values = [10 ** (i / 1000.0) for i in range(-6000, 3000)]
+        for value in values:
+            sketch.add(value)
+        self.assertLessEqual(len(sketch.buckets), 64)
+        self.assert_quantile(sketch, values, 0.99)
+
+    def test_empty(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        self.assertRaises(ValueError, QuantileSketch, 1.5)
+
+
+class TestDistinctCounter(unittest.TestCase):
+
+    def fill(self, urls):
+        counter = DistinctCounter()
+        for url in urls:
+            counter.add(get_url_hash(url))
+        return counter
+
+    def test_exact(self):
+        counter = self.fill('/u/{}'.format(i % 700) for i in range(3000))
+        self.assertEqual(counter.count(), 700)
+        self.assertIsNone(counter.registers)
+
+    def test_estimate(self):
+        """Оценка для множества, не помещающегося в точный режим, и объем памяти"""
+        for size in (2000, 50000):
+            counter = self.fill('/u/{}'.format(i) for i in range(size))
+            self.assertIsNone(counter.hashes)
+            self.assertEqual(len(counter.registers), 4096)
+            self.assertLess(abs(counter.count() - size) / size, 0.05)
+
+    def test_merge(self):
+        """Слияние не зависит от порядка и совпадает со счетчиком по всем значениям"""
+        urls = ['/u/{}'.format(i) for i in range(3000)]
+        whole = self.fill(urls)
+        for parts in ([urls[:500], urls[500:900], urls[900:]], [urls[:100], urls[2000:], urls[100:2000]]):
+            merged = DistinctCounter()
+            for part in parts:
+                merged.merge(self.fill(part))
+            self.assertEqual(merged.registers, whole.registers)
+        small = self.fill(urls[:300]).merge(self.fill(urls[200:600]))
+        self.assertEqual(small.count(), 600)
+        for counter in (small, whole):
+            self.assertEqual(DistinctCounter.from_dict(counter.to_dict()).count(), counter.count())
+        self.assertRaises(ValueError, whole.merge, DistinctCounter(precision=10))
+
+
+class TestSketchAggregation(unittest.TestCase):
+
+    def test_report_rows(self):
+        """Отчет в режиме sketch совпадает с точным в пределах точности скетча"""
+        rnd = random.Random(1)
+        entries = []
+        for value in synthetic_times(20000, 3):
+            entries.append({'request_url': '/api/{}'.format(int(rnd.paretovariate(1.2)) % 40), 'request_time': str(value)})
+        entries.extend([None] * 10)
+        exact_dict, good, bad = aggregate(entries)
+        half = len(entries) // 2
+        sketch_result = merge_aggregates(aggregate(entries[:half], 0.01), aggregate(entries[half:], 0.01))
+        self.assertEqual((good, bad), sketch_result[1:])
+
+        exact_rows = get_stats(exact_dict, 10)
+        sketch_rows = get_stats(sketch_result[0], 10)
+        self.assertEqual([row['url'] for row in exact_rows], [row['url'] for row in sketch_rows])
+        for exact_row, sketch_row in zip(exact_rows, sketch_rows):
+            times = sorted(exact_dict[exact_row['url']])
+            self.assertEqual(exact_row['count'], sketch_row['count'])
+            self.assertEqual(exact_row['time_max'], sketch_row['time_max'])
+            self.assertAlmostEqual(exact_row['time_sum'], sketch_row['time_sum'])
+            for key, q in (('time_med', 0.5), ('time_p90', 0.9), ('time_p95', 0.95), ('time_p99', 0.99)):
+                exact = times[math.floor(q * (len(times) - 1))]
+                self.assertLessEqual(abs(sketch_row[key] - exact), 0.01 * exact + 1e-12, key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+import sys
+import random
+import operator
+from array import array
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import get_stats, get_median, select_ranks
+
+
+def sorting_get_stats(time_dict, size):
+    """Исходная реализация get_stats с полной сортировкой"""
+    time_sum = dict()
+    all_time = 0.0
+    N = 0
+    for url in time_dict.keys():
+        time_sum[url] = sum(time_dict[url])
+        all_time += time_sum[url]
+        N += len(time_dict[url])
+    time_sorted = sorted(time_sum.items(), key=operator.itemgetter(1), reverse=True)
+    out_list = list()
+    for url, sum_value in time_sorted[:size]:
+        n = len(time_dict[url])
+        temp = sorted(time_dict[url])
+        out_list.append({'count': n,
+                        'time_avg': sum_value/n,
+                        'time_max': max(time_dict[url]),
+                        'time_sum': sum_value,
+                        'url': url,
+                        'time_med': (sum(temp[n//2-1:n//2+1])/2.0, temp[n//2])[n % 2] if n else None,
+                        'time_perc': sum_value/all_time,
+                        'count_perc': n/N
+                        })
+    return out_list
+
+
+class TestStats(unittest.TestCase):
+
+    def test_select_ranks(self):
+        """Выбор порядковых статистик совпадает с сортировкой"""
+        rnd = random.Random(5)
+        for values in ([rnd.random() for _ in range(100000)],
+                       array('d', (round(rnd.random(), 3) for _ in range(50000))),
+                       [rnd.choice((0.1, 0.2, 0.3)) for _ in range(40000)],
+                       [float(i) for i in range(20000, 0, -1)],
+                       [1.0] * 30000,
+                       [rnd.random() for _ in range(100)]):
+            expected = sorted(values)
+            ranks = (0, 1, len(values) // 2 - 1, len(values) // 2, len(values) - 1)
+            self.assertEqual(select_ranks(values, ranks), [expected[rank] for rank in ranks])
+            n = len(values)
+            self.assertEqual(get_median(values), (sum(expected[n//2-1:n//2+1])/2.0, expected[n//2])[n % 2])
+        self.assertIsNone(get_median([]))
+        self.assertEqual(get_median(array('d', [3.0, 1.0, 2.0, 10.0])), 2.5)
+
+    def test_same_as_sorting(self):
+        """Строки отчета совпадают с реализацией на полной сортировке, в том числе при равных суммах"""
+        rnd = random.Random(11)
+        time_dict = dict()
+        for i in range(3000):
+            count = 1 + int(rnd.paretovariate(1.0)) % 5000
+            if i % 3:
+                time_dict['/url/{}'.format(i)] = array('d', (round(rnd.random(), 3) for _ in range(count)))
+            else:
+                time_dict['/url/{}'.format(i)] = array('d', [0.5] * (i % 7 + 1))
+        for size in (0, 1, 10, 500, 5000):
+            self.assertEqual(get_stats(time_dict, size), sorting_get_stats(time_dict, size))
+
+
+if __name__ == '__main__':
+    unittest.main()
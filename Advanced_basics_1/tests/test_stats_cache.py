@@ -0,0 +1,55 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import (aggregate, parse_lines, get_stats, get_stats_from_cache, get_file_identity,
+                          save_stats_cache, load_stats_cache)
+from test_parallel import make_lines
+
+
+class TestStatsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630.plain')
+        self.cache_path = os.path.join(self.tmp_dir, 'cache', 'nginx-access-ui.log-20170630.plain.stats')
+        lines = make_lines(3000)
+        lines.append(lines[0].replace('/api/v2/banner/', '/api/v2/баннер/'))
+        with open(self.log_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_cache(self, sketch_accuracy):
+        with open(self.log_path, encoding='utf-8') as f:
+            result = aggregate(parse_lines(f), sketch_accuracy)
+        identity = get_file_identity(self.log_path)
+        save_stats_cache(self.cache_path, identity, result, sketch_accuracy)
+        with load_stats_cache(self.cache_path, identity, sketch_accuracy) as cache:
+            self.assertEqual((cache.meta['good_count'], cache.meta['bad_count']), result[1:])
+            for size in (0, 1, 7, 1000):
+                self.assertEqual(get_stats_from_cache(cache, size), get_stats(result[0], size))
+        self.assertIsNone(load_stats_cache(self.cache_path, identity, 0.02 if sketch_accuracy else 0.01))
+
+    def test_exact(self):
+        """Отчет по файлу агрегатов совпадает с отчетом по разобранному log-файлу"""
+        self.check_cache(None)
+
+    def test_sketch(self):
+        """Файл агрегатов в режиме sketch содержит колонки квантилей"""
+        self.check_cache(0.01)
+
+    def test_invalidation(self):
+        """Файл агрегатов не используется после изменения log-файла"""
+        self.check_cache(None)
+        with open(self.log_path, 'a') as f:
+            f.write(make_lines(1)[0] + '\n')
+        self.assertIsNone(load_stats_cache(self.cache_path, get_file_identity(self.log_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
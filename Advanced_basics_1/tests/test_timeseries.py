@@ -0,0 +1,134 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from timeseries import TimeSeries
+from sketches import QuantileSketch
+from log_analyzer import (parse_lines, get_request_times_from_log, get_request_times_incremental, get_stats,
+                          save_time_series, get_time_series)
+from benchmarks.generator import generate_lines
+
+
+def get_counts(series, time_dict=None):
+    """
+    Словарь {(url, метка интервала): (количество, сумма)} по временным рядам
+    series (для точных рядов - со словарем времен time_dict)
+    """
+
+    result = dict()
+    for url, by_label in series.get_buckets(time_dict).items():
+        for label, times in by_label.items():
+            if isinstance(times, QuantileSketch):
+                result[url, label] = (times.count, times.total)
+            else:
+                result[url, label] = (len(times), sum(times))
+    return result
+
+
+class TestTimeSeries(unittest.TestCase):
+
+    def test_labels(self):
+        minutes, hours = TimeSeries('minute'), TimeSeries('hour')
+        self.assertEqual(minutes.get_label('29/Jun/2017:03:50:22 +0300'), '2017-06-29T03:50+03:00')
+        self.assertEqual(minutes.get_label('29/Jun/2017:03:50:59 +0300'), '2017-06-29T03:50+03:00')
+        self.assertEqual(minutes.get_label('01/Dec/2017:23:05:00 -0130'), '2017-12-01T23:05-01:30')
+        self.assertEqual(hours.get_label('29/Jun/2017:03:50:22 +0300'), '2017-06-29T03:00+03:00')
+        self.assertIsNone(minutes.get_label('29/JUN/2017:03:50:22 +0300'))
+        self.assertIsNone(minutes.get_label('31/Feb/2017:03:50:22 +0300'))
+        self.assertEqual(len(minutes._labels), 4)
+        self.assertRaises(ValueError, TimeSeries, 'second')
+
+    def test_merge(self):
+        """Номера интервалов второй части переводятся в номера первой, времена не дублируются"""
+        first, second = TimeSeries('minute'), TimeSeries('minute')
+        first.add('/a', '29/Jun/2017:03:50:22 +0300', 1.0)
+        first.add('/a', '29/Jun/2017:03:51:22 +0300', 2.0)
+        second.add('/b', '29/Jun/2017:03:52:00 +0300', 3.0)
+        second.add('/a', '29/Jun/2017:03:51:59 +0300', 4.0)
+        self.assertEqual(first.merge(second).keys, ['29/Jun/2017:03:50 +0300', '29/Jun/2017:03:51 +0300',
+                                                    '29/Jun/2017:03:52 +0300'])
+        time_dict = {'/a': [1.0, 2.0, 4.0], '/b': [3.0]}
+        restored = TimeSeries.from_dict(first.to_dict())
+        for series in (first, restored):
+            self.assertEqual(get_counts(series, time_dict), {
+                ('/a', '2017-06-29T03:50+03:00'): (1, 1.0), ('/a', '2017-06-29T03:51+03:00'): (2, 6.0),
+                ('/b', '2017-06-29T03:52+03:00'): (1, 3.0)})
+        self.assertRaises(ValueError, first.report, ['/a'])
+
+        sketched = TimeSeries('hour', 0.01)
+        for i in range(40):
+            sketched.add('/a', '29/Jun/2017:03:50:22 +0300', 1.0 + i)
+        sketched.add('/b', '29/Jun/2017:03:50:22 +0300', 2.0)
+        buckets = TimeSeries.from_dict(sketched.to_dict()).get_buckets()
+        self.assertIsInstance(buckets['/a']['2017-06-29T03:00+03:00'], QuantileSketch)
+        self.assertEqual(list(buckets['/b']['2017-06-29T03:00+03:00']), [2.0])
+        self.assertEqual(sketched.report(['/a', '/b'])['total'][0]['count'], 41)
+
+    def test_config(self):
+        """Скетчи во временных рядах только в режимах агрегации со скетчами"""
+        self.assertIsNone(get_time_series({}))
+        self.assertIsNone(get_time_series({'TIME_BUCKET': 'hour'}).accuracy)
+        self.assertIsNone(get_time_series({'TIME_BUCKET': 'hour', 'SKETCH_ACCURACY': 0.05}).accuracy)
+        self.assertEqual(get_time_series({'TIME_BUCKET': 'minute', 'AGGREGATION': 'sketch'}).accuracy, 0.01)
+        self.assertEqual(get_time_series({'TIME_BUCKET': 'minute', 'AGGREGATION': 'heavy',
+                                          'SKETCH_ACCURACY': 0.05}).accuracy, 0.05)
+
+    def test_series(self):
+        """Количество и сумма по интервалам совпадают с точным подсчетом"""
+        lines = list(generate_lines(20000, urls=50, bad_ratio=0.02, seed=5))
+        expected = dict()
+        for entry in parse_lines(lines, with_time=True):
+            if entry:
+                key = (entry['request_url'], TimeSeries('hour').get_label(entry['time_local']))
+                count, total = expected.get(key, (0, 0.0))
+                expected[key] = (count + 1, total + float(entry['request_time']))
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'nginx-access-ui.log-20170629.plain')
+            with open(path, 'w') as f:
+                f.write(''.join(lines))
+            single, parallel, sketched = TimeSeries('hour'), TimeSeries('hour'), TimeSeries('hour', 0.01)
+            first = get_request_times_from_log(path, series=single)
+            self.assertEqual(get_request_times_from_log(path, 3, series=parallel), first)
+            self.assertEqual(first, get_request_times_from_log(path))
+            get_request_times_from_log(path, 3, sketch_accuracy=0.01, series=sketched)
+            for series in (single, parallel, sketched):
+                counts = get_counts(series, first[0])
+                self.assertEqual(set(counts), set(expected))
+                for key, (count, total) in counts.items():
+                    self.assertEqual(count, expected[key][0])
+                    self.assertAlmostEqual(total, expected[key][1])
+
+            state_path = os.path.join(tmp_dir, 'reports.state')
+            with open(path, 'w') as f:
+                f.write(''.join(lines[:12000]))
+            get_request_times_incremental(path, state_path, series=TimeSeries('hour'))
+            with open(path, 'a') as f:
+                f.write(''.join(lines[12000:]))
+            resumed = TimeSeries('hour')
+            self.assertEqual(get_request_times_incremental(path, state_path, series=resumed), first)
+            self.assertEqual({key: value[0] for key, value in get_counts(resumed, first[0]).items()},
+                             {key: value[0] for key, value in expected.items()})
+
+            out_list = get_stats(first[0], 5)
+            report_name = os.path.join(tmp_dir, 'reports', 'report-2017.06.29.html')
+            save_time_series(single, out_list, report_name, first[0])
+            data = single.report([row['url'] for row in out_list], first[0])
+            self.assertEqual(list(data['urls']), [row['url'] for row in out_list])
+            self.assertEqual(len(data['total']), 24)
+            self.assertEqual(sum(row['count'] for row in data['total']), first[1])
+            for row in out_list:
+                self.assertEqual(sum(point['count'] for point in data['urls'][row['url']]), row['count'])
+            for point in data['total']:
+                self.assertLessEqual(point['time_p50'], point['time_p99'])
+            self.assertTrue(os.path.isfile(os.path.join(tmp_dir, 'reports', 'report-2017.06.29.timeseries.json')))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
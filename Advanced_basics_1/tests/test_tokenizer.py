@@ -0,0 +1,97 @@
+import unittest
+import os
+import sys
+import random
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from log_analyzer import parse_lines, tokenize
+from test_parallel import LINE, make_lines
+
+
+FIELDS = ('status', 'body_bytes_sent', 'request_type', 'remote_addr', 'http_referer', 'http_user_agent')
+
+
+SPECIAL_LINES = [
+    '',
+    '\n',
+    LINE.format('/api/1', '0.1') + '\n',
+    LINE.format('/api/1', '-'),
+    LINE.format('/api/"quoted"', '0.1'),
+    LINE.format('/api/1', '0.1 0.2'),
+    LINE.format('/api/1', '0.1').replace('HTTP/1.1', 'http/1.0'),
+    LINE.format('/api/1', '0.1').replace('GET', 'G3T'),
+    LINE.format('/api/1', '0.1').replace('Jun', 'JUN'),
+    LINE.format('/api/1', '0.1').replace('Jun', 'J1n'),
+    LINE.format('/api/1', '0.1').replace(' 200 ', ' 20 '),
+    LINE.format('/api/1', '0.1').replace('"-"', '""', 1),
+    LINE.format('/api/1', '0.1').replace('1.196.116.32', '1.196.116'),
+    LINE.format('/api/1', '0.1').replace('1.196.116.32', 'host 1.196.116.32'),
+    LINE.format('/api/1', '0.1').replace('-  -', '-'),
+    LINE.format('/api/1', '0.1').replace('+0300', '0300'),
+    LINE.format('', '0.1'),
+    LINE.format(' HTTP/1.1', '0.1'),
+    '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "GET /a HTTP/1.1" 200 1 "-" "-" "-" "-" "-" 0.1',
+    '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "GET /a HTTP/1.1" 200 1 "-" "a" "b" "-" "-" "-" "-" 0.1',
+    '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "GET /a HTTP/1.1" 200 1 "-" "-" "-" "-" "-"  0.1',
+    '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300]  "GET /a HTTP/1.1" 200 1 "-" "-" "-" "-" "-" 0.1',
+    '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "GET /путь HTTP/1.1" 200 1 "-" "Агент" "-" "-" "-" 0.1',
+    '1.1.1.1 - ю [29/Jun/2017:03:50:22 +0300] "GET /a HTTP/1.1" 200 1 "-" "-" "-" "-" "-" 0.1',
+    '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "GET /a HTTP/1.1" ٢00 1 "-" "-" "-" "-" "-" 0.1',
+]
+
+
+def mutate(line, rnd):
+    position = rnd.randrange(len(line) + 1)
+    choice = rnd.random()
+    if choice < 0.4:
+        return line[:position] + line[position + 1:]
+    if choice < 0.8:
+        return line[:position] + rnd.choice(' "[]-/.:0aZ') + line[position:]
+    return line[:position] + line[position:].upper()
+
+
+class TestTokenizer(unittest.TestCase):
+
+    def assert_same_entries(self, lines):
+        for line in lines:
+            regex = next(parse_lines([line], fast=False))
+            for fast in (next(parse_lines([line])), next(parse_lines([line.encode('utf-8')]))):
+                if regex is None:
+                    self.assertIsNone(fast, line)
+                else:
+                    self.assertIsNotNone(fast, line)
+                    self.assertEqual(fast['request_url'], regex['request_url'], line)
+                    self.assertEqual(fast['request_time'], regex['request_time'], line)
+            timed = next(parse_lines([line], with_time=True))
+            if regex is not None:
+                self.assertEqual(timed['time_local'], regex['time_local'], line)
+            grouped = next(parse_lines([line], fields=FIELDS))
+            if regex is not None:
+                self.assertEqual({field: grouped[field] for field in FIELDS},
+                                 {field: regex[field] for field in FIELDS}, line)
+
+    def test_regular_lines(self):
+        """Обычные строки разбираются без регулярного выражения"""
+        for line in make_lines(500):
+            if not line.startswith('broken'):
+                self.assertIsNotNone(tokenize(line.encode('utf-8')), line)
+        self.assert_same_entries(make_lines(500))
+
+    def test_special_lines(self):
+        """Совпадение классификации и полей с регулярным выражением на особых строках"""
+        self.assert_same_entries(SPECIAL_LINES)
+
+    def test_mutated_lines(self):
+        """Совпадение классификации и полей с регулярным выражением на испорченных строках"""
+        rnd = random.Random(0)
+        lines = []
+        for line in make_lines(300):
+            for _ in range(10):
+                for _ in range(rnd.randint(1, 3)):
+                    line = mutate(line, rnd)
+                lines.append(line)
+        self.assert_same_entries(lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
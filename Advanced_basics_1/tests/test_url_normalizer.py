@@ -0,0 +1,127 @@
+import unittest
+import os
+import sys
+import random
+import shutil
+import tempfile
+current_path = os.path.realpath(__file__)
+sys.path.append(os.path.join(os.path.dirname(current_path), os.pardir))
+from url_normalizer import UrlNormalizer
+from log_analyzer import (aggregate, parse_lines, get_request_times_from_log, get_request_times_incremental,
+                          get_stats, get_file_identity, save_stats_cache, load_stats_cache, get_stats_from_cache)
+from test_parallel import LINE
+
+
+def make_lines(count, seed=3):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        choice = rnd.random()
+        if choice < 0.3:
+            url = '/api/v2/banner/{}'.format(rnd.randint(1, 500))
+        elif choice < 0.5:
+            url = '/api/v2/slot/{}/groups?page={}'.format(rnd.randint(1, 100), rnd.randint(1, 9))
+        elif choice < 0.7:
+            url = '/export/{:032x}/file'.format(rnd.getrandbits(128))
+        elif choice < 0.95:
+            url = '/api/1/campaigns/?id={}'.format(rnd.randint(1, 1000))
+        else:
+            url = '/accounts/self/'
+        lines.append(LINE.format(url, '{:.3f}'.format(rnd.random())))
+    return lines
+
+
+class TestUrlNormalizer(unittest.TestCase):
+
+    def test_rules(self):
+        normalizer = UrlNormalizer()
+        cases = [('/api/v2/banner/25019354 HTTP/1.1', '/api/v2/banner/{id} HTTP/1.1'),
+                 ('/api/v2/slot/4705/groups?a=1&b=2 HTTP/1.0', '/api/v2/slot/{id}/groups HTTP/1.0'),
+                 ('/u/123e4567-e89b-12d3-a456-426614174000/ HTTP/1.1', '/u/{uuid}/ HTTP/1.1'),
+                 ('/f/d41d8cd98f00b204e9800998ecf8427e HTTP/1.1', '/f/{hex} HTTP/1.1'),
+                 ('/f/deadbeefcafe HTTP/1.1', '/f/deadbeefcafe HTTP/1.1'),
+                 ('/api/v2/internal/banner/24294027/info', '/api/v2/internal/banner/{id}/info')]
+        for url, template in cases:
+            self.assertEqual(normalizer.normalize(url), template)
+        only_query = UrlNormalizer(['query'])
+        self.assertEqual(only_query.normalize('/banner/25?x=1 HTTP/1.1'), '/banner/25 HTTP/1.1')
+        self.assertRaises(ValueError, UrlNormalizer, ['query', 'dates'])
+
+    def test_interning(self):
+        normalizer = UrlNormalizer()
+        first = normalizer.get_id('/banner/1 HTTP/1.1')
+        self.assertEqual(normalizer.get_id('/banner/2 HTTP/1.1'), first)
+        self.assertEqual(normalizer.get_id('/banner/1 HTTP/1.1'), first)
+        self.assertNotEqual(normalizer.get_id('/slot/1 HTTP/1.1'), first)
+        self.assertEqual(normalizer.variant_counts(), {'/banner/{id} HTTP/1.1': 2, '/slot/{id} HTTP/1.1': 1})
+
+    def test_bounded_cache(self):
+        """Кэш исходных URL ограничен, а число вариантов шаблона считается без него"""
+        normalizer = UrlNormalizer(cache_size=100)
+        for i in range(5000):
+            normalizer.get_id('/banner/{} HTTP/1.1'.format(i % 1000))
+        self.assertLessEqual(len(normalizer._raw_ids), 100)
+        self.assertEqual(normalizer.variant_counts(), {'/banner/{id} HTTP/1.1': 1000})
+
+
+class TestNormalizedAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630.plain')
+        self.lines = make_lines(5000)
+        with open(self.log_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.lines) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def reference(self):
+        """Агрегация с нормализацией, выполненной заранее над исходными записями"""
+        normalizer = UrlNormalizer()
+        entries = list(parse_lines(self.lines))
+        raw_urls = dict()
+        for entry in entries:
+            template = normalizer.normalize(entry['request_url'])
+            raw_urls.setdefault(template, set()).add(entry['request_url'])
+            entry['request_url'] = template
+        time_dict, good, bad = aggregate(entries)
+        return time_dict, good, bad, {template: len(urls) for template, urls in raw_urls.items()}
+
+    def test_templates(self):
+        """Сырые URL сворачиваются в шаблоны, число вариантов попадает в отчет"""
+        time_dict, good, bad, variants = self.reference()
+        self.assertEqual(len(time_dict), 5)
+        for workers in (1, 3):
+            normalizer = UrlNormalizer()
+            result = get_request_times_from_log(self.log_path, workers, normalizer=normalizer)
+            self.assertEqual(result, (time_dict, good, bad))
+            self.assertEqual(normalizer.variant_counts(), variants)
+            rows = get_stats(result[0], 10, normalizer.variant_counts())
+            self.assertEqual(rows, get_stats(time_dict, 10, variants))
+            self.assertEqual(sum(row['url_variants'] for row in rows), sum(variants.values()))
+
+    def test_incremental_and_cache(self):
+        """Число вариантов сохраняется в файле состояния и в файле агрегатов"""
+        with open(self.log_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.lines[:3000]) + '\n')
+        state_path = os.path.join(self.tmp_dir, 'reports.state')
+        get_request_times_incremental(self.log_path, state_path, normalizer=UrlNormalizer())
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(self.lines[3000:]) + '\n')
+        normalizer = UrlNormalizer()
+        result = get_request_times_incremental(self.log_path, state_path, normalizer=normalizer)
+        time_dict, good, bad, variants = self.reference()
+        self.assertEqual(result, (time_dict, good, bad))
+        self.assertEqual(normalizer.variant_counts(), variants)
+
+        cache_path = os.path.join(self.tmp_dir, 'cache', 'log.stats')
+        identity = get_file_identity(self.log_path)
+        save_stats_cache(cache_path, identity, result, normalizer=normalizer)
+        self.assertIsNone(load_stats_cache(cache_path, identity))
+        with load_stats_cache(cache_path, identity, url_rules=normalizer.rules) as cache:
+            self.assertEqual(get_stats_from_cache(cache, 10), get_stats(time_dict, 10, variants))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,7 +27,7 @@ class TestAnalyzer(unittest.TestCase):
         self.assertTrue(os.path.exists(r'./test_success_reports/report-2019.11.11.html'))
         with open(r'./test_success_reports/report-2019.11.11.html', 'r') as f:
             report_text = f.read()
-        list_len = len(re.findall(r"((\{('\w+': [^\{\}]*(, ){0,1})\})(, ){0,1}){1}", report_text))
+        list_len = len(re.findall(r'((\{("\w+": [^\{\}]*(, ){0,1})\})(, ){0,1}){1}', report_text))
         self.assertTrue(list_len == 42)
 
         """
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Агрегация времен обработки запросов по интервалам времени (минутам или часам)
+для каждого URL.
+"""
+
+import math
+import datetime
+from array import array
+
+from sketches import QuantileSketch
+
+
+UNITS = {'minute': 17, 'hour': 14}
+MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+QUANTILES = (('time_p50', 0.5), ('time_p99', 0.99))
+SKETCH_MIN_COUNT = 32
+
+
+def parse_prefix(key, with_minutes=True):
+    """
+    Начало минуты (или часа при with_minutes=False) в виде datetime с часовым
+    поясом для префикса поля time_local вида "29/Jun/2017:03:50 +0300"
+    (без секунд), None если префикс некорректен.
+    """
+
+    try:
+        offset = int(key[-4:-2]) * 60 + int(key[-2:])
+        tz = datetime.timezone(datetime.timedelta(minutes=-offset if key[-5] == '-' else offset))
+        minute = int(key[15:17]) if with_minutes else 0
+        return datetime.datetime(int(key[7:11]), MONTHS[key[3:6]], int(key[0:2]), int(key[12:14]), minute,
+                                 tzinfo=tz)
+    except (KeyError, ValueError):
+        return None
+
+
+class TimeSeries:
+    """
+    Времена запросов по URL и интервалам времени (минутам или часам поля
+    time_local вида "29/Jun/2017:03:50:22 +0300").
+
+    Интервал строки определяется по сырому префиксу поля до минуты (или часа)
+    вместе с часовым поясом, без разбора даты: префиксы нумеруются в таблице
+    keys, а метка интервала в формате ISO 8601 вычисляется по префиксу только
+    при построении отчета, один раз на префикс. Пока поле time_local не
+    меняется, номер интервала берется из предыдущей строки.
+
+    Если задана точность accuracy, то для каждого интервала хранится словарь
+    {url: времена}, и строка дописывается в словарь текущего интервала.
+    Времена пары (URL, интервал) хранятся массивом array('d'), пока их меньше
+    SKETCH_MIN_COUNT, затем заменяются на QuantileSketch (количество и сумма
+    точно, квантили с относительной точностью accuracy): большинство пар
+    содержит лишь несколько строк, и создавать скетч на каждую из них дорого.
+
+    Без accuracy для каждого URL хранится только массив номеров интервалов,
+    параллельный массиву времен этого URL в основной агрегации time_dict:
+    времена не дублируются, и квантили вычисляются точно по time_dict при
+    построении отчета. Поэтому части временных рядов должны сливаться в том
+    же порядке, что и словари времен (как в merge_aggregates).
+    """
+
+    def __init__(self, unit='minute', accuracy=None):
+        if unit not in UNITS:
+            raise ValueError('Неизвестный интервал агрегации по времени "{}", допустимые значения: {}'.format(
+                unit, ', '.join(UNITS)))
+        self.unit = unit
+        self.accuracy = accuracy
+        self.keys = list()
+        self.ids = dict()
+        self.sketches = dict()
+        self._prefix = UNITS[unit]
+        self._key_ids = dict()
+        self._labels = dict()
+        self._last = (None, None, None)
+
+    def parse_prefix(self, key):
+        """
+        Метка интервала в формате ISO 8601 для префикса key вида
+        "29/Jun/2017:03:50 +0300", None если префикс некорректен.
+        """
+
+        moment = parse_prefix(key, self.unit == 'minute')
+        return moment.isoformat(timespec='minutes') if moment is not None else None
+
+    def get_key(self, time_local):
+        """Префикс поля time_local до минуты (или часа) с часовым поясом"""
+        return time_local[:self._prefix] + time_local[20:]
+
+    def get_key_id(self, key):
+        key_id = self._key_ids.get(key)
+        if key_id is None:
+            key_id = self._key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    def get_label(self, time_local):
+        return self.get_key_label(self.get_key(time_local))
+
+    def get_key_label(self, key):
+        label = self._labels.get(key, False)
+        if label is False:
+            label = self._labels[key] = self.parse_prefix(key)
+        return label
+
+    def add(self, url, time_local, value):
+        last, key_id, bucket = self._last
+        if time_local != last:
+            key_id = self.get_key_id(time_local[:self._prefix] + time_local[20:])
+            bucket = None
+            if self.accuracy:
+                bucket = self.sketches.get(key_id)
+                if bucket is None:
+                    bucket = self.sketches[key_id] = dict()
+            self._last = (time_local, key_id, bucket)
+        if bucket is not None:
+            times = bucket.get(url)
+            if times is None:
+                bucket[url] = array('d', (value,))
+            elif times.__class__ is array:
+                times.append(value)
+                if len(times) >= SKETCH_MIN_COUNT:
+                    bucket[url] = self.to_sketch(times)
+            else:
+                times.add(value)
+        else:
+            ids = self.ids.get(url)
+            if ids is None:
+                ids = self.ids[url] = array('I')
+            ids.append(key_id)
+
+    def to_sketch(self, times):
+        sketch = QuantileSketch(self.accuracy)
+        for value in times:
+            sketch.add(value)
+        return sketch
+
+    def merge_times(self, target, times):
+        """Сливает времена times (массив или скетч) в target, возвращает результат"""
+        if not isinstance(target, QuantileSketch) and isinstance(times, QuantileSketch):
+            target, times = times, target
+        if isinstance(target, QuantileSketch):
+            if isinstance(times, QuantileSketch):
+                target.merge(times)
+            else:
+                for value in times:
+                    target.add(value)
+            return target
+        target.extend(times)
+        return self.to_sketch(target) if self.accuracy and len(target) >= SKETCH_MIN_COUNT else target
+
+    def merge(self, other):
+        remap = [self.get_key_id(key) for key in other.keys]
+        identity = remap == list(range(len(remap)))
+        for url, other_ids in other.ids.items():
+            ids = other_ids if identity else array('I', map(remap.__getitem__, other_ids))
+            if url in self.ids:
+                self.ids[url].extend(ids)
+            else:
+                self.ids[url] = ids
+        for key_id, other_bucket in other.sketches.items():
+            bucket = self.sketches.setdefault(remap[key_id], dict())
+            for url, times in other_bucket.items():
+                bucket[url] = self.merge_times(bucket[url], times) if url in bucket else times
+        return self
+
+    def to_dict(self):
+        return {'unit': self.unit,
+                'accuracy': self.accuracy,
+                'keys': self.keys,
+                'ids': {url: ids.tolist() for url, ids in self.ids.items()},
+                'sketches': [[key_id, {url: times.to_dict() if isinstance(times, QuantileSketch) else times.tolist()
+                                       for url, times in bucket.items()}]
+                             for key_id, bucket in self.sketches.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(data['unit'], data['accuracy'])
+        for key in data['keys']:
+            result.get_key_id(key)
+        result.ids = {url: array('I', ids) for url, ids in data['ids'].items()}
+        result.sketches = {key_id: {url: QuantileSketch.from_dict(times) if isinstance(times, dict) else array('d', times)
+                                    for url, times in bucket.items()}
+                           for key_id, bucket in data['sketches']}
+        return result
+
+    def get_buckets(self, time_dict=None, urls=None):
+        """
+        Словарь {url: {метка интервала: времена array('d') или скетч}} для
+        списка urls (по умолчанию для всех URL). В точном режиме времена
+        берутся из словаря time_dict основной агрегации.
+        """
+
+        labels = [self.get_key_label(key) for key in self.keys]
+        result = dict()
+        if self.accuracy:
+            wanted = set(urls) if urls is not None else None
+            for key_id, bucket in self.sketches.items():
+                label = labels[key_id]
+                if label is None:
+                    continue
+                for url, times in bucket.items():
+                    if wanted is None or url in wanted:
+                        result.setdefault(url, dict())[label] = times
+            return result
+        if not isinstance(time_dict, dict):
+            raise ValueError('Для точных временных рядов нужен словарь времен основной агрегации')
+        for url in self.ids if urls is None else urls:
+            by_label = result[url] = dict()
+            for key_id, value in zip(self.ids.get(url, ()), time_dict.get(url, ())):
+                label = labels[key_id]
+                if label is None:
+                    continue
+                times = by_label.get(label)
+                if times is None:
+                    by_label[label] = array('d', (value,))
+                else:
+                    times.append(value)
+        return result
+
+    def get_rows(self, by_label):
+        """Строки временного ряда по словарю {метка интервала: времена} в порядке времени"""
+        rows = []
+        for label, times in sorted(by_label.items()):
+            if isinstance(times, QuantileSketch):
+                row = {'time': label, 'count': times.count, 'time_sum': times.total}
+                for key, q in QUANTILES:
+                    row[key] = times.quantile(q)
+            else:
+                row = {'time': label, 'count': len(times), 'time_sum': sum(times)}
+                ordered = sorted(times)
+                for key, q in QUANTILES:
+                    row[key] = ordered[math.floor(q * (len(ordered) - 1))]
+            rows.append(row)
+        return rows
+
+    def report(self, urls, time_dict=None):
+        """
+        Временные ряды для списка urls и суммарный ряд по всем URL в виде
+        словаря, пригодного для записи в json. В точном режиме нужен словарь
+        времен time_dict основной агрегации.
+        """
+
+        total = dict()
+        for by_label in self.get_buckets(time_dict).values():
+            for label, times in by_label.items():
+                if label not in total:
+                    total[label] = QuantileSketch(self.accuracy) if self.accuracy else array('d')
+                total[label] = self.merge_times(total[label], times)
+        by_url = self.get_buckets(time_dict, urls)
+        return {'unit': self.unit,
+                'accuracy': self.accuracy,
+                'total': self.get_rows(total),
+                'urls': {url: self.get_rows(by_url.get(url, dict())) for url in urls}}
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Нормализация URL запросов в шаблоны для уменьшения числа различных ключей
+при агрегации.
+"""
+
+import re
+import hashlib
+
+from sketches import DistinctCounter
+
+
+SEGMENT_RULES = [
+    ('uuid', re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE), '{uuid}'),
+    ('numeric', re.compile(r'^[0-9]+$'), '{id}'),
+    ('hex', re.compile(r'^(?=[a-f]*[0-9])[0-9a-f]{8,}$', re.IGNORECASE), '{hex}'),
+]
+RULES = ('query',) + tuple(name for name, _, _ in SEGMENT_RULES)
+RAW_CACHE_SIZE = 100000
+
+
+def get_url_hash(url):
+    """Стабильный между процессами и запусками 64-битный хеш URL"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8', 'surrogateescape'), digest_size=8).digest(), 'big')
+
+
+class UrlNormalizer:
+    """
+    Приводит URL к шаблону по правилам rules:
+        "query": отбрасывается строка запроса после "?"
+        "uuid": сегменты пути вида UUID заменяются на {uuid}
+        "numeric": числовые сегменты пути заменяются на {id}
+        "hex": шестнадцатеричные сегменты от 8 символов, содержащие цифру,
+               заменяются на {hex}
+    Суффикс протокола " HTTP/1.x" из поля request_url сохраняется.
+
+    Шаблоны хранятся в таблице names и идентифицируются номерами, поэтому
+    агрегация идет по целочисленным ключам. Номера шаблонов исходных URL
+    запоминаются в кэше на cache_size URL (переполненный кэш очищается),
+    так что повторные URL не нормализуются заново. Число свернутых в шаблон различных исходных URL
+    считается счетчиком DistinctCounter по хешам URL, поэтому объем памяти
+    не растет с числом различных исходных URL.
+    """
+
+    def __init__(self, rules=RULES, cache_size=RAW_CACHE_SIZE):
+        unknown = set(rules) - set(RULES)
+        if unknown:
+            raise ValueError('Неизвестные правила нормализации URL: {}'.format(', '.join(sorted(unknown))))
+        self.rules = list(rules)
+        self._segment_rules = [(pattern, placeholder) for name, pattern, placeholder in SEGMENT_RULES if name in rules]
+        self.names = list()
+        self.cache_size = cache_size
+        self._template_ids = dict()
+        self._raw_ids = dict()
+        self._variants = dict()
+
+    def normalize(self, url):
+        """Шаблон для URL без обращения к таблицам"""
+        path, space, protocol = url.rpartition(' ')
+        if not space:
+            path, protocol = url, ''
+        if 'query' in self.rules:
+            path = path.partition('?')[0]
+        if self._segment_rules:
+            segments = path.split('/')
+            for i, segment in enumerate(segments):
+                for pattern, placeholder in self._segment_rules:
+                    if pattern.match(segment):
+                        segments[i] = placeholder
+                        break
+            path = '/'.join(segments)
+        return path + space + protocol
+
+    def intern(self, template):
+        """Номер шаблона в таблице names, новый шаблон добавляется в конец"""
+        template_id = self._template_ids.get(template)
+        if template_id is None:
+            template_id = self._template_ids[template] = len(self.names)
+            self.names.append(template)
+        return template_id
+
+    def get_id(self, url):
+        """Номер шаблона для исходного URL"""
+        template_id = self._raw_ids.get(url)
+        if template_id is None:
+            template_id = self.intern(self.normalize(url))
+            counter = self._variants.get(template_id)
+            if counter is None:
+                counter = self._variants[template_id] = DistinctCounter()
+            counter.add(get_url_hash(url))
+            if len(self._raw_ids) >= self.cache_size:
+                self._raw_ids.clear()
+            self._raw_ids[url] = template_id
+        return template_id
+
+    def variants(self):
+        """Словарь {шаблон: счетчик DistinctCounter различных исходных URL}"""
+        return {self.names[template_id]: counter for template_id, counter in self._variants.items()}
+
+    def update(self, variants):
+        """Сливает счетчики различных исходных URL по шаблонам из variants"""
+        for template, counter in variants.items():
+            template_id = self.intern(template)
+            if template_id in self._variants:
+                self._variants[template_id].merge(counter)
+            else:
+                self._variants[template_id] = DistinctCounter().merge(counter)
+
+    def variants_to_dict(self):
+        """Представление счетчиков различных исходных URL для записи в json"""
+        return {template: counter.to_dict() for template, counter in self.variants().items()}
+
+    def update_from_dict(self, data):
+        """Сливает счетчики из представления variants_to_dict"""
+        self.update({template: DistinctCounter.from_dict(counter) for template, counter in data.items()})
+
+    def variant_counts(self):
+        """Словарь {шаблон: число различных исходных URL}"""
+        return {self.names[template_id]: counter.count() for template_id, counter in self._variants.items()}
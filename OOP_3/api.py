@@ -2,16 +2,27 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import sys
 import json
 import datetime
 import logging
 import hashlib
 import uuid
 import re
+import time
+import queue
+import socket
+import selectors
+import threading
+import functools
+import collections
 from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from scoring import get_score
-from scoring import get_interests
+from scoring import get_interests_bulk
+from cache import ResultCache, get_key, TTL as SCORE_TTL, SIZE as SCORE_CACHE_SIZE
+from store import Store, DEFAULT_PORT, TIMEOUT as STORE_TIMEOUT, RETRIES as STORE_RETRIES
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -20,12 +31,14 @@ OK = 200
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
+REQUEST_TOO_LARGE = 413
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
+    REQUEST_TOO_LARGE: "Request Entity Too Large",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
 }
@@ -37,6 +50,16 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
 }
+EMAIL_RE = re.compile(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)")
+# the same day and month forms as strptime with '%d.%m.%Y' accepts
+DATE_RE = re.compile(r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)")
+WORKERS = 8
+KEEPALIVE_TIMEOUT = 5
+BATCH_WORKERS = 8
+MAX_BATCH_ITEMS = 1000
+MAX_BODY_SIZE = 1 << 20
+score_cache = ResultCache(SCORE_TTL, SCORE_CACHE_SIZE)
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
 
 
 class Field:
@@ -67,24 +90,35 @@ class ArgumentsField(Field):
 
 class EmailField(Field):
     def validate(self, value):
-        return len(re.findall(r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)", value)) == 1
+        return EMAIL_RE.match(value) is not None
 
 
 class PhoneField(Field):
     def validate(self, value):
             try:
                 number = int(value)
-                if all([number >= 7 * 10**10, number < 8 * 10**10]):    
-                    return True
+                return 7 * 10**10 <= number < 8 * 10**10
             except:
                 return False
 
 
+@functools.lru_cache(maxsize=4096)
+def parse_date(value):
+    """ Date from a string dd.mm.yyyy, the same as strptime(value, '%d.%m.%Y') gives, or None """
+    found = DATE_RE.fullmatch(value)
+    if found is None:
+        return None
+    day, month, year = found.groups()
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
 class DateField(Field):
     def validate(self, value):
         try:
-            datetime.datetime.strptime(value, '%d.%m.%Y')
-            return True
+            return parse_date(value) is not None
         except:
             return False
 
@@ -92,8 +126,8 @@ class DateField(Field):
 class BirthDayField(DateField):
     def validate(self, value):
         try:
-            dt = datetime.datetime.strptime(value, '%d.%m.%Y')
-            return dt.year >= datetime.datetime.today().year - 70
+            dt = parse_date(value)
+            return dt is not None and dt.year >= datetime.date.today().year - 70
         except:
             return False
 
@@ -110,8 +144,14 @@ class ClientIDsField(Field):
         return False
 
 
+_MISSING = object()
+
+
 class ORMMeta(type):
-    """ Metaclass of our fields """
+    """ Metaclass of our fields. Builds the validation plan of a class once, when
+    the class is created: required field names, a validator for every field
+    and the field names in the order get_fields returns them. Fields are
+    stored in __slots__, so instances have no __dict__ """
     
     def __new__(self, class_name, bases, namespace):
         fields = {
@@ -123,6 +163,10 @@ class ORMMeta(type):
         for name in fields.keys():
             del new_namespace[name]
         new_namespace['_fields'] = fields
+        new_namespace['_required'] = tuple(name for name, field in fields.items() if field.required)
+        new_namespace['_validators'] = {name: field.validate for name, field in fields.items()}
+        new_namespace['_names'] = tuple(sorted(fields))
+        new_namespace.setdefault('__slots__', tuple(fields))
         return super().__new__(self, class_name, bases, new_namespace)
 
 
@@ -133,14 +177,18 @@ class ORMBase(metaclass=ORMMeta):
 
 
     def validate(self, kwargs):
-        _required = []
-        for name in self._fields.keys():
-            if self._fields[name].required and (name not in kwargs.keys()):
-                _required.append(name)
+        keys = kwargs.keys()
+        _required = [name for name in self._required if name not in keys]
         if _required:
             raise AttributeError('Additional fields are required to create class {}: {} '.format(self.__class__.__name__, ', '.join(_required)))
+        validators = self._validators
         for key, value in kwargs.items():
-            setattr(self, key, value)
+            validator = validators.get(key)
+            if validator is None:
+                raise AttributeError('Unknown field "{}" in class {}'.format(key, self.__class__.__name__))
+            if not validator(value):
+                raise AttributeError('Invalid value "{}" for field {} in class "{}"'.format(value, key, self.__class__.__name__))
+            object.__setattr__(self, key, value)
 
 
     def __setattr__(self, key, value):
@@ -154,11 +202,12 @@ class ORMBase(metaclass=ORMMeta):
             raise AttributeError('Unknown field "{}" in class {}'.format(key, self.__class__.__name__))
 
     def get_fields(self):
-        """ Collect to dictionary all field elements """
+        """ Collect to dictionary all field elements that are set, in the order of their names """
         new_dictionary = {}
-        allattrs = [name for name in dir(self) if name in self._fields.keys()]
-        for name in allattrs:
-            new_dictionary[name] = getattr(self, name)
+        for name in self._names:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                new_dictionary[name] = value
         return new_dictionary
 
 
@@ -214,6 +263,15 @@ def check_auth(request):
     return False
 
 
+def get_score_key(fields):
+    """ Cache key of online_score arguments. Missing and null fields are the same
+    for get_score, and so are a phone given as a number or as a string """
+    normalized = {name: value for name, value in fields.items() if value is not None}
+    if 'phone' in normalized:
+        normalized['phone'] = str(normalized['phone'])
+    return "score:" + get_key(normalized)
+
+
 def method_handler(request, ctx, store):
     response, code = {}, None
     request_body = request['body']
@@ -229,12 +287,13 @@ def method_handler(request, ctx, store):
             if  main_request.is_admin:
                 response = {"score": 42}
             else:
-                response = {"score": get_score(None, **method_request.get_fields())}    
+                fields = method_request.get_fields()
+                response = {"score": score_cache.get_or_compute(get_score_key(fields),
+                                                                lambda: get_score(store, **fields))}
         elif main_request.method == 'clients_interests':
             method_request = ClientsInterestsRequest(main_request.arguments)
             ctx['nclients'] = len(method_request.client_ids)
-            for id in method_request.client_ids:
-                response[id] = get_interests(None, id)
+            response = get_interests_bulk(store, method_request.client_ids)
         code = 200
         return response, code
     except AttributeError as e:
@@ -245,6 +304,14 @@ def method_handler(request, ctx, store):
 
 
 class MainHTTPHandler(BaseHTTPRequestHandler):
+    """ Handler with HTTP/1.1 keep-alive: idle connections are closed after timeout seconds.
+    A POST body may be a JSON array of requests (a batch): they are handled concurrently
+    in batch_executor, each on its own, and the response is an ordered array
+    of {"response", "code"} objects """
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    max_body_size = MAX_BODY_SIZE
+    max_batch_items = MAX_BATCH_ITEMS
     router = {
         "method": method_handler
     }
@@ -258,47 +325,256 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
+        data_string = None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            length = int(self.headers['Content-Length'])
+            if length > self.max_body_size:
+                code = REQUEST_TOO_LARGE
+                self.close_connection = True
+            else:
+                data_string = self.rfile.read(length)
+                request = json.loads(data_string)
         except:
             code = BAD_REQUEST
+            if data_string is None:
+                # the end of the unread body is unknown, so the connection can't be reused
+                self.close_connection = True
 
-        if request:
+        # an empty batch is still a batch: it gets an empty array, not an empty response
+        if isinstance(request, list) or request:
             path = self.path.strip("/")
             logging.info("%s: %s %s \n" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
+            if path in self.router and isinstance(request, list):
+                response, code = self.handle_batch(path, request, context)
+            elif path in self.router:
+                response, code = self.handle_request(path, request, context)
             else:
                 code = NOT_FOUND
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
         if code not in ERRORS:
             r = {"response": response, "code": code}
         else:
             r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
         context.update(r)
         logging.info(context)
-        self.wfile.write(json.dumps(r).encode())
+        self.send_json(code, r)
         return
 
+    def handle_request(self, path, request, context):
+        try:
+            return self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+        except Exception as e:
+            logging.exception("Unexpected error: %s" % e)
+            return {}, INTERNAL_ERROR
+
+    def handle_batch(self, path, requests, context):
+        if len(requests) > self.max_batch_items:
+            return "Batch of {} requests exceeds the limit of {}".format(len(requests), self.max_batch_items), \
+                REQUEST_TOO_LARGE
+        context["batch"] = len(requests)
+        futures = []
+        for i, request in enumerate(requests):
+            item_context = {"request_id": "{}.{}".format(context["request_id"], i)}
+            if isinstance(request, dict):
+                futures.append(batch_executor.submit(self.handle_request, path, request, item_context))
+            else:
+                futures.append(None)
+        items = []
+        for future in futures:
+            response, code = future.result() if future is not None else ({}, INVALID_REQUEST)
+            if code in ERRORS:
+                response = response or ERRORS.get(code)
+            items.append({"response": response, "code": code})
+        return items, OK
+
+    def do_GET(self):
+        """ Service counters: GET /stats """
+        if self.path.strip("/") == "stats":
+            code, r = OK, {"response": {"score_cache": score_cache.stats()}, "code": OK}
+        else:
+            code, r = NOT_FOUND, {"error": ERRORS[NOT_FOUND], "code": NOT_FOUND}
+        self.send_json(code, r)
+
+    def send_json(self, code, r):
+        body = json.dumps(r).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@functools.lru_cache(maxsize=None)
+def deferred_handler(handler_class):
+    """ Subclass of handler_class for ThreadPoolHTTPServer: constructing it runs
+    the handler's own __init__ and setup() but serves no request, the server
+    serves requests one at a time and closes the handler with close() """
+
+    class DeferredHandler(handler_class):
+        def handle(self):
+            pass  # requests are served by ThreadPoolHTTPServer
+
+        def finish(self):
+            pass  # deferred until the server closes the connection
+
+        def close(self):
+            handler_class.finish(self)
+
+    DeferredHandler.__name__ = DeferredHandler.__qualname__ = "Deferred" + handler_class.__name__
+    return DeferredHandler
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """ HTTPServer that serves requests in a fixed pool of worker threads.
+    Keep-alive connections wait for their next request in a selector watched
+    by one thread, so an idle client doesn't hold a worker: a connection is
+    handed to the pool only when it is readable, for one request at a time.
+    Connections idle for the handler timeout are closed """
+
+    def __init__(self, server_address, handler_class, workers=WORKERS):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.idle_timeout = handler_class.timeout or KEEPALIVE_TIMEOUT
+        self.idle = collections.OrderedDict()
+        self.returned = queue.SimpleQueue()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.watching = True
+        self.watcher = threading.Thread(target=self.watch_connections, daemon=True)
+        self.watcher.start()
+
+    def process_request(self, request, client_address):
+        handler = deferred_handler(self.RequestHandlerClass)(request, client_address, self)
+        self.wait_request(handler)
+
+    def handle_error(self, request, client_address):
+        """ A client dropping the connection is not a server error: log it
+        at debug level without a traceback """
+        error = sys.exc_info()[1]
+        if isinstance(error, ConnectionError):
+            logging.debug("Connection from %s:%s closed by the client: %s" % (client_address[0], client_address[1],
+                                                                              error))
+        else:
+            super().handle_error(request, client_address)
+
+    def process_request_thread(self, handler):
+        """ Serve one request of a readable connection in a worker """
+        try:
+            handler.close_connection = True
+            handler.handle_one_request()
+            keep_alive = not handler.close_connection
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+            keep_alive = False
+        if keep_alive:
+            self.wait_request(handler)
+        else:
+            self.close_handler(handler)
+
+    def wait_request(self, handler):
+        """ Pass the connection back to the selector, or straight to the pool
+        when the next request is already read into the handler buffer """
+        handler.connection.settimeout(0)
+        try:
+            buffered = handler.rfile.peek(1)
+        except OSError:
+            buffered = b""
+        finally:
+            handler.connection.settimeout(handler.timeout)
+        if buffered:
+            self.executor.submit(self.process_request_thread, handler)
+        elif not self.watching:
+            self.close_handler(handler)
+        else:
+            self.returned.put(handler)
+            self.wake_watcher()
+
+    def wake_watcher(self):
+        try:
+            self.wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass  # the watcher has unread wakeups already
+
+    def watch_connections(self):
+        while self.watching:
+            timeout = None
+            if self.idle:
+                timeout = max(0, next(iter(self.idle.values())) - time.monotonic())
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.wakeup_reader:
+                    self.wakeup_reader.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                del self.idle[key.data]
+                self.executor.submit(self.process_request_thread, key.data)
+            while not self.returned.empty():
+                handler = self.returned.get()
+                self.selector.register(handler.connection, selectors.EVENT_READ, handler)
+                self.idle[handler] = time.monotonic() + self.idle_timeout
+            now = time.monotonic()
+            while self.idle and next(iter(self.idle.values())) <= now:
+                handler, _ = self.idle.popitem(last=False)
+                self.selector.unregister(handler.connection)
+                self.close_handler(handler)
+
+    def close_handler(self, handler):
+        try:
+            handler.close()
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(handler.request)
+
+    def server_close(self):
+        super().server_close()
+        self.watching = False
+        self.wake_watcher()
+        self.watcher.join()
+        self.executor.shutdown(wait=True)
+        while not self.returned.empty():
+            self.idle[self.returned.get()] = None
+        for handler in self.idle:
+            self.close_handler(handler)
+        self.idle.clear()
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-w", "--workers", action="store", type=int, default=WORKERS)
+    op.add_option("-s", "--store", action="store", default=None, help="host[:port] of the key-value store")
+    op.add_option("--store-timeout", action="store", type=float, default=STORE_TIMEOUT)
+    op.add_option("--store-retries", action="store", type=int, default=STORE_RETRIES)
+    op.add_option("--score-ttl", action="store", type=float, default=SCORE_TTL)
+    op.add_option("--score-cache-size", action="store", type=int, default=SCORE_CACHE_SIZE)
+    op.add_option("--batch-workers", action="store", type=int, default=BATCH_WORKERS)
+    op.add_option("--max-batch-items", action="store", type=int, default=MAX_BATCH_ITEMS)
+    op.add_option("--max-body-size", action="store", type=int, default=MAX_BODY_SIZE)
     (opts, args) = op.parse_args()
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s \n', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+    score_cache = ResultCache(opts.score_ttl, opts.score_cache_size)
+    batch_executor = ThreadPoolExecutor(max_workers=opts.batch_workers)
+    MainHTTPHandler.max_batch_items = opts.max_batch_items
+    MainHTTPHandler.max_body_size = opts.max_body_size
+    if opts.store:
+        host, _, port = opts.store.partition(":")
+        # one pool for the whole process: handler threads share its connections
+        MainHTTPHandler.store = Store(host, int(port or DEFAULT_PORT), pool_size=opts.workers,
+                                      timeout=opts.store_timeout, retries=opts.store_retries)
+    server = ThreadPoolHTTPServer(("localhost", opts.port), MainHTTPHandler, opts.workers)
     logging.info("Starting server at %s" % opts.port)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
     server.server_close()
+    if MainHTTPHandler.store is not None:
+        MainHTTPHandler.store.close()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Latency of clients_interests lookups against the in-process stand-in store:
+one GET per client id versus get_interests_bulk (one MGET per chunk of ids).
+Every store command is answered after --delay seconds to model a network
+round trip.
+
+    python3 benchmarks/bench_interests.py --sizes 1,100,10000 --delay 0.0002
+"""
+
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from store import Store
+from scoring import get_interests, get_interests_bulk
+from fake_store import FakeStoreServer
+
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-s", "--sizes", action="store", default="1,100,10000")
+    op.add_option("-d", "--delay", action="store", type=float, default=0.0002)
+    op.add_option("-r", "--repeat", action="store", type=int, default=3)
+    (opts, args) = op.parse_args()
+    sizes = [int(size) for size in opts.sizes.split(",")]
+    server = FakeStoreServer(delay=opts.delay)
+    server.data.update({"i:%d" % cid: json.dumps(["cars", "books"]) for cid in range(0, max(sizes), 2)})
+    store = Store(*server.server_address)
+    try:
+        print('{:>8} {:>12} {:>12} {:>8}'.format('ids', 'per-id, ms', 'bulk, ms', 'speedup'))
+        for size in sizes:
+            cids = list(range(size))
+            loop = measure(lambda: {cid: get_interests(store, cid) for cid in cids}, opts.repeat)
+            bulk = measure(lambda: get_interests_bulk(store, cids), opts.repeat)
+            print('{:>8} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(size, loop * 1000, bulk * 1000, loop / bulk))
+    finally:
+        store.close()
+        server.stop()
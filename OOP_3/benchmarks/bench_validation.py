@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Validations per second of the request classes: MethodRequest with its
+arguments validated as OnlineScoreRequest or ClientsInterestsRequest, and
+field collection with get_fields.
+
+    python3 benchmarks/bench_validation.py --count 100000
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from api import MethodRequest, OnlineScoreRequest, ClientsInterestsRequest
+
+METHOD = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "x" * 128, "arguments": {}}
+SCORE = {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "a", "last_name": "b",
+         "birthday": "01.01.1990", "gender": 1}
+INTERESTS = {"client_ids": [1, 2, 3, 4], "date": "20.07.2017"}
+INVALID = {"phone": "79175002040", "email": "stupnikovotus.ru", "first_name": "a", "last_name": "b"}
+
+
+def validate_score():
+    MethodRequest(METHOD)
+    OnlineScoreRequest(SCORE).get_fields()
+
+
+def validate_interests():
+    MethodRequest(METHOD)
+    ClientsInterestsRequest(INTERESTS).get_fields()
+
+
+def validate_invalid():
+    try:
+        OnlineScoreRequest(INVALID)
+    except AttributeError:
+        pass
+
+
+def measure(function, count, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--count", action="store", type=int, default=100000)
+    op.add_option("-r", "--repeat", action="store", type=int, default=3)
+    (opts, args) = op.parse_args()
+    for name, function in (('online_score', validate_score), ('clients_interests', validate_interests),
+                           ('invalid email', validate_invalid)):
+        print('{:<18} {:>10.0f} validations/s'.format(name + ':', measure(function, opts.count, opts.repeat)))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import json
+import hashlib
+import threading
+import collections
+from concurrent.futures import Future
+
+TTL = 60
+SIZE = 10000
+
+
+def get_key(fields):
+    """ Stable hash of a dictionary of request fields: the same fields give the same key
+    in any order and in any process """
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """ In-process cache of computed results with a TTL and LRU eviction. Concurrent
+    calls of get_or_compute for the same missing key are coalesced: the first caller
+    computes the value and the others wait for its result (or its exception) """
+
+    def __init__(self, ttl=TTL, size=SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._items = collections.OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        owner = False
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] > self.clock():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._items[key]
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = Future()
+                self.misses += 1
+                owner = True
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+            self._items[key] = (self.clock() + self.ttl, value)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "size": len(self._items)}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import collections
+import socketserver
+
+from store import read_reply
+
+
+def encode_bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    value = value.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class FakeStoreHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.accepted += 1
+            drop = server.accepted <= server.drop_first
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            if drop:
+                return
+            time.sleep(server.delay)
+            name, args = command[0].upper(), command[1:]
+            with server.lock:
+                server.commands[name] += 1
+            if name == "GET":
+                reply = encode_bulk(server.data.get(args[0]))
+            elif name == "MGET":
+                reply = b"*%d\r\n" % len(args) + b"".join(encode_bulk(server.data.get(key)) for key in args)
+            elif name == "SET":
+                server.data[args[0]] = args[1]
+                reply = b"+OK\r\n"
+            else:
+                reply = b"-ERR unknown command\r\n"
+            try:
+                self.wfile.write(reply)
+            except OSError:
+                return
+
+
+class FakeStoreServer(socketserver.ThreadingTCPServer):
+    """ In-process stand-in for the key-value store: GET, MGET and SET of the redis protocol.
+    Every command is answered after delay seconds, the first drop_first connections
+    are closed without an answer """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0, drop_first=0):
+        super().__init__(("localhost", 0), FakeStoreHandler)
+        self.data = {}
+        self.delay = delay
+        self.drop_first = drop_first
+        self.accepted = 0
+        self.commands = collections.Counter()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
@@ -1,7 +1,18 @@
+import json
 import random
+import hashlib
 import logging
 
+SCORE_TTL = 60 * 60
+
+
 def get_score(store, phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+    key_parts = [phone, email, birthday, gender, first_name, last_name]
+    key = "uid:" + hashlib.md5(json.dumps(key_parts).encode('utf-8')).hexdigest()
+    if store is not None:
+        cached = store.cache_get(key)
+        if cached is not None:
+            return json.loads(cached)
     score = 0
     if phone:
         logging.info('first plus')
@@ -15,9 +26,24 @@ def get_score(store, phone=None, email=None, birthday=None, gender=None, first_n
     if first_name and last_name:
         logging.info('fourth plus')
         score += 0.5
+    if store is not None:
+        store.cache_set(key, json.dumps(score), SCORE_TTL)
     return score
 
 
 def get_interests(store, cid):
-    interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
-    return random.sample(interests, 2)
+    if store is None:
+        interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+        return random.sample(interests, 2)
+    r = store.get("i:%s" % cid)
+    return json.loads(r) if r else []
+
+
+def get_interests_bulk(store, cids):
+    """ Interests of clients cids: every distinct id is fetched once, all of them
+    with one multi-get per chunk of ids. Missing clients get an empty list """
+    unique = list(dict.fromkeys(cids))
+    if store is None:
+        return {cid: get_interests(None, cid) for cid in unique}
+    values = store.mget(["i:%s" % cid for cid in unique])
+    return {cid: json.loads(value) if value else [] for cid, value in zip(unique, values)}
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import socket
+import logging
+import threading
+import contextlib
+
+DEFAULT_PORT = 6379
+POOL_SIZE = 10
+TIMEOUT = 1.0
+RETRIES = 3
+BACKOFF = 0.05
+MGET_CHUNK = 1000
+
+
+class StoreError(Exception):
+    """ The store is unavailable or answered with an error """
+
+
+class ReplyError(StoreError):
+    """ The store answered with an error reply, retrying won't help """
+
+
+class Connection:
+    """ One socket to a store speaking the redis protocol (RESP) """
+
+    def __init__(self, host, port, timeout=TIMEOUT):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile('rb')
+
+    def execute(self, args, timeout=TIMEOUT):
+        """ Send one command and read its reply """
+        self.sock.settimeout(timeout)
+        self.sock.sendall(encode_command(args))
+        return read_reply(self.file)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def encode_command(args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def read_reply(file):
+    line = file.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Connection closed by the store')
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b'+':
+        return payload.decode('utf-8')
+    if prefix == b'-':
+        raise ReplyError(payload.decode('utf-8'))
+    if prefix == b':':
+        return int(payload)
+    if prefix == b'$':
+        size = int(payload)
+        if size < 0:
+            return None
+        data = file.read(size + 2)
+        if len(data) != size + 2:
+            raise ConnectionError('Connection closed by the store')
+        return data[:-2].decode('utf-8')
+    if prefix == b'*':
+        size = int(payload)
+        return None if size < 0 else [read_reply(file) for _ in range(size)]
+    raise StoreError('Unexpected reply from the store: {!r}'.format(line))
+
+
+class ConnectionPool:
+    """ Thread-safe pool of at most size connections. Connections are opened
+    lazily and returned to the pool after a successful call, a connection that
+    failed is closed instead """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, size=POOL_SIZE, timeout=TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.created = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise StoreError('No free connection to the store in {} s'.format(timeout))
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = Connection(self.host, self.port, timeout)
+                with self._lock:
+                    self.created += 1
+            try:
+                yield conn
+            except ReplyError:
+                self._idle.put(conn)
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Store:
+    """ Key-value store client with a connection pool, per-call timeouts and
+    bounded retries with exponential backoff. cache_get and cache_set are
+    best-effort: when the store is unavailable they return None and do nothing.
+    get raises StoreError, because its callers have no other source of data """
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 retries=RETRIES, backoff=BACKOFF):
+        self.pool = ConnectionPool(host, port, pool_size, timeout)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def execute(self, *args, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(self.retries + 1):
+            try:
+                with self.pool.connection(timeout) as conn:
+                    return conn.execute(args, timeout)
+            except ReplyError:
+                raise
+            except (OSError, StoreError) as e:
+                if attempt == self.retries:
+                    raise StoreError('Store {}:{} is unavailable: {}'.format(self.pool.host, self.pool.port, e))
+                logging.warning('Store call %s failed (%s), retry %d', args[0], e, attempt + 1)
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def get(self, key, timeout=None):
+        return self.execute('GET', key, timeout=timeout)
+
+    def mget(self, keys, timeout=None, chunk_size=MGET_CHUNK):
+        """ Values of keys (None for missing ones) with one MGET round trip
+        per chunk_size keys """
+        values = []
+        for start in range(0, len(keys), chunk_size):
+            values.extend(self.execute('MGET', *keys[start:start + chunk_size], timeout=timeout))
+        return values
+
+    def cache_get(self, key, timeout=None):
+        try:
+            return self.execute('GET', key, timeout=timeout)
+        except StoreError as e:
+            logging.warning('Cache get of %s failed: %s', key, e)
+            return None
+
+    def cache_set(self, key, value, expire, timeout=None):
+        try:
+            self.execute('SET', key, value, 'EX', int(expire), timeout=timeout)
+        except StoreError as e:
+            logging.warning('Cache set of %s failed: %s', key, e)
+
+    def close(self):
+        self.pool.close()
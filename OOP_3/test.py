@@ -1,9 +1,20 @@
+import io
 import hashlib
 import datetime
+import contextlib
 import functools
 import unittest
+import json
+import time
+import socket
+import threading
+import http.client
 
 import api
+import store
+import cache
+import fake_store
+import scoring
 
 
 def cases(cases):
@@ -17,14 +28,28 @@ def cases(cases):
     return decorator
 
 
-class TestSuite(unittest.TestCase):
+class ScoreCacheTestCase(unittest.TestCase):
+    """ Every test gets its own empty api.score_cache, so scores cached by one test
+    don't turn into hits in another """
+
+    def setUp(self):
+        self.saved_score_cache = api.score_cache
+        api.score_cache = cache.ResultCache()
+
+    def tearDown(self):
+        api.score_cache = self.saved_score_cache
+
+
+class TestSuite(ScoreCacheTestCase):
     def setUp(self):
+        super().setUp()
         self.context = {}
         self.headers = {}
         self.settings = {}
+        self.store = None
 
     def get_response(self, request):
-        return api.method_handler({"body": request, "headers": self.headers}, self.context, self.settings)
+        return api.method_handler({"body": request, "headers": self.headers}, self.context, self.store)
 
     def set_valid_auth(self, request):
         if request.get("login") == api.ADMIN_LOGIN:
@@ -138,5 +163,433 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
 
+def valid_request(**arguments):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+    request["token"] = hashlib.sha512((request["account"] + request["login"] + api.SALT).encode()).hexdigest()
+    return request
+
+
+def slow_handler(request, ctx, store):
+    time.sleep(0.3)
+    return api.method_handler(request, ctx, store)
+
+
+class SlowHandler(api.MainHTTPHandler):
+    router = {"method": slow_handler}
+
+
+class InitHandler(api.MainHTTPHandler):
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.requests_served = 0
+        self.instances.append(self)
+        super().__init__(*args, **kwargs)
+
+    def do_POST(self):
+        self.requests_served += 1
+        super().do_POST()
+
+
+class TestServer(ScoreCacheTestCase):
+    handler = api.MainHTTPHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server = api.ThreadPoolHTTPServer(("localhost", 0), self.handler, workers=4)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super().tearDown()
+
+    def connect(self):
+        return http.client.HTTPConnection(*self.server.server_address, timeout=5)
+
+    def post(self, connection, body, path="/method/"):
+        connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_keep_alive(self):
+        """ Several requests on one connection get the same answers as method_handler """
+        connection = self.connect()
+        requests = [valid_request(phone="79175002040", email="stupnikov@otus.ru", first_name="a", last_name="b"),
+                    valid_request(first_name="a"),
+                    dict(valid_request(first_name="a", last_name="b"), token="bad")]
+        sock = None
+        self.assertEqual(self.post(connection, json.dumps(requests[0]))[0], api.OK)
+        for request in requests:
+            response, code = api.method_handler({"body": request, "headers": {}}, {}, None)
+            status, body = self.post(connection, json.dumps(request))
+            self.assertEqual(status, code)
+            key = "error" if code in api.ERRORS else "response"
+            self.assertEqual(body, {key: response or api.ERRORS[code], "code": code})
+            sock = sock or connection.sock
+            self.assertIs(connection.sock, sock)
+        self.assertEqual(self.post(connection, "[1, 2", "/method/"), (api.BAD_REQUEST, {
+            "error": "Bad Request", "code": api.BAD_REQUEST}))
+        self.assertEqual(self.post(connection, json.dumps(requests[0]), "/unknown/"), (api.NOT_FOUND, {
+            "error": "Not Found", "code": api.NOT_FOUND}))
+        self.assertIs(connection.sock, sock)
+        connection.request("GET", "/stats")
+        response = connection.getresponse()
+        self.assertEqual(set(json.loads(response.read())["response"]["score_cache"]),
+                         {"hits", "misses", "coalesced", "size"})
+        connection.close()
+
+    def test_missing_length(self):
+        """ Without Content-Length the body can't be skipped, so the connection is closed """
+        with socket.create_connection(self.server.server_address, timeout=5) as sock:
+            sock.sendall(b"POST /method/ HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            data = b""
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        self.assertTrue(data.startswith(b"HTTP/1.1 400"))
+        self.assertTrue(data.endswith(json.dumps({"error": "Bad Request", "code": api.BAD_REQUEST}).encode()))
+
+    def test_batch(self):
+        """ Each item of a batch is authenticated and validated on its own, answers keep the order """
+        requests = [valid_request(first_name="a", last_name="b"),
+                    dict(valid_request(first_name="a", last_name="b"), token="bad"),
+                    valid_request(first_name="a"),
+                    5]
+        connection = self.connect()
+        status, body = self.post(connection, json.dumps(requests))
+        self.assertEqual(status, api.OK)
+        self.assertEqual(body, {"code": api.OK, "response": [
+            {"response": {"score": 0.5}, "code": api.OK},
+            {"response": "Forbidden", "code": api.FORBIDDEN},
+            {"response": api.method_handler({"body": requests[2], "headers": {}}, {}, None)[0],
+             "code": api.INVALID_REQUEST},
+            {"response": "Invalid Request", "code": api.INVALID_REQUEST}]})
+        self.assertEqual(self.post(connection, "[]"), (api.OK, {"response": [], "code": api.OK}))
+        connection.close()
+
+    def test_limits(self):
+        """ Too many batch items or too large a body are rejected with 413 """
+        self.server.RequestHandlerClass = type("LimitedHandler", (self.handler,), {
+            "max_batch_items": 2, "max_body_size": 1000})
+        connection = self.connect()
+        status, body = self.post(connection, json.dumps([valid_request(first_name="a", last_name="b")] * 3))
+        self.assertEqual((status, body["code"]), (api.REQUEST_TOO_LARGE, api.REQUEST_TOO_LARGE))
+        self.assertEqual(self.post(connection, json.dumps([valid_request(first_name="a", last_name="b")] * 2))[0],
+                         api.OK)
+        status, body = self.post(connection, json.dumps([{"padding": "x" * 1000}]))
+        self.assertEqual(body, {"error": "Request Entity Too Large", "code": api.REQUEST_TOO_LARGE})
+        self.assertIsNone(connection.sock)
+        connection.close()
+
+    def test_idle_connections(self):
+        """ Idle keep-alive clients don't hold workers: with more of them than workers
+        a new client is still served at once """
+        body = json.dumps(valid_request(first_name="a", last_name="b"))
+        idle = [self.connect() for _ in range(6)]
+        for connection in idle:
+            self.assertEqual(self.post(connection, body)[0], api.OK)
+        started = time.time()
+        connection = self.connect()
+        self.assertEqual(self.post(connection, body)[0], api.OK)
+        self.assertLess(time.time() - started, 1)
+        connection.close()
+        for connection in idle:
+            sock = connection.sock
+            self.assertEqual(self.post(connection, body)[0], api.OK)
+            self.assertIs(connection.sock, sock)
+            connection.close()
+
+    def test_handler_init(self):
+        """ The server constructs handlers through their own __init__ """
+        InitHandler.instances.clear()
+        self.server.RequestHandlerClass = InitHandler
+        connection = self.connect()
+        body = json.dumps(valid_request(first_name="a", last_name="b"))
+        self.assertEqual(self.post(connection, body)[0], api.OK)
+        self.assertEqual(self.post(connection, body)[0], api.OK)
+        connection.close()
+        self.assertEqual([handler.requests_served for handler in InitHandler.instances], [2])
+
+    def test_client_disconnect(self):
+        """ A dropped client connection is logged at debug level without a traceback """
+        stderr = io.StringIO()
+        with self.assertLogs(level="DEBUG") as logs, contextlib.redirect_stderr(stderr):
+            try:
+                raise BrokenPipeError(32, "Broken pipe")
+            except BrokenPipeError:
+                self.server.handle_error(None, ("127.0.0.1", 5000))
+        self.assertEqual(stderr.getvalue(), "")
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].levelname, "DEBUG")
+        self.assertIsNone(logs.records[0].exc_info)
+
+    def test_idle_timeout(self):
+        """ A connection idle for the keep-alive timeout is closed by the server """
+        self.server.idle_timeout = 0.2
+        connection = self.connect()
+        self.assertEqual(self.post(connection, json.dumps(valid_request(first_name="a", last_name="b")))[0],
+                         api.OK)
+        started = time.time()
+        self.assertEqual(connection.sock.recv(1), b"")
+        self.assertLess(time.time() - started, 1)
+        connection.close()
+
+
+class TestConcurrentServer(TestServer):
+    handler = SlowHandler
+
+    def test_concurrent_clients(self):
+        """ Slow calls and a stalled client don't block the other clients """
+        stalled = socket.create_connection(self.server.server_address, timeout=5)
+        stalled.sendall(b"POST /method/ HTTP/1.1\r\nContent-Length: 100\r\n\r\n{")
+        results = []
+
+        def client():
+            connection = self.connect()
+            results.append(self.post(connection, json.dumps(valid_request(first_name="a", last_name="b"))))
+            connection.close()
+
+        started = time.time()
+        threads = [threading.Thread(target=client) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.time() - started, 0.8)
+        self.assertEqual(results, [(api.OK, {"response": {"score": 0.5}, "code": api.OK})] * 3)
+        stalled.close()
+
+    def test_concurrent_batch(self):
+        """ Items of a batch run concurrently """
+        connection = self.connect()
+        started = time.time()
+        status, body = self.post(connection, json.dumps([valid_request(first_name="a", last_name="b")] * 4))
+        self.assertLess(time.time() - started, 0.8)
+        self.assertEqual(body["response"], [{"response": {"score": 0.5}, "code": api.OK}] * 4)
+        connection.close()
+
+
+class TestStore(ScoreCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = fake_store.FakeStoreServer()
+        self.store = store.Store(*self.server.server_address, pool_size=4, timeout=0.5, retries=2, backoff=0.01)
+
+    def tearDown(self):
+        self.store.close()
+        self.server.stop()
+        super().tearDown()
+
+    def test_operations(self):
+        self.assertIsNone(self.store.get("i:1"))
+        self.store.cache_set("i:1", '["cars", "pets"]', 60)
+        self.assertEqual(self.store.cache_get("i:1"), '["cars", "pets"]')
+        self.assertEqual(self.store.get("i:1"), '["cars", "pets"]')
+        self.assertRaises(store.ReplyError, self.store.execute, "FLUSHALL")
+        self.assertEqual(self.store.get("i:1"), '["cars", "pets"]')
+        self.assertEqual(self.server.accepted, 1)
+
+    def test_pooled_handlers(self):
+        """ Requests from many handler threads reuse a few pooled connections """
+        self.server.data.update({"i:%d" % i: json.dumps(["books", str(i)]) for i in range(20)})
+        results = []
+
+        def call():
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                       "arguments": {"client_ids": list(range(20))}}
+            request["token"] = valid_request()["token"]
+            results.append(api.method_handler({"body": request, "headers": {}}, {}, self.store))
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expected = {i: ["books", str(i)] for i in range(20)}
+        self.assertEqual(results, [(expected, api.OK)] * 8)
+        self.assertLessEqual(self.server.accepted, 4)
+        self.assertEqual(self.store.pool.created, self.server.accepted)
+        self.assertEqual(dict(self.server.commands), {"MGET": 8})
+
+    def test_mget(self):
+        """ Repeated ids are fetched once, large lists in chunks, misses get empty lists """
+        self.server.data.update({"i:%d" % i: json.dumps(["tv", str(i)]) for i in range(5)})
+        keys = ["i:%d" % i for i in range(7)]
+        self.assertEqual(self.store.mget(keys, chunk_size=3), self.store.mget(keys))
+        self.assertEqual(self.store.mget(keys)[4:], ['["tv", "4"]', None, None])
+        self.assertEqual(self.server.commands["MGET"], 5)
+        self.assertEqual(self.store.mget([]), [])
+        self.assertEqual(self.server.commands["MGET"], 5)
+        self.assertEqual(scoring.get_interests_bulk(self.store, [1, 6, 1, 1]), {1: ["tv", "1"], 6: []})
+        self.assertEqual(self.server.commands["MGET"], 6)
+        self.assertEqual(sorted(scoring.get_interests_bulk(None, [1, 2, 1])), [1, 2])
+
+    def test_score_cache(self):
+        arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "a", "last_name": "b"}
+        self.assertEqual(api.get_score(self.store, **arguments), 3.5)
+        self.assertEqual(len(self.server.data), 1)
+        self.server.data[next(iter(self.server.data))] = "1.5"
+        self.assertEqual(api.get_score(self.store, **arguments), 1.5)
+
+    def test_retry(self):
+        """ A dropped connection is replaced and the call retried """
+        self.server.drop_first = 2
+        self.server.data["i:1"] = "[]"
+        self.assertEqual(self.store.get("i:1"), "[]")
+        self.assertEqual(self.server.accepted, 3)
+
+    def test_timeout(self):
+        """ A slow store fails after the per-call timeout and the retries """
+        self.server.delay = 0.3
+        started = time.time()
+        self.assertRaises(store.StoreError, self.store.get, "i:1", timeout=0.05)
+        self.assertLess(time.time() - started, 0.5)
+        self.assertIsNone(self.store.get("i:1", timeout=1.0))
+
+    def test_unavailable(self):
+        """ Without the store scores are still computed, interests fail with 500 """
+        self.server.stop()
+        self.assertIsNone(self.store.cache_get("uid:1"))
+        self.store.cache_set("uid:1", "1", 60)
+        self.assertRaises(store.StoreError, self.store.get, "i:1")
+        request = valid_request(phone="79175002040", email="stupnikov@otus.ru", first_name="a", last_name="b")
+        self.assertEqual(api.method_handler({"body": request, "headers": {}}, {}, self.store),
+                         ({"score": 3.5}, api.OK))
+        self.assertEqual((api.score_cache.hits, api.score_cache.misses), (0, 1))
+
+        api_server = api.ThreadPoolHTTPServer(("localhost", 0), api.MainHTTPHandler, workers=2)
+        api_server.RequestHandlerClass = type("StoreHandler", (api.MainHTTPHandler,), {"store": self.store})
+        thread = threading.Thread(target=api_server.serve_forever)
+        thread.start()
+        try:
+            connection = http.client.HTTPConnection(*api_server.server_address, timeout=5)
+            request = dict(request, method="clients_interests", arguments={"client_ids": [1]})
+            connection.request("POST", "/method/", body=json.dumps(request))
+            response = connection.getresponse()
+            self.assertEqual((response.status, json.loads(response.read())),
+                             (api.INTERNAL_ERROR, {"error": "Internal Server Error", "code": api.INTERNAL_ERROR}))
+            connection.close()
+        finally:
+            api_server.shutdown()
+            api_server.server_close()
+            thread.join()
+
+
+class TestResultCache(ScoreCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = [0.0]
+        self.cache = cache.ResultCache(ttl=10, size=2, clock=lambda: self.now[0])
+
+    def test_ttl_and_lru(self):
+        self.assertEqual(self.cache.get_or_compute("a", lambda: 1), 1)
+        self.assertEqual(self.cache.get_or_compute("a", lambda: 2), 1)
+        self.now[0] = 10
+        self.assertEqual(self.cache.get_or_compute("a", lambda: 3), 3)
+        self.cache.get_or_compute("b", lambda: 4)
+        self.cache.get_or_compute("a", lambda: 5)
+        self.cache.get_or_compute("c", lambda: 6)
+        self.assertEqual(self.cache.get_or_compute("a", lambda: 7), 3)
+        self.assertEqual(self.cache.get_or_compute("b", lambda: 8), 8)
+        self.assertEqual(self.cache.stats(), {"hits": 3, "misses": 5, "coalesced": 0, "size": 2})
+
+    def test_coalescing(self):
+        """ Concurrent callers of a missing key wait for one computation """
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return len(calls)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_compute("k", compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while self.cache.stats()["coalesced"] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((calls, results), ([1], [1] * 5))
+        self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 1, "coalesced": 4, "size": 1})
+
+    def test_error(self):
+        """ An error reaches the waiting callers and is not cached """
+        def fail():
+            raise store.StoreError("down")
+
+        self.assertRaises(store.StoreError, self.cache.get_or_compute, "k", fail)
+        self.assertEqual(self.cache.get_or_compute("k", lambda: 1), 1)
+
+    def test_score_key(self):
+        arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "a", "last_name": "b"}
+        key = api.get_score_key(arguments)
+        self.assertEqual(api.get_score_key(dict(reversed(list(arguments.items())), phone=79175002040, gender=None)),
+                         key)
+        self.assertNotEqual(api.get_score_key(dict(arguments, email="other@otus.ru")), key)
+
+    def test_handler(self):
+        """ online_score answers repeated arguments from the cache """
+        request = valid_request(phone=79175002040, email="stupnikov@otus.ru", first_name="a", last_name="b")
+        self.assertEqual(api.method_handler({"body": request, "headers": {}}, {}, None), ({"score": 3.5}, api.OK))
+        self.assertEqual((api.score_cache.hits, api.score_cache.misses), (0, 1))
+        request = valid_request(last_name="b", first_name="a", email="stupnikov@otus.ru", phone="79175002040")
+        self.assertEqual(api.method_handler({"body": request, "headers": {}}, {}, None), ({"score": 3.5}, api.OK))
+        self.assertEqual((api.score_cache.hits, api.score_cache.misses), (1, 1))
+
+
+class TestValidationPlan(unittest.TestCase):
+    def test_plan(self):
+        """ The plan is built with the class, instances are slotted """
+        self.assertEqual(api.OnlineScoreRequest._required, ("first_name", "last_name"))
+        self.assertEqual(api.MethodRequest._names, ("account", "arguments", "login", "method", "token"))
+        request = api.OnlineScoreRequest({"phone": 79175002040, "last_name": "b", "first_name": "a"})
+        self.assertFalse(hasattr(request, "__dict__"))
+        self.assertEqual(list(request.get_fields().items()),
+                         [("first_name", "a"), ("last_name", "b"), ("phone", 79175002040)])
+        self.assertRaises(AttributeError, getattr, request, "email")
+
+    def test_messages(self):
+        """ Error messages are the same as before the plans """
+        cases = [
+            ({"phone": "79175002040"}, "There are not any pairs in arguments: phone-email, name-last_name, "
+                                       "gender-birthday"),
+            ({"phone": "79175002040", "email": "a@b.c"},
+             "Additional fields are required to create class OnlineScoreRequest: first_name, last_name "),
+            ({"first_name": "a", "last_name": "b", "email": "ab.c"},
+             'Invalid value "ab.c" for field email in class "OnlineScoreRequest"'),
+            ({"first_name": "a", "last_name": "b", "age": 1}, 'Unknown field "age" in class OnlineScoreRequest'),
+        ]
+        for arguments, message in cases:
+            with self.assertRaises(AttributeError) as raised:
+                api.OnlineScoreRequest(arguments)
+            self.assertEqual(raised.exception.args[0], message)
+        with self.assertRaises(AttributeError) as raised:
+            api.MethodRequest(5)
+        self.assertEqual(raised.exception.args[0], "'int' object has no attribute 'keys'")
+
+    def test_parse_date(self):
+        """ parse_date accepts the same strings as strptime with '%d.%m.%Y' """
+        values = ["01.01.2000", "1.1.2000", " 1.01.2000", "31.02.2000", "29.02.2000", "29.02.2001", "00.01.2000",
+                  "01.13.2000", "01.01.200", "01.01.20000", "01.01.0000", "1.1.2000 ", "XXX", "", "31.12.9999",
+                  "\u0661.01.2000"]
+        for value in values:
+            try:
+                expected = datetime.datetime.strptime(value, "%d.%m.%Y").date()
+            except ValueError:
+                expected = None
+            self.assertEqual(api.parse_date(value), expected, value)
+        self.assertFalse(api.DateField().validate(5))
+        self.assertFalse(api.BirthDayField().validate(["01.01.2000"]))
+
+
 if __name__ == "__main__":
     unittest.main()